@@ -0,0 +1,63 @@
+import json
+import threading
+
+from psycopg2.extras import DictCursor
+
+from pg_notify import NotificationService
+from main2 import ROS_NODES_ERROR_RECORD, ACTIVE_FAULTS_CHANNEL
+
+
+class ActiveFaultSet(NotificationService):
+    ''' In process mirror of the open rows of ros_nodes_error_record, keyed by (node_type, node_name).
+    is_faulted() and friends answer from memory, the NOTIFY payloads of every open / close / delete keep the
+    mirror in sync and the open rows are reloaded after every (re)connect of the LISTEN session.
+    They answer None while the mirror is stale (not loaded, session lost or the last reload failed)
+
+        faults = ActiveFaultSet(testing._pool, testing._conn_str).start()
+        if faults.is_faulted(): ...
+    '''
+    def __init__(self, pool, conn_str, listen_timeout_sec=5.0) -> None:
+        self._pool = pool
+        self._lock = threading.Lock()
+        # (node_type, node_name) -> ids of the open error rows of that node
+        self._active = {}
+        super().__init__(conn_str, [ACTIVE_FAULTS_CHANNEL], "active_fault_set", listen_timeout_sec)
+
+    def _reload(self):
+        with self._pool.connection(autocommit=True) as _conn:
+            with _conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(f"""
+                    SELECT id, node_type, node_name FROM {ROS_NODES_ERROR_RECORD} WHERE error_end_time IS NULL;
+                """)
+                _rows = cur.fetchall()
+        _active = {}
+        for _row in _rows:
+            _active.setdefault((_row["node_type"], _row["node_name"]), set()).add(_row["id"])
+        with self._lock:
+            self._active = _active
+
+    def _handle(self, _notify):
+        _event = json.loads(_notify.payload)
+        _key = (_event["node_type"], _event["node_name"])
+        with self._lock:
+            if _event["is_open"]:
+                self._active.setdefault(_key, set()).add(_event["id"])
+            else:
+                _ids = self._active.get(_key, set())
+                _ids.discard(_event["id"])
+                if not _ids:
+                    self._active.pop(_key, None)
+
+    def is_faulted(self):
+        ''' True when at least one fault is open on any node, None when unknown '''
+        with self._lock:
+            return None if self.is_stale() else bool(self._active)
+
+    def is_node_faulted(self, _node_type, _node_name):
+        with self._lock:
+            return None if self.is_stale() else (_node_type, _node_name) in self._active
+
+    def active(self):
+        ''' the (node_type, node_name) pairs with an open fault, None when unknown '''
+        with self._lock:
+            return None if self.is_stale() else set(self._active)
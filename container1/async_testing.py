@@ -0,0 +1,114 @@
+''' asyncio data access, needs aiopg which the aii-python3 image does not ship: pip install aiopg '''
+import asyncio
+import logging
+
+from psycopg2 import Error
+from psycopg2.extras import DictCursor
+
+try:
+    import aiopg
+except ImportError:
+    # only the asyncio callers need it, main2 and the threaded services import without it
+    aiopg = None
+
+from main2 import (
+    MACHINE_REGISTRATION_RECORD,
+    MACHINE_DISABLE_ENABLE_RECORD,
+    REMOTE_CONTROL_RECORD,
+    DB_POOL_MIN_CONN,
+    DB_POOL_MAX_CONN,
+    INSERT_MACHINE_REGISTRATION_DATA_SQL,
+    INSERT_MACHINE_DISABLE_ENABLE_DATA_SQL,
+    INSERT_MACHINE_REMOTE_CONTROL_DATA_SQL,
+    SUBMIT_COMMAND_SQL,
+)
+
+
+class AsyncTesting:
+    ''' asyncio version of the Testing data access helpers for callers that run an event loop (ROS / cloud bridge).
+    Every call awaits a connection from an aiopg pool instead of blocking the loop.
+    aiopg connections always run in autocommit mode, which is fine as every helper is a single statement.
+
+        async with AsyncTesting(testing._conn_str) as db:
+            await db.insert_machine_disable_enable_data(False, "FACTORY001", "user001", 2)
+    '''
+    def __init__(self, conn_str, minsize=DB_POOL_MIN_CONN, maxsize=DB_POOL_MAX_CONN) -> None:
+        self._conn_str = conn_str
+        self._minsize = minsize
+        self._maxsize = maxsize
+        self._pool = None
+
+    async def open(self):
+        if aiopg is None:
+            raise RuntimeError("AsyncTesting needs aiopg, install it with pip install aiopg")
+        self._pool = await aiopg.create_pool(self._conn_str, minsize=self._minsize, maxsize=self._maxsize)
+        return self
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _insert_returning_id(self, _sql, _params, _table_name):
+        async with self._pool.acquire() as _conn:
+            async with _conn.cursor(cursor_factory=DictCursor) as cur:
+                await cur.execute(_sql, _params)
+                _new_id = (await cur.fetchone())["id"]
+        logging.info(f"new row with id - {_new_id} insert to table {_table_name}")
+        return _new_id
+
+    async def insert_machine_registration_data(self, _is_registered, _factory_id, _factory_name, _registered_by_id, registered_source_id):
+        return await self._insert_returning_id(
+            INSERT_MACHINE_REGISTRATION_DATA_SQL,
+            (_is_registered, _registered_by_id, registered_source_id, _factory_id, _factory_name, 1),
+            MACHINE_REGISTRATION_RECORD
+        )
+
+    async def insert_machine_disable_enable_data(self, _is_disable, _factory_id, _disabled_by_id, disabled_source_id):
+        return await self._insert_returning_id(
+            INSERT_MACHINE_DISABLE_ENABLE_DATA_SQL,
+            (_is_disable, _disabled_by_id, disabled_source_id, _factory_id, 1),
+            MACHINE_DISABLE_ENABLE_RECORD
+        )
+
+    async def insert_machine_remote_control_data(self, _is_remote, _requested_time_minute, _factory_id, _requested_by_id, _requested_source_id):
+        return await self._insert_returning_id(
+            INSERT_MACHINE_REMOTE_CONTROL_DATA_SQL,
+            (_is_remote, _requested_time_minute, _requested_by_id, _requested_source_id, _factory_id, 1),
+            REMOTE_CONTROL_RECORD
+        )
+
+    async def submit_command(self, _source, _command_str, _remote_id=None, _requester_id=None):
+        ''' asyncio version of Testing._submit_command, the insert and the arbitration are the one statement
+        (submit_command()) so autocommit is fine. Return {"decision", "reason_code", "record_id", "current_record_id"} '''
+        try:
+            async with self._pool.acquire() as _conn:
+                async with _conn.cursor(cursor_factory=DictCursor) as cur:
+                    await cur.execute(SUBMIT_COMMAND_SQL, (_source, _command_str, _remote_id, _requester_id))
+                    _result = dict(await cur.fetchone())
+            logging.info(f"command {_command_str} from {_source} - {_result['decision']} ({_result['reason_code']})")
+            return _result
+        except Error as e:
+            logging.error(f"(f) submit_command - Error submitting command : {e}")
+
+    async def fetchone_from_current_type_table(self, _table_name):
+        try:
+            async with self._pool.acquire() as _conn:
+                async with _conn.cursor(cursor_factory=DictCursor) as cur:
+                    await cur.execute(f"SELECT * FROM {_table_name};")
+                    return await cur.fetchone()
+        except Error as e:
+            logging.error(f"(f) fetchone_from_current_type_table - an error occure : {e}")
+
+    async def run_many(self, _coroutines):
+        ''' Run many helper calls at once, e.g. run_many([db.insert_...(...) for _ in range(100)]).
+        The pool maxsize bounds how many of them are on the database at the same time.
+        Failed calls come back as exception objects in the result list instead of cancelling the others '''
+        return await asyncio.gather(*_coroutines, return_exceptions=True)
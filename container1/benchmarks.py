@@ -0,0 +1,275 @@
+''' Benchmarks for the container1 data access layer.
+They write a lot of rows, so they run against their own scratch database (BENCHMARK_DB_NAME)
+
+    python benchmarks.py                     # every benchmark
+    python benchmarks.py async_vs_sync       # only the named ones
+'''
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+
+from main2 import (
+    Testing,
+    COMMANDS_RECORD,
+    PANEL_SELECTIONS_RECORD,
+    SELF_URGENT_STOP_COMMANDS_RECORD,
+    PANEL_SELECTIONS_RECORD_BEFORE_INSERTED_TRIGGER,
+    SELF_URGENT_STOP_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER,
+    CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD,
+    CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD_ORIG,
+    check_before_insert_procedure_name,
+)
+from panel_jobs import PanelSelectionJobWorker
+from psycopg2.extras import execute_values
+from async_testing import AsyncTesting
+
+BENCHMARK_DB_NAME = os.getenv("BENCHMARK_DB_NAME", "aii_sortermachine_bench")
+BENCHMARK_PRODUCERS = [int(_n) for _n in os.getenv("BENCHMARK_PRODUCERS", "1,10,100").split(",")]
+BENCHMARK_INSERTS_PER_PRODUCER = int(os.getenv("BENCHMARK_INSERTS_PER_PRODUCER", 20))
+BENCHMARK_HISTORY_SIZES = [int(_n) for _n in os.getenv("BENCHMARK_HISTORY_SIZES", "1000,100000,1000000").split(",")]
+BENCHMARK_SAMPLES = int(os.getenv("BENCHMARK_SAMPLES", 200))
+BENCHMARK_REPLAY_ROWS = int(os.getenv("BENCHMARK_REPLAY_ROWS", 100000))
+# the row by row replay is slow, it runs on a slice and is compared in rows per second
+BENCHMARK_REPLAY_ROW_PATH_ROWS = int(os.getenv("BENCHMARK_REPLAY_ROW_PATH_ROWS", 10000))
+
+
+def _percentile(_values, _pct):
+    _sorted = sorted(_values)
+    return _sorted[min(len(_sorted) - 1, int(round(_pct / 100 * (len(_sorted) - 1))))]
+
+
+def _summary(_name, _elapsed_sec, _latencies_sec):
+    return {
+        "name": _name,
+        "calls": len(_latencies_sec),
+        "elapsed_sec": round(_elapsed_sec, 4),
+        "calls_per_sec": round(len(_latencies_sec) / _elapsed_sec, 1) if _elapsed_sec else None,
+        "p50_ms": round(_percentile(_latencies_sec, 50) * 1000, 3),
+        "p95_ms": round(_percentile(_latencies_sec, 95) * 1000, 3),
+    }
+
+
+def prepare_benchmark_testing():
+    testing = Testing(BENCHMARK_DB_NAME)
+    with testing._pool.connection(autocommit=True) as _conn:
+        testing._insert_default_valid_types(_conn)
+        testing._set_default_tables_row(_conn)
+    logging.getLogger().setLevel(logging.WARNING)
+    return testing
+
+
+def _sync_inserts(testing, _producers, _inserts_per_producer):
+    _latencies = []
+    _lock = threading.Lock()
+
+    def _producer():
+        _local = []
+        for _ in range(_inserts_per_producer):
+            _t = time.perf_counter()
+            testing._insert_machine_disable_enable_data(False, "FACTORY001", "benchmark", 1)
+            _local.append(time.perf_counter() - _t)
+        with _lock:
+            _latencies.extend(_local)
+
+    _threads = [threading.Thread(target=_producer) for _ in range(_producers)]
+    _start = time.perf_counter()
+    for _thread in _threads:
+        _thread.start()
+    for _thread in _threads:
+        _thread.join()
+    return _summary(f"sync x{_producers}", time.perf_counter() - _start, _latencies)
+
+
+async def _async_inserts(db, _producers, _inserts_per_producer):
+    _latencies = []
+
+    async def _producer():
+        for _ in range(_inserts_per_producer):
+            _t = time.perf_counter()
+            await db.insert_machine_disable_enable_data(False, "FACTORY001", "benchmark", 1)
+            _latencies.append(time.perf_counter() - _t)
+
+    _start = time.perf_counter()
+    await db.run_many([_producer() for _ in range(_producers)])
+    return _summary(f"async x{_producers}", time.perf_counter() - _start, _latencies)
+
+
+def benchmark_async_vs_sync(testing):
+    ''' Same insert helper through the threaded sync pool and through the aiopg pool,
+    with 1, 10 and 100 concurrent producers (BENCHMARK_PRODUCERS) '''
+    async def _run_async():
+        async with AsyncTesting(testing._conn_str) as db:
+            return [await _async_inserts(db, _n, BENCHMARK_INSERTS_PER_PRODUCER) for _n in BENCHMARK_PRODUCERS]
+
+    _results = [_sync_inserts(testing, _n, BENCHMARK_INSERTS_PER_PRODUCER) for _n in BENCHMARK_PRODUCERS]
+    _results += asyncio.run(_run_async())
+    return _results
+
+
+def _fill_history(_conn, _table_name, _fill_sql, _target_rows):
+    ''' top the table up to _target_rows already processed rows, triggers are skipped for the fill '''
+    with _conn.cursor() as cur:
+        cur.execute(f"SELECT count(*) FROM {_table_name};")
+        _missing = _target_rows - cur.fetchone()[0]
+        if _missing > 0:
+            cur.execute("SET LOCAL session_replication_role = replica;")
+            cur.execute(_fill_sql, (_missing,))
+            cur.execute(f"ANALYZE {_table_name};")
+    _conn.commit()
+
+
+def _insert_latencies(_conn, _sql, _samples):
+    _latencies = []
+    with _conn.cursor() as cur:
+        for _ in range(_samples):
+            _t = time.perf_counter()
+            cur.execute(_sql)
+            _latencies.append(time.perf_counter() - _t)
+    return _latencies
+
+
+def benchmark_command_insert_vs_history(testing):
+    ''' Latency of one commands_record insert (with the generate_current_command trigger)
+    for a growing amount of existing rows (BENCHMARK_HISTORY_SIZES), it should stay flat '''
+    _results = []
+    for _history_rows in BENCHMARK_HISTORY_SIZES:
+        with testing._pool.connection() as _conn:
+            _fill_history(_conn, COMMANDS_RECORD, f"""
+                INSERT INTO {COMMANDS_RECORD} (is_processed, is_activated)
+                SELECT true, false FROM generate_series(1, %s);
+            """, _history_rows)
+            _conn.autocommit = True
+            _latencies = _insert_latencies(
+                _conn, f"INSERT INTO {COMMANDS_RECORD} (command_map_id) VALUES (NULL);", BENCHMARK_SAMPLES
+            )
+        _results.append(_summary(f"{COMMANDS_RECORD} insert, {_history_rows} existing rows", sum(_latencies), _latencies))
+    return _results
+
+
+def _replace_before_insert_trigger(_conn, _table_name, _trigger_name, _function_name):
+    with _conn.cursor() as cur:
+        cur.execute(f"DROP TRIGGER IF EXISTS {_trigger_name} ON {_table_name};")
+        cur.execute(f"""
+            CREATE TRIGGER {_trigger_name}
+            BEFORE INSERT ON {_table_name}
+            FOR EACH ROW
+            EXECUTE FUNCTION {_function_name}();
+        """)
+
+
+def benchmark_source_insert_before_after(testing):
+    ''' Insert latency into command source tables with the generic BEFORE INSERT function
+    (information_schema lookups and dynamic SQL, "before") and with the generated per table function ("after").
+    Neither one expires the remote session (expire_remote_control_session does), only the lookups are compared '''
+    _cases = {
+        PANEL_SELECTIONS_RECORD: (
+            PANEL_SELECTIONS_RECORD_BEFORE_INSERTED_TRIGGER,
+            f"INSERT INTO {PANEL_SELECTIONS_RECORD} (command_str) VALUES ('1');"
+        ),
+        SELF_URGENT_STOP_COMMANDS_RECORD: (
+            SELF_URGENT_STOP_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER,
+            f"INSERT INTO {SELF_URGENT_STOP_COMMANDS_RECORD} DEFAULT VALUES;"
+        ),
+    }
+    _results = []
+    with testing._pool.connection(autocommit=True) as _conn:
+        with _conn.cursor() as cur:
+            cur.execute(CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD_ORIG)
+        try:
+            for _table_name, (_trigger_name, _sql) in _cases.items():
+                for _label, _function_name in (
+                    ("before", CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD),
+                    ("after", check_before_insert_procedure_name(_table_name)),
+                ):
+                    _replace_before_insert_trigger(_conn, _table_name, _trigger_name, _function_name)
+                    _latencies = _insert_latencies(_conn, _sql, BENCHMARK_SAMPLES)
+                    _results.append(_summary(f"{_table_name} insert, {_label}", sum(_latencies), _latencies))
+        finally:
+            for _table_name, (_trigger_name, _sql) in _cases.items():
+                _replace_before_insert_trigger(_conn, _table_name, _trigger_name, check_before_insert_procedure_name(_table_name))
+    return _results
+
+
+def _replay_rows(_count):
+    # panel selections cycling through the grades and off, as a replayed operator would
+    _command_strs = ("2", "3", "4", "1")
+    return [(_command_strs[_i % len(_command_strs)],) for _i in range(_count)]
+
+
+def benchmark_bulk_replay(testing):
+    ''' Replay of BENCHMARK_REPLAY_ROWS panel selections through the bulk path (COPY into staging, set based inserts,
+    the batch arbitrated in order in memory and written once) against the row by row chain (execute_values, every trigger per row) '''
+    _results = []
+    with testing._pool.connection() as _conn:
+        _rows = _replay_rows(BENCHMARK_REPLAY_ROW_PATH_ROWS)
+        _start = time.perf_counter()
+        with _conn.cursor() as cur:
+            execute_values(cur, f"INSERT INTO {PANEL_SELECTIONS_RECORD} (command_str) VALUES %s;", _rows, page_size=1000)
+        _conn.commit()
+        _elapsed = time.perf_counter() - _start
+    _results.append({
+        "name": f"row chain replay, {len(_rows)} rows",
+        "elapsed_sec": round(_elapsed, 4),
+        "rows_per_sec": round(len(_rows) / _elapsed, 1),
+    })
+    _rows = _replay_rows(BENCHMARK_REPLAY_ROWS)
+    _start = time.perf_counter()
+    testing._bulk_insert_commands(PANEL_SELECTIONS_RECORD, _rows)
+    _elapsed = time.perf_counter() - _start
+    _results.append({
+        "name": f"bulk replay, {len(_rows)} rows",
+        "elapsed_sec": round(_elapsed, 4),
+        "rows_per_sec": round(len(_rows) / _elapsed, 1),
+        "speedup": round((len(_rows) / _elapsed) / _results[0]["rows_per_sec"], 1),
+    })
+    return _results
+
+
+def benchmark_panel_insert_sync_vs_deferred(testing):
+    ''' Panel insert latency with the whole chain in the insert ("sync") and with only the job row ("deferred"),
+    plus how long the worker takes to apply the deferred ones '''
+    _sql = f"INSERT INTO {PANEL_SELECTIONS_RECORD} (command_str) VALUES ('1');"
+    _results = []
+    with testing._pool.connection(autocommit=True) as _conn:
+        _previous_mode = testing._get_panel_arbitration_mode(_conn)
+        try:
+            for _mode in ("sync", "deferred"):
+                testing._set_panel_arbitration_mode(_conn, _mode)
+                _latencies = _insert_latencies(_conn, _sql, BENCHMARK_SAMPLES)
+                _results.append(_summary(f"{PANEL_SELECTIONS_RECORD} insert, {_mode}", sum(_latencies), _latencies))
+            _worker = PanelSelectionJobWorker(testing._pool, testing._conn_str)
+            _start = time.perf_counter()
+            while _worker.run_once():
+                pass
+            _elapsed = time.perf_counter() - _start
+            _stats = _worker.stats()
+            _results.append({
+                "name": f"deferred jobs applied, {_stats['processed']} jobs",
+                "elapsed_sec": round(_elapsed, 4),
+                "max_lag_sec": round(_stats["max_lag_sec"], 4),
+            })
+        finally:
+            testing._set_panel_arbitration_mode(_conn, _previous_mode)
+    return _results
+
+
+BENCHMARKS = {
+    "async_vs_sync": benchmark_async_vs_sync,
+    "command_insert_vs_history": benchmark_command_insert_vs_history,
+    "source_insert_before_after": benchmark_source_insert_before_after,
+    "bulk_replay": benchmark_bulk_replay,
+    "panel_insert_sync_vs_deferred": benchmark_panel_insert_sync_vs_deferred,
+}
+
+if __name__=="__main__":
+    _names = sys.argv[1:] or list(BENCHMARKS)
+    testing = prepare_benchmark_testing()
+    try:
+        for _name in _names:
+            for _result in BENCHMARKS[_name](testing):
+                print(_result)
+    finally:
+        testing._pool.closeall()
@@ -0,0 +1,26 @@
+''' Fail (exit code 1) when a trigger hot query plans a sequential scan on a big table.
+Run it against a database holding a realistic amount of history, e.g. the benchmark one
+
+    python check_query_plans.py                      # POSTGRES_DB_NAME
+    python check_query_plans.py aii_sortermachine_bench
+'''
+import logging
+import sys
+
+from main2 import Testing, POSTGRES_DB_NAME, TRIGGER_HOT_QUERIES, QUERY_PLAN_SEQ_SCAN_MIN_ROWS
+
+if __name__=="__main__":
+    testing = Testing(sys.argv[1] if len(sys.argv) > 1 else POSTGRES_DB_NAME)
+    try:
+        with testing._pool.connection(autocommit=True) as _conn:
+            with _conn.cursor() as cur:
+                # fresh planner statistics, the row estimates decide which seq scans count
+                cur.execute("ANALYZE;")
+            _violations = testing._check_query_plans(_conn)
+    finally:
+        testing._pool.closeall()
+    if _violations:
+        for _violation in _violations:
+            logging.error(f"seq scan - {_violation}")
+        raise SystemExit(1)
+    logging.info(f"{len(TRIGGER_HOT_QUERIES)} queries checked, no seq scan above {QUERY_PLAN_SEQ_SCAN_MIN_ROWS} rows")
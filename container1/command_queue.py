@@ -0,0 +1,216 @@
+''' Consumers of the commands_queue, one copy of every commands_record row per consumer group
+
+    python command_queue.py auditor         # log every command of the auditor group until interrupted
+    python command_queue.py ros_bridge      # same for the ros bridge group, the config bundles resolved on the way
+'''
+import logging
+import os
+import socket
+import sys
+import threading
+
+from psycopg2 import Error
+from psycopg2.extras import RealDictCursor
+
+from pg_notify import NotificationService
+from main2 import COMMANDS_QUEUE, COMMANDS_QUEUE_VIEW, COMMANDS_QUEUE_CHANNEL, COMMANDS_RECORD, COMMAND_MAP
+
+COMMANDS_QUEUE_BATCH_SIZE = int(os.getenv("COMMANDS_QUEUE_BATCH_SIZE", 50))
+COMMANDS_QUEUE_VISIBILITY_TIMEOUT = float(os.getenv("COMMANDS_QUEUE_VISIBILITY_TIMEOUT", 30.0))
+COMMANDS_QUEUE_MAX_ATTEMPTS = int(os.getenv("COMMANDS_QUEUE_MAX_ATTEMPTS", 5))
+COMMANDS_QUEUE_POLL_INTERVAL = float(os.getenv("COMMANDS_QUEUE_POLL_INTERVAL", 5.0))
+
+# claimed rows are hidden for the visibility timeout, the ones at max attempts are left for an operator to look at
+CLAIM_COMMANDS_SQL = f"""
+    WITH claimed AS (
+        UPDATE {COMMANDS_QUEUE} AS q
+        SET attempts = q.attempts + 1,
+            visible_at = LOCALTIMESTAMP + %(visibility_sec)s * INTERVAL '1 second',
+            claimed_by = %(consumer_id)s
+        FROM (
+            SELECT id FROM {COMMANDS_QUEUE}
+            WHERE consumer_group = %(consumer_group)s AND is_acked = false
+            AND visible_at <= LOCALTIMESTAMP AND attempts < %(max_attempts)s
+            ORDER BY id
+            LIMIT %(batch_size)s
+            FOR UPDATE SKIP LOCKED
+        ) AS c
+        WHERE q.id = c.id
+        RETURNING q.id, q.command_record_id, q.attempts
+    )
+    SELECT claimed.id AS queue_id, claimed.command_record_id AS queued_command_record_id, claimed.attempts,
+    cr.*, cm.command_str, cm.ros_command_str
+    FROM claimed
+    -- a commands_record row gone with its partition comes back with NULL columns, it is acked without handling
+    LEFT JOIN {COMMANDS_RECORD} AS cr ON cr.id = claimed.command_record_id
+    LEFT JOIN {COMMAND_MAP} AS cm ON cm.id = cr.command_map_id
+    ORDER BY claimed.id;
+"""
+# a consumer whose claim ran out (and got taken over) cannot ack or release it anymore
+ACK_COMMANDS_SQL = f"""
+    UPDATE {COMMANDS_QUEUE} SET is_acked = true, claimed_by = NULL, last_error = NULL
+    WHERE id = ANY(%s) AND claimed_by = %s AND is_acked = false;
+"""
+RELEASE_COMMAND_SQL = f"""
+    UPDATE {COMMANDS_QUEUE} SET visible_at = LOCALTIMESTAMP + %s * INTERVAL '1 second', claimed_by = NULL, last_error = %s
+    WHERE id = %s AND claimed_by = %s AND is_acked = false;
+"""
+QUEUE_DEPTH_SQL = f"""
+    SELECT consumer_group, count(*) AS pending, count(*) FILTER (WHERE is_claimed) AS claimed,
+    count(*) FILTER (WHERE attempts >= %s) AS dead,
+    EXTRACT(EPOCH FROM LOCALTIMESTAMP - min(timestamp)) AS oldest_sec
+    FROM {COMMANDS_QUEUE_VIEW}
+    GROUP BY consumer_group;
+"""
+
+
+class CommandQueueConsumer(NotificationService):
+    ''' Drain the commands_queue rows of one consumer group. Several consumers of the same group share the work,
+    FOR UPDATE SKIP LOCKED hands every row to one of them, and the groups never wait on each other.
+    handler(row) gets the commands_record row (plus command_str, ros_command_str, queue_id and attempts), the row is
+    acked when it returns and released again for a retry (after retry_delay_sec) when it raises.
+    With a config_resolver (started by the caller, it can be shared) the row also gets config_bundle, the serialized
+    config bundle of its command_map, None when there is none.
+    A consumer dying with claimed rows leaves them to the others once the visibility timeout ran out
+
+        resolver = ConfigResolver(testing._pool, testing._conn_str).start()
+        consumer = CommandQueueConsumer(testing._pool, testing._conn_str, "ros_bridge", _send_to_ros,
+                                        config_resolver=resolver).start()
+    '''
+    def __init__(self, pool, conn_str, consumer_group, handler, consumer_id=None,
+                 batch_size=COMMANDS_QUEUE_BATCH_SIZE, visibility_timeout_sec=COMMANDS_QUEUE_VISIBILITY_TIMEOUT,
+                 max_attempts=COMMANDS_QUEUE_MAX_ATTEMPTS, poll_interval_sec=COMMANDS_QUEUE_POLL_INTERVAL,
+                 retry_delay_sec=1.0, config_resolver=None) -> None:
+        self._pool = pool
+        self._consumer_group = consumer_group
+        self._handler = handler
+        self._config_resolver = config_resolver
+        self._consumer_id = consumer_id or f"{socket.gethostname()}-{os.getpid()}-{id(self):x}"
+        self._batch_size = batch_size
+        self._visibility_timeout_sec = visibility_timeout_sec
+        self._max_attempts = max_attempts
+        self._poll_interval_sec = poll_interval_sec
+        self._retry_delay_sec = retry_delay_sec
+        self._lock = threading.Lock()
+        super().__init__(conn_str, [COMMANDS_QUEUE_CHANNEL], f"command_queue_{consumer_group}", poll_interval_sec)
+        self._stats = {"claimed": 0, "acked": 0, "failed": 0, "orphaned": 0, "lost_claims": 0, "db_errors": 0}
+
+    def claim(self):
+        ''' claim the next batch_size visible rows of the group, return them as dicts '''
+        with self._pool.connection() as _conn:
+            with _conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(CLAIM_COMMANDS_SQL, {
+                    "visibility_sec": self._visibility_timeout_sec,
+                    "consumer_id": self._consumer_id,
+                    "consumer_group": self._consumer_group,
+                    "max_attempts": self._max_attempts,
+                    "batch_size": self._batch_size,
+                })
+                _rows = [dict(_row) for _row in cur.fetchall()]
+            _conn.commit()
+        with self._lock:
+            self._stats["claimed"] += len(_rows)
+        return _rows
+
+    def ack(self, _queue_ids):
+        ''' mark the claimed rows as done, return how many were still ours '''
+        if not _queue_ids:
+            return 0
+        with self._pool.connection() as _conn:
+            with _conn.cursor() as cur:
+                cur.execute(ACK_COMMANDS_SQL, (list(_queue_ids), self._consumer_id))
+                _acked = cur.rowcount
+            _conn.commit()
+        with self._lock:
+            self._stats["acked"] += _acked
+            self._stats["lost_claims"] += len(_queue_ids) - _acked
+        return _acked
+
+    def release(self, _queue_id, _error):
+        ''' give a claimed row back for a retry after retry_delay_sec '''
+        with self._pool.connection() as _conn:
+            with _conn.cursor() as cur:
+                cur.execute(RELEASE_COMMAND_SQL, (self._retry_delay_sec, str(_error)[:1000], _queue_id, self._consumer_id))
+            _conn.commit()
+        with self._lock:
+            self._stats["failed"] += 1
+
+    def run_once(self):
+        ''' claim, handle and ack one batch, return the number of rows handled successfully '''
+        try:
+            _rows = self.claim()
+        except Error as e:
+            logging.error(f"(f) run_once - unable to claim from {self._consumer_group} : {e}")
+            with self._lock:
+                self._stats["db_errors"] += 1
+            return 0
+        _done = []
+        for _row in _rows:
+            if _row["id"] is None:
+                logging.warning(f"(f) run_once - command record {_row['queued_command_record_id']} is gone, acked without handling")
+                with self._lock:
+                    self._stats["orphaned"] += 1
+                _done.append(_row["queue_id"])
+                continue
+            try:
+                if self._config_resolver is not None:
+                    _row["config_bundle"] = self._config_resolver.get(_row["command_map_id"])
+                self._handler(_row)
+                _done.append(_row["queue_id"])
+            except Exception as e:
+                logging.warning(f"(f) run_once - {self._consumer_group} failed on command record {_row['id']} (attempt {_row['attempts']}) : {e}")
+                try:
+                    self.release(_row["queue_id"], e)
+                except Error as e:
+                    logging.error(f"(f) run_once - unable to release queue row {_row['queue_id']}, it shows up again after the timeout : {e}")
+        try:
+            self.ack(_done)
+        except Error as e:
+            # handled but not acked, the rows come back after the visibility timeout, handlers have to be idempotent
+            logging.error(f"(f) run_once - unable to ack {len(_done)} row(s) of {self._consumer_group} : {e}")
+            with self._lock:
+                self._stats["db_errors"] += 1
+            return 0
+        return len(_done)
+
+    def _poll(self):
+        # drained (or failing), wait for new rows, the timeout also brings back the expired claims
+        return self._poll_interval_sec if self.run_once() < self._batch_size else 0.0
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+
+def queue_depth(pool, max_attempts=COMMANDS_QUEUE_MAX_ATTEMPTS):
+    ''' {consumer group: {"pending", "claimed", "dead", "oldest_sec"}} of the rows not acked yet '''
+    with pool.connection(autocommit=True) as _conn:
+        with _conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(QUEUE_DEPTH_SQL, (max_attempts,))
+            return {_row.pop("consumer_group"): dict(_row) for _row in cur.fetchall()}
+
+
+if __name__=="__main__":
+    from main2 import Testing
+    from config_resolver import ConfigResolver
+
+    testing = Testing()
+    _consumer_group = sys.argv[1] if len(sys.argv) > 1 else "auditor"
+    # the ros bridge sends the node configs along with the command
+    resolver = ConfigResolver(testing._pool, testing._conn_str).start() if _consumer_group == "ros_bridge" else None
+    consumer = CommandQueueConsumer(
+        testing._pool, testing._conn_str, _consumer_group,
+        lambda _row: logging.info(f"command record {_row['id']} - {_row['command_str']} (attempt {_row['attempts']})"),
+        config_resolver=resolver
+    ).start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        consumer.stop()
+        if resolver is not None:
+            resolver.stop()
+        logging.info(f"consumer stats - {consumer.stats()}, queue depth - {queue_depth(testing._pool)}")
+        testing._pool.closeall()
@@ -0,0 +1,175 @@
+''' Waiting on the status reports of the commands (command_status_record, command_status_changed events)
+
+    python command_status.py 42         # wait for command record 42 to be satisfied or in error
+'''
+import json
+import logging
+import os
+import sys
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from psycopg2 import Error
+from psycopg2.extras import DictCursor
+
+from pg_notify import NotificationService
+from timer_scheduler import TimerScheduler
+from latency_histogram import LatencyHistogram
+from main2 import COMMAND_STATUS_CHANNEL, COMMAND_STATUSES, LATEST_COMMAND_STATUS_SQL
+
+COMMAND_FINAL_STATUSES = ("satisfied", "error")
+# how many command records the waiter remembers the latest status of
+COMMAND_STATUS_CACHE_SIZE = int(os.getenv("COMMAND_STATUS_CACHE_SIZE", 1024))
+
+
+class CommandStatusWaiter(NotificationService):
+    ''' Futures resolved by the command_status_changed events. wait_for_command() first looks at the latest status
+    already recorded, so a status reported before the call is not missed, and the pending waits are checked again
+    after every (re)connect of the LISTEN session. The status is the one aggregated over the ROS nodes
+    (command_aggregate_status: error once a node is in error, satisfied once every reporting node and every node
+    type the command expects are, pending_nodes counts the expected ones still missing), node_type / node_name
+    / error_msg are the ones of the node in error. The first final status (satisfied / error) of every command seen
+    is observed in the latency histogram (command_record timestamp to the last report counted)
+
+        waiter = CommandStatusWaiter(testing._pool, testing._conn_str).start()
+        _status = waiter.wait_for_command(_record_id, timeout=10.0).result()
+        # {"command_record_id", "status", "nodes", "pending_nodes", "node_type", "node_name", "error_msg", "latency_sec"}
+    '''
+    def __init__(self, pool, conn_str, histogram=None, scheduler=None, listen_timeout_sec=5.0,
+                 cache_size=COMMAND_STATUS_CACHE_SIZE) -> None:
+        self._pool = pool
+        self._cache_size = cache_size
+        self.histogram = histogram if histogram is not None else LatencyHistogram()
+        # a scheduler handed in is shared with other users and left running by stop()
+        self._owns_scheduler = scheduler is None
+        self._scheduler = scheduler if scheduler is not None else TimerScheduler("command_status_timeouts")
+        self._lock = threading.Lock()
+        # command_record_id -> [(states, future)]
+        self._waiters = {}
+        # command_record_id -> latest status event, oldest first
+        self._latest = OrderedDict()
+        super().__init__(conn_str, [COMMAND_STATUS_CHANNEL], "command_status_waiter", listen_timeout_sec)
+
+    def wait_for_command(self, _record_id, _states=COMMAND_FINAL_STATUSES, timeout=None):
+        ''' Future resolved with the first status event of _record_id in _states, or failed with TimeoutError
+        after timeout seconds '''
+        _states = frozenset(_states)
+        _unknown = _states.difference(COMMAND_STATUSES)
+        if _unknown:
+            raise ValueError(f"unknown command status(es) {sorted(_unknown)}")
+        _future = Future()
+        with self._lock:
+            _event = self._latest.get(_record_id)
+            if _event is not None and _event["status"] in _states:
+                _future.set_result(_event)
+                return _future
+            self._waiters.setdefault(_record_id, []).append((_states, _future))
+        if timeout is not None:
+            self._scheduler.schedule(None, timeout, self._expire, _record_id, _future, timeout)
+        # registered before the lookup, a status arriving in between resolves the future through the event instead
+        self._recheck([_record_id])
+        return _future
+
+    def _expire(self, _record_id, _future, _timeout):
+        if self._drop(_record_id, _future):
+            if not _future.cancelled():
+                _future.set_exception(TimeoutError(f"no status in time for command record {_record_id} after {_timeout}s"))
+
+    def _drop(self, _record_id, _future):
+        ''' remove the waiter, return False when it was already resolved '''
+        with self._lock:
+            _waiters = self._waiters.get(_record_id, [])
+            _remaining = [_waiter for _waiter in _waiters if _waiter[1] is not _future]
+            if len(_remaining) == len(_waiters):
+                return False
+            if _remaining:
+                self._waiters[_record_id] = _remaining
+            else:
+                del self._waiters[_record_id]
+            return True
+
+    def _recheck(self, _record_ids):
+        try:
+            self._reload(_record_ids)
+        except Error as e:
+            logging.error(f"(f) _recheck - unable to read the status of {len(_record_ids)} command(s) : {e}")
+
+    def _reload(self, _record_ids=None):
+        ''' apply the latest recorded status of _record_ids (every waited command by default) '''
+        with self._lock:
+            _record_ids = list(self._waiters) if _record_ids is None else list(_record_ids)
+        if not _record_ids:
+            return
+        with self._pool.connection(autocommit=True) as _conn:
+            with _conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(LATEST_COMMAND_STATUS_SQL, (_record_ids,))
+                _events = [dict(_row) for _row in cur.fetchall()]
+        for _event in _events:
+            if _event["latency_sec"] is not None:
+                _event["latency_sec"] = float(_event["latency_sec"])
+            self._apply(_event, _is_observed=False)
+
+    def _apply(self, _event, _is_observed=True):
+        _record_id = _event["command_record_id"]
+        _resolved = []
+        with self._lock:
+            _previous = self._latest.pop(_record_id, None)
+            self._latest[_record_id] = _event
+            while len(self._latest) > self._cache_size:
+                self._latest.popitem(last=False)
+            _is_first_final = _event["status"] in COMMAND_FINAL_STATUSES and (
+                _previous is None or _previous["status"] not in COMMAND_FINAL_STATUSES
+            )
+            _waiters = self._waiters.pop(_record_id, [])
+            _remaining = []
+            for _states, _future in _waiters:
+                (_resolved if _event["status"] in _states else _remaining).append(_future)
+            if _remaining:
+                self._waiters[_record_id] = _remaining
+        if _is_observed and _is_first_final and _event.get("latency_sec") is not None:
+            self.histogram.observe(float(_event["latency_sec"]))
+        for _future in _resolved:
+            # a future cancelled by its caller is just dropped
+            if not _future.cancelled():
+                _future.set_result(_event)
+
+    def _handle(self, _notify):
+        self._apply(json.loads(_notify.payload))
+
+    def pending(self):
+        ''' number of futures not resolved yet '''
+        with self._lock:
+            return sum(len(_waiters) for _waiters in self._waiters.values())
+
+    def start(self):
+        if self._owns_scheduler:
+            self._scheduler.start()
+        return super().start()
+
+    def stop(self):
+        ''' stop listening, the futures still pending are cancelled '''
+        super().stop()
+        if self._owns_scheduler:
+            self._scheduler.stop()
+        with self._lock:
+            _futures = [_future for _waiters in self._waiters.values() for _, _future in _waiters]
+            self._waiters.clear()
+        for _future in _futures:
+            _future.cancel()
+
+
+if __name__=="__main__":
+    from main2 import Testing
+
+    testing = Testing()
+    waiter = CommandStatusWaiter(testing._pool, testing._conn_str).start()
+    try:
+        _status = waiter.wait_for_command(int(sys.argv[1]), timeout=float(sys.argv[2]) if len(sys.argv) > 2 else 30.0).result()
+        logging.info(f"command record {_status['command_record_id']} - {_status['status']} after {_status['latency_sec']}s")
+    except TimeoutError as e:
+        logging.warning(f"{e}")
+        raise SystemExit(1)
+    finally:
+        waiter.stop()
+        testing._pool.closeall()
@@ -0,0 +1,138 @@
+''' Stop of the timed commands (command_map.command_duration_sec > 0, e.g. the diagnostics)
+
+    python command_watchdog.py      # run the watchdog until interrupted
+'''
+import json
+import logging
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2 import Error
+from psycopg2.extras import DictCursor
+
+from pg_notify import NotificationService
+from timer_scheduler import TimerScheduler
+from main2 import CURRENT_COMMAND_CHANNEL, CURRENT_TIMED_COMMANDS_SQL, STOP_TIMED_COMMAND
+
+COMMAND_WATCHDOG_RETRY_SEC = float(os.getenv("COMMAND_WATCHDOG_RETRY_SEC", 1.0))
+
+
+class CommandDurationWatchdog(NotificationService):
+    ''' Keep the deadline of every current timed command in a TimerScheduler and insert its stop command
+    when the deadline passes (stop_timed_command(), which checks again that the command is still current and due).
+    A stop the arbitration does not accept is escalated to a self urgent stop by stop_timed_command(), when that
+    one is not accepted either the stop is tried again after retry_sec. The deadlines come from the NOTIFY sent on
+    every current_command change and are reloaded after every (re)connect of the LISTEN session,
+    a new current command supersedes the deadline of the previous one. The stops run one at a time on a worker
+    thread of their own, the scheduler thread (possibly shared) only hands them over
+
+        watchdog = CommandDurationWatchdog(testing._pool, testing._conn_str).start()
+    '''
+    def __init__(self, pool, conn_str, scheduler=None, listen_timeout_sec=5.0, retry_sec=COMMAND_WATCHDOG_RETRY_SEC) -> None:
+        self._pool = pool
+        self._retry_sec = retry_sec
+        # a scheduler handed in is shared with other users and left running by stop()
+        self._owns_scheduler = scheduler is None
+        self._scheduler = scheduler if scheduler is not None else TimerScheduler("command_watchdog_timers")
+        self._executor = None
+        super().__init__(conn_str, [CURRENT_COMMAND_CHANNEL], "command_watchdog", listen_timeout_sec)
+        self.stops_inserted = 0
+        self.stops_escalated = 0
+        self.stops_rejected = 0
+
+    def _key(self, _current_command_id):
+        return ("command_duration", _current_command_id)
+
+    def _track(self, _current_command_id, _command_record_id, _remaining_sec):
+        _key = self._key(_current_command_id)
+        if _remaining_sec is None:
+            self._scheduler.cancel(_key)
+        else:
+            self._scheduler.schedule(_key, max(float(_remaining_sec), 0.0), self._submit_stop, _current_command_id, _command_record_id)
+
+    def _reload(self):
+        ''' schedule the deadlines of the timed commands current right now '''
+        with self._pool.connection(autocommit=True) as _conn:
+            with _conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(CURRENT_TIMED_COMMANDS_SQL)
+                _rows = cur.fetchall()
+        for _row in _rows:
+            self._track(_row["id"], _row["command_record_id"], _row["remaining_sec"])
+
+    def _submit_stop(self, _current_command_id, _command_record_id):
+        # on the scheduler thread, the stop goes through the database on the worker
+        _executor = self._executor
+        if _executor is None:
+            return
+        try:
+            _executor.submit(self._stop_command, _current_command_id, _command_record_id)
+        except RuntimeError:
+            # shut down by stop() in the meantime
+            pass
+
+    def _stop_command(self, _current_command_id, _command_record_id):
+        try:
+            with self._pool.connection() as _conn:
+                with _conn.cursor(cursor_factory=DictCursor) as cur:
+                    cur.execute(f"SELECT * FROM {STOP_TIMED_COMMAND}(%s);", (_command_record_id,))
+                    _stop = cur.fetchone()
+                _conn.commit()
+        except Error as e:
+            logging.error(f"(f) _stop_command - unable to stop command record {_command_record_id}, retry in {self._retry_sec}s : {e}")
+            self._track(_current_command_id, _command_record_id, self._retry_sec)
+            return
+        if _stop["remaining_sec"] is None:
+            logging.debug(f"(f) _stop_command - command record {_command_record_id} is not current anymore")
+        elif _stop["remaining_sec"] > 0:
+            # the database clock is behind ours, wait for it
+            self._track(_current_command_id, _command_record_id, _stop["remaining_sec"])
+        elif _stop["decision"] not in ("accepted", "superseded"):
+            # not even the self urgent stop got through, the command is still running
+            logging.warning(f"(f) _stop_command - stop of command record {_command_record_id} {_stop['decision']} ({_stop['reason_code']}), retry in {self._retry_sec}s")
+            self.stops_rejected += 1
+            self._track(_current_command_id, _command_record_id, self._retry_sec)
+        else:
+            self.stops_inserted += 1
+            if _stop["is_escalated"]:
+                self.stops_escalated += 1
+                logging.warning(f"timed command record {_command_record_id} is over, its stop got rejected ({_stop['reason_code']}), self urgent stop {_stop['record_id']} inserted instead")
+            else:
+                logging.info(f"timed command record {_command_record_id} is over, stop command record {_stop['record_id']} inserted")
+
+    def _handle(self, _notify):
+        _event = json.loads(_notify.payload)
+        self._track(_event["id"], _event["command_record_id"], _event["remaining_sec"])
+
+    def pending(self):
+        ''' number of deadlines currently tracked '''
+        return self._scheduler.pending()
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="command_watchdog_stops")
+        if self._owns_scheduler:
+            self._scheduler.start()
+        return super().start()
+
+    def stop(self):
+        super().stop()
+        if self._owns_scheduler:
+            self._scheduler.stop()
+        # a stop already going through the database is finished, the ones queued behind it are dropped
+        _executor, self._executor = self._executor, None
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+
+
+if __name__=="__main__":
+    from main2 import Testing
+
+    testing = Testing()
+    watchdog = CommandDurationWatchdog(testing._pool, testing._conn_str).start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watchdog.stop()
+        testing._pool.closeall()
@@ -0,0 +1,83 @@
+import logging
+import threading
+
+from pg_notify import NotificationService
+from main2 import COMMAND_CONFIG_CHANNEL, COMMAND_CONFIG_BUNDLES_SQL
+
+
+class ConfigResolver(NotificationService):
+    ''' In process cache of the serialized config bundle of every command_map id
+    (command_map joined with its active command_map_node_config_map rows and their ros_nodes_configs).
+    All the bundles are built by one query and kept as JSON text, get() hands out the same string until
+    a trigger on one of the three tables sends a NOTIFY, the next get() after that rebuilds them once.
+    The bundles are also rebuilt after every (re)connect of the LISTEN session, while they are stale (session lost
+    or the last rebuild failed) get() keeps handing out the last ones built
+
+        resolver = ConfigResolver(testing._pool, testing._conn_str).start()
+        resolver.get(command_map_id)                        # '{"command_map_id": 1, ..., "node_configs": {...}}'
+    '''
+    def __init__(self, pool, conn_str, listen_timeout_sec=5.0) -> None:
+        self._pool = pool
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        # command_map id -> serialized bundle
+        self._bundles = {}
+        # command_str -> [(mode_id, command_map id)]
+        self._by_command_str = {}
+        # bumped by every notification, the bundles are current while _loaded_generation == _generation
+        self._generation = 1
+        self._loaded_generation = 0
+        super().__init__(conn_str, [COMMAND_CONFIG_CHANNEL], "config_resolver", listen_timeout_sec)
+        self.hits = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+
+    def _reload(self):
+        ''' rebuild every bundle '''
+        with self._reload_lock:
+            with self._lock:
+                _generation = self._generation
+            with self._pool.connection(autocommit=True) as _conn:
+                with _conn.cursor() as cur:
+                    cur.execute(COMMAND_CONFIG_BUNDLES_SQL)
+                    _rows = cur.fetchall()
+            _bundles = {}
+            _by_command_str = {}
+            for _command_map_id, _bundle, _command_str, _mode_id in _rows:
+                _bundles[_command_map_id] = _bundle
+                _by_command_str.setdefault(_command_str, []).append((_mode_id, _command_map_id))
+            with self._lock:
+                self._bundles = _bundles
+                self._by_command_str = _by_command_str
+                # a notification received during the query leaves the bundles dirty for the next get()
+                self._loaded_generation = _generation
+
+    def _handle(self, _notify):
+        # the payload only names the table that changed
+        logging.debug(f"(f) _handle - command configs changed in {_notify.payload}")
+        self.invalidate()
+
+    def _ensure_loaded(self):
+        with self._lock:
+            _is_dirty = self._loaded_generation != self._generation
+        if _is_dirty:
+            self.reload()
+
+    def get(self, _command_map_id):
+        ''' serialized bundle of the command_map id, None when unknown '''
+        self._ensure_loaded()
+        with self._lock:
+            self.hits += 1
+            return self._bundles.get(_command_map_id)
+
+    def get_by_command_str(self, _command_str, mode_id=None):
+        ''' serialized bundle of the (first) command_map with that command_str, in that mode when given '''
+        self._ensure_loaded()
+        with self._lock:
+            self.hits += 1
+            for _mode_id, _command_map_id in self._by_command_str.get(_command_str, []):
+                if mode_id is None or _mode_id == mode_id:
+                    return self._bundles[_command_map_id]
+        return None
@@ -0,0 +1,163 @@
+import logging
+import threading
+import psycopg2
+
+from contextlib import contextmanager
+from time import monotonic
+from psycopg2 import Error, OperationalError, InterfaceError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import PoolError
+
+
+class DatabasePool:
+    ''' Thread safe connection pool shared by all the data access helpers.
+    A connection is handed to one thread at a time, checked with a cheap query when it has been idle
+    for longer than health_check_idle_sec and replaced when broken.
+    Checkouts and the time spent waiting for a free connection are counted, see stats() '''
+    def __init__(self, conn_str, minconn=1, maxconn=5, checkout_timeout_sec=10.0, health_check_idle_sec=30.0) -> None:
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"invalid pool size min={minconn} max={maxconn}")
+        self._conn_str = conn_str
+        self._minconn = minconn
+        self._maxconn = maxconn
+        self._checkout_timeout_sec = checkout_timeout_sec
+        self._health_check_idle_sec = health_check_idle_sec
+        self._cond = threading.Condition()
+        # idle connections as (connection, monotonic time of last checkin), used as a stack
+        self._idle = []
+        self._in_use = set()
+        # number of connections owned by the pool including the ones being opened
+        self._size = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "wait_time_sec": 0.0,
+            "max_wait_time_sec": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "health_check_failures": 0,
+        }
+        for _ in range(minconn):
+            _conn = self._connect()
+            self._size += 1
+            self._idle.append((_conn, monotonic()))
+
+    def _connect(self):
+        _conn = psycopg2.connect(self._conn_str)
+        with self._cond:
+            self._stats["created"] += 1
+        return _conn
+
+    def _is_healthy(self, _conn, _last_used):
+        if _conn.closed:
+            return False
+        if monotonic() - _last_used < self._health_check_idle_sec:
+            return True
+        try:
+            with _conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            if not _conn.autocommit:
+                _conn.rollback()
+            return True
+        except Error as e:
+            logging.warning(f"(f) _is_healthy - drop broken pooled connection : {e}")
+            return False
+
+    def getconn(self, timeout=None):
+        ''' Check a connection out of the pool, wait up to timeout seconds when all of them are in use '''
+        _timeout = self._checkout_timeout_sec if timeout is None else timeout
+        _start = monotonic()
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+                if self._idle:
+                    _conn, _last_used = self._idle.pop()
+                    break
+                if self._size < self._maxconn:
+                    _conn, _last_used = None, None
+                    self._size += 1
+                    break
+                _remaining = _timeout - (monotonic() - _start)
+                if _remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolError(f"no free connection within {_timeout}s, pool size {self._maxconn}")
+                self._cond.wait(_remaining)
+        try:
+            if _conn is not None and not self._is_healthy(_conn, _last_used):
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                if not _conn.closed:
+                    _conn.close()
+                _conn = None
+            if _conn is None:
+                _conn = self._connect()
+        except Error:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        _waited = monotonic() - _start
+        with self._cond:
+            self._in_use.add(_conn)
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_sec"] += _waited
+            self._stats["max_wait_time_sec"] = max(self._stats["max_wait_time_sec"], _waited)
+        return _conn
+
+    def putconn(self, _conn, close=False):
+        ''' Give a connection back, any open transaction is rolled back first '''
+        if not close and not _conn.closed:
+            try:
+                if _conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    _conn.rollback()
+            except Error:
+                close = True
+        if close and not _conn.closed:
+            _conn.close()
+        with self._cond:
+            self._in_use.discard(_conn)
+            if self._closed or _conn.closed:
+                if not _conn.closed:
+                    _conn.close()
+                self._size -= 1
+                self._stats["discarded"] += 1
+            else:
+                self._idle.append((_conn, monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, autocommit=False, timeout=None):
+        ''' with pool.connection() as _conn: ... checks the connection out and always gives it back '''
+        _conn = self.getconn(timeout)
+        _broken = False
+        try:
+            if _conn.autocommit != autocommit:
+                _conn.autocommit = autocommit
+            yield _conn
+        except (OperationalError, InterfaceError):
+            _broken = True
+            raise
+        finally:
+            self.putconn(_conn, close=_broken)
+
+    def stats(self):
+        with self._cond:
+            _stats = dict(self._stats)
+            _stats["size"] = self._size
+            _stats["idle"] = len(self._idle)
+            _stats["in_use"] = len(self._in_use)
+        _stats["avg_wait_time_sec"] = _stats["wait_time_sec"] / _stats["checkouts"] if _stats["checkouts"] else 0.0
+        return _stats
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for _conn, _ in self._idle:
+                if not _conn.closed:
+                    _conn.close()
+                self._size -= 1
+            self._idle = []
+            self._cond.notify_all()
+        logging.info(f"(f) closeall - pool closed, {len(self._in_use)} connection(s) still checked out")
@@ -0,0 +1,53 @@
+import bisect
+import os
+import threading
+
+# upper bounds of the latency buckets in seconds, the last bucket takes everything above
+COMMAND_LATENCY_BUCKETS_SEC = [float(_b) for _b in os.getenv("COMMAND_LATENCY_BUCKETS_SEC", "0.05,0.1,0.25,0.5,1,2.5,5,10,30").split(",")]
+
+
+class LatencyHistogram:
+    ''' Fixed bucket histogram of latencies in seconds, cheap enough to observe on every event.
+    Percentiles are read from the buckets, so they are the upper bound of the bucket they fall in '''
+    def __init__(self, buckets_sec=COMMAND_LATENCY_BUCKETS_SEC) -> None:
+        self._buckets_sec = sorted(buckets_sec)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self._buckets_sec) + 1)
+        self._count = 0
+        self._sum_sec = 0.0
+        self._max_sec = 0.0
+
+    def observe(self, _latency_sec):
+        with self._lock:
+            self._counts[bisect.bisect_left(self._buckets_sec, _latency_sec)] += 1
+            self._count += 1
+            self._sum_sec += _latency_sec
+            self._max_sec = max(self._max_sec, _latency_sec)
+
+    def percentile(self, _pct):
+        ''' upper bound of the bucket holding the _pct percentile, the max for the last bucket, None when empty '''
+        with self._lock:
+            if self._count == 0:
+                return None
+            _rank = _pct / 100 * self._count
+            _seen = 0
+            for _index, _bucket_count in enumerate(self._counts):
+                _seen += _bucket_count
+                if _seen >= _rank and _bucket_count:
+                    return self._buckets_sec[_index] if _index < len(self._buckets_sec) else self._max_sec
+            return self._max_sec
+
+    def snapshot(self):
+        with self._lock:
+            _buckets = {f"le_{_bound}": _count for _bound, _count in zip(self._buckets_sec, self._counts)}
+            _buckets["inf"] = self._counts[-1]
+            _snapshot = {
+                "count": self._count,
+                "mean_sec": self._sum_sec / self._count if self._count else None,
+                "max_sec": self._max_sec,
+                "buckets": _buckets,
+            }
+        _snapshot["p50_sec"] = self.percentile(50)
+        _snapshot["p95_sec"] = self.percentile(95)
+        _snapshot["p99_sec"] = self.percentile(99)
+        return _snapshot
@@ -0,0 +1,47 @@
+import json
+import threading
+
+from psycopg2.extras import DictCursor
+
+from pg_notify import NotificationService
+from main2 import CURRENT_MACHINE_STATE, MACHINE_STATE_CHANNEL
+
+MACHINE_STATE_FLAGS = ("is_remote", "is_unregistered", "is_disabled", "is_service", "is_error", "is_warning")
+
+
+class MachineStateCache(NotificationService):
+    ''' In process copy of the current_machine_state row for the towerlight / HMI.
+    get() never touches the database, a background thread applies the NOTIFY payloads
+    and reloads the row after every (re)connect of the LISTEN session
+
+        cache = MachineStateCache(testing._pool, testing._conn_str).start()
+        cache.get()["is_error"]
+    '''
+    def __init__(self, pool, conn_str, listen_timeout_sec=5.0) -> None:
+        self._pool = pool
+        self._lock = threading.Lock()
+        self._state = None
+        super().__init__(conn_str, [MACHINE_STATE_CHANNEL], "machine_state_cache", listen_timeout_sec)
+        self.reads = 0
+
+    def _set_state(self, _row):
+        _state = {_flag: bool(_row[_flag]) for _flag in MACHINE_STATE_FLAGS}
+        with self._lock:
+            self._state = _state
+
+    def _reload(self):
+        with self._pool.connection(autocommit=True) as _conn:
+            with _conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(f"SELECT * FROM {CURRENT_MACHINE_STATE};")
+                _row = cur.fetchone()
+        if _row is not None:
+            self._set_state(_row)
+
+    def _handle(self, _notify):
+        self._set_state(json.loads(_notify.payload))
+
+    def get(self):
+        ''' last known flags, None until the first load and while the copy is stale (see is_stale()) '''
+        with self._lock:
+            self.reads += 1
+            return None if self._state is None or self.is_stale() else dict(self._state)
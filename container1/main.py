@@ -13,10 +13,23 @@ from enum import Enum
 from time import monotonic
 from datetime import datetime
 
+from db_pool import DatabasePool
+from pg_notify import NotificationListener
+from timer_scheduler import TimerScheduler
+from panel_debounce import PanelSelectionDebouncer
+
 TIMEZONE = os.getenv("TIMEZONE", "Asia/Bangkok")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 POSTGRES_SERVICE_NAME = os.getenv("POSTGRES_SERVICE_NAME","localhost")
-MIN_SEQUENCE_COMMANDS_WAIT_TIME = os.getenv("MIN_SEQUENCE_COMMANDS_WAIT_TIME", 10)
+MIN_SEQUENCE_COMMANDS_WAIT_TIME = float(os.getenv("MIN_SEQUENCE_COMMANDS_WAIT_TIME", 10))
+# "notify" reacts to the trigger on current_panel_selection, "poll" keeps the old fixed interval loop
+PANEL_SELECTION_MODE = os.getenv("PANEL_SELECTION_MODE", "notify")
+PANEL_SELECTION_POLL_INTERVAL = float(os.getenv("PANEL_SELECTION_POLL_INTERVAL", 2))
+PANEL_SELECTION_LISTEN_TIMEOUT = float(os.getenv("PANEL_SELECTION_LISTEN_TIMEOUT", 60))
+DB_POOL_MIN_CONN = int(os.getenv("DB_POOL_MIN_CONN", 1))
+DB_POOL_MAX_CONN = int(os.getenv("DB_POOL_MAX_CONN", 5))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", 10))
+DB_POOL_HEALTH_CHECK_IDLE_SEC = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE_SEC", 30))
 
 LOGGING_LEVEL_DICT = {
     "CRITICAL": logging.CRITICAL,
@@ -40,9 +53,19 @@ CURRENT_SORTER_DISPLAY = "current_sorter_display"
 
 GENERATE_CURRENT_COMMAND = "generate_current_command"
 GENERATE_COMMANDS_RECORD = "generate_commands_record"
+NOTIFY_CURRENT_PANEL_SELECTION = "notify_current_panel_selection"
+NOTIFY_CONFIGS_RECORD_CHANGED = "notify_configs_record_changed"
+
+PANEL_SELECTION_CHANNEL = "current_panel_selection_changed"
+CONFIGS_CHANNEL = "configs_record_changed"
 
 TRIGGER_ON_COMMANDS_RECORD = "trigger_on_commands_record"
 TRIGGER_ON_CURRENT_MACHINE_CONTROL_STATUSES = "trigger_on_current_machine_control_statuses"
+TRIGGER_ON_CURRENT_PANEL_SELECTION = "trigger_on_current_panel_selection"
+TRIGGER_ON_CONFIGS_RECORD = "trigger_on_configs_record"
+
+# scheduler key of the ALL_START sent after the ALL_STOP of a grade change, at most one is pending
+PANEL_DELAYED_START_KEY = "panel_delayed_start"
 
 ENUMS = {
     "source_enum":"""
@@ -82,6 +105,14 @@ DATABASE_TABLES = {
             commander_id VARCHAR(255) NOT NULL,
             panel_selection panel_selection_enum,
             is_activated BOOLEAN NOT NULL DEFAULT false,
+            -- stored so the arbitration in {GENERATE_CURRENT_COMMAND} can be served by an index instead of LIKE '%_START'
+            command_kind VARCHAR(5) GENERATED ALWAYS AS (
+                CASE WHEN command LIKE '%_START' THEN 'start' WHEN command LIKE '%_STOP' THEN 'stop' END
+            ) STORED,
+            -- start priority of the source, cloud first then remote then local
+            source_priority SMALLINT GENERATED ALWAYS AS (
+                CASE source WHEN 'cloud' THEN 1 WHEN 'remote' THEN 2 ELSE 3 END
+            ) STORED,
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
     """,
@@ -171,6 +202,28 @@ DATABASE_TABLES = {
     # """
 }
 
+# columns added after the first version of a table, _setup_tables leaves the existing tables as they are
+DATABASE_COLUMNS_ADDED = {
+    COMMANDS_RECORD: f"""
+        ALTER TABLE {COMMANDS_RECORD}
+        ADD COLUMN IF NOT EXISTS command_kind VARCHAR(5) GENERATED ALWAYS AS (
+            CASE WHEN command LIKE '%_START' THEN 'start' WHEN command LIKE '%_STOP' THEN 'stop' END
+        ) STORED,
+        ADD COLUMN IF NOT EXISTS source_priority SMALLINT GENERATED ALWAYS AS (
+            CASE source WHEN 'cloud' THEN 1 WHEN 'remote' THEN 2 ELSE 3 END
+        ) STORED;
+    """,
+}
+
+DATABASE_INDEXES = {
+    # only the few not yet processed commands are in the index, the arbitration reads them in priority order
+    "commands_record_unprocessed_idx": f"""
+        CREATE INDEX IF NOT EXISTS commands_record_unprocessed_idx
+        ON {COMMANDS_RECORD} (command_kind, source_priority, timestamp DESC)
+        WHERE is_processed = false;
+    """,
+}
+
 PROCEDURES_CREATE_COMMANDS = {
     GENERATE_CURRENT_COMMAND : f"""
         CREATE OR REPLACE FUNCTION {GENERATE_CURRENT_COMMAND} ()
@@ -200,24 +253,15 @@ PROCEDURES_CREATE_COMMANDS = {
             IF is_unregister THEN
                 IF is_service OR is_remote THEN
                     SELECT * INTO selected_command FROM {COMMANDS_RECORD}
-                    WHERE is_processed = false AND command LIKE '%_START'
-                    ORDER BY
-                        CASE 
-                            WHEN source = 'cloud' THEN 1
-                            WHEN source = 'remote' THEN 2
-                            ELSE 3
-                        END,
-                        timestamp DESC
+                    WHERE is_processed = false AND command_kind = 'start'
+                    ORDER BY source_priority, timestamp DESC
                     LIMIT 1;
                     IF NOT FOUND THEN
+                        -- remote first, then cloud, then local
                         SELECT * INTO selected_command FROM {COMMANDS_RECORD}
-                        WHERE is_processed = false AND command LIKE '%_STOP'
+                        WHERE is_processed = false AND command_kind = 'stop'
                         ORDER BY
-                            CASE
-                                WHEN source = 'remote' THEN 1
-                                WHEN source = 'cloud' THEN 2
-                                ELSE 3
-                            END,
+                            CASE source_priority WHEN 2 THEN 1 WHEN 1 THEN 2 ELSE 3 END,
                             timestamp DESC
                         LIMIT 1;
                     END IF;
@@ -226,52 +270,27 @@ PROCEDURES_CREATE_COMMANDS = {
                 -- If is_service or is_remote is true
                 IF is_service OR is_remote OR is_disabled THEN
                     SELECT * INTO selected_command FROM {COMMANDS_RECORD}
-                    WHERE is_processed = false AND command LIKE '%_START'
-                    ORDER BY
-                        CASE 
-                            WHEN source = 'cloud' THEN 1
-                            WHEN source = 'remote' THEN 2
-                            ELSE 3
-                        END,
-                        timestamp DESC
+                    WHERE is_processed = false AND command_kind = 'start'
+                    ORDER BY source_priority, timestamp DESC
                     LIMIT 1;
                     IF NOT FOUND THEN
+                        -- local first, then remote, then cloud
                         SELECT * INTO selected_command FROM {COMMANDS_RECORD}
-                        WHERE is_processed = false AND command LIKE '%_STOP'
-                        ORDER BY
-                            CASE
-                                WHEN source = 'local' THEN 1
-                                WHEN source = 'remote' THEN 2
-                                WHEN source = 'cloud' THEN 3
-                                ELSE 4
-                            END,
-                            timestamp DESC
+                        WHERE is_processed = false AND command_kind = 'stop'
+                        ORDER BY source_priority DESC, timestamp DESC
                         LIMIT 1;
                     END IF;
                 -- If is_disabled is false
                 ELSE
                     SELECT * INTO selected_command FROM {COMMANDS_RECORD}
-                    WHERE is_processed = false AND command LIKE '%_START'
-                    ORDER BY
-                        CASE
-                            WHEN source = 'cloud' THEN 1
-                            WHEN source = 'remote' THEN 2
-                            WHEN source = 'local' THEN 3
-                            ELSE 4
-                        END,
-                        timestamp DESC
+                    WHERE is_processed = false AND command_kind = 'start'
+                    ORDER BY source_priority, timestamp DESC
                     LIMIT 1;
                     IF NOT FOUND THEN
+                        -- local first, then remote, then cloud
                         SELECT * INTO selected_command FROM {COMMANDS_RECORD}
-                        WHERE is_processed = false AND command LIKE '%_STOP'
-                        ORDER BY
-                            CASE
-                                WHEN source = 'local' THEN 1
-                                WHEN source = 'remote' THEN 2
-                                WHEN source = 'cloud' THEN 3
-                                ELSE 4
-                            END,
-                            timestamp DESC
+                        WHERE is_processed = false AND command_kind = 'stop'
+                        ORDER BY source_priority DESC, timestamp DESC
                         LIMIT 1;
                     END IF;
                 END IF;
@@ -283,15 +302,38 @@ PROCEDURES_CREATE_COMMANDS = {
                 ON CONFLICT (id)
                 DO UPDATE SET command_id = excluded.command_id, command_status = excluded.command_status, timestamp = CURRENT_TIMESTAMP;
 
+                -- only the pending commands are touched, the processed history is never rewritten
                 UPDATE {COMMANDS_RECORD}
                 SET is_processed = true,
-                    is_activated = CASE WHEN command_id = selected_command.command_id THEN true ELSE is_activated END;
+                    is_activated = CASE WHEN command_id = selected_command.command_id THEN true ELSE is_activated END
+                WHERE is_processed = false;
 
             END IF;
             RETURN NEW;
         END;
         $$ LANGUAGE plpgsql;
     """,
+    NOTIFY_CURRENT_PANEL_SELECTION : f"""
+        CREATE OR REPLACE FUNCTION {NOTIFY_CURRENT_PANEL_SELECTION} ()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify(
+                '{PANEL_SELECTION_CHANNEL}',
+                json_build_object('id', NEW.id, 'panel_selection', NEW.panel_selection)::text
+            );
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    NOTIFY_CONFIGS_RECORD_CHANGED : f"""
+        CREATE OR REPLACE FUNCTION {NOTIFY_CONFIGS_RECORD_CHANGED} ()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify('{CONFIGS_CHANNEL}', TG_OP);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
     # GENERATE_COMMANDS_RECORD : f"""
     #     CREATE OR REPLACE FUNCTION {GENERATE_COMMANDS_RECORD} ()
     #     RETURNS TRIGGER AS $$
@@ -449,6 +491,33 @@ TRIGGERS_FOR_GENERATE_CURRENT_COMMAND = f"""
         END $$;   
     """
 
+TRIGGERS_FOR_PANEL_SELECTION_NOTIFY = f"""
+        -- Trigger for current_panel_selection, only unprocessed selections wake up the listener
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{TRIGGER_ON_CURRENT_PANEL_SELECTION}') THEN
+                CREATE TRIGGER {TRIGGER_ON_CURRENT_PANEL_SELECTION}
+                AFTER INSERT OR UPDATE ON {CURRENT_PANEL_SELECTION}
+                FOR EACH ROW
+                WHEN (NEW.is_processed = false)
+                EXECUTE FUNCTION {NOTIFY_CURRENT_PANEL_SELECTION}();
+            END IF;
+        END $$;
+    """
+
+TRIGGERS_FOR_CONFIGS_NOTIFY = f"""
+        -- Trigger for configs_record, once per statement, the machine config gets reloaded as a whole
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{TRIGGER_ON_CONFIGS_RECORD}') THEN
+                CREATE TRIGGER {TRIGGER_ON_CONFIGS_RECORD}
+                AFTER INSERT OR UPDATE OR DELETE ON {CONFIGS_RECORD}
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {NOTIFY_CONFIGS_RECORD_CHANGED}();
+            END IF;
+        END $$;
+    """
+
 class Testing:
     def __init__(self) -> None:
         self._current_timezone = pytz.timezone(TIMEZONE)
@@ -463,8 +532,10 @@ class Testing:
         )
         self._machine_id = "machine123"
         self._conn_str = self._get_valid_connection_str('testing', 'postgres', 'entersecretpassword', POSTGRES_SERVICE_NAME)
+        self._pool = self._create_pool(self._conn_str)
         # self._setup_database()
-        self._machine_config = self._get_all_configs()
+        self._load_machine_config()
+        self._scheduler = TimerScheduler("panel_selection_timers").start()
 
     def _setup_enums(self, _conn):
         for _enum_type, _command in ENUMS.items():
@@ -483,24 +554,36 @@ class Testing:
             else:
                 logging.debug(f"Table name {_table_name} already exists.")
 
+    def _setup_columns(self, _conn):
+        for _table_name, _command in DATABASE_COLUMNS_ADDED.items():
+            with _conn.cursor() as cur:
+                cur.execute(_command)
+
     def _setup_procedures(self, _conn):
         for _procedure_name, _command in PROCEDURES_CREATE_COMMANDS.items():
             with _conn.cursor() as cur:
                 cur.execute(_command)
 
+    def _setup_indexes(self, _conn):
+        for _index_name, _command in DATABASE_INDEXES.items():
+            with _conn.cursor() as cur:
+                cur.execute(_command)
+
     def _setup_triggers(self, _conn):
         with _conn.cursor() as cur:
             cur.execute(TRIGGERS_FOR_GENERATE_CURRENT_COMMAND)
+            cur.execute(TRIGGERS_FOR_PANEL_SELECTION_NOTIFY)
+            cur.execute(TRIGGERS_FOR_CONFIGS_NOTIFY)
 
     def _setup_database(self):
         try:
-            _db_connection = psycopg2.connect(self._conn_str)
-            _db_connection.autocommit = True
-            self._setup_enums(_db_connection)
-            self._setup_tables(_db_connection)
-            self._setup_procedures(_db_connection)
-            self._setup_triggers(_db_connection)            
-            _db_connection.close()
+            with self._pool.connection(autocommit=True) as _db_connection:
+                self._setup_enums(_db_connection)
+                self._setup_tables(_db_connection)
+                self._setup_columns(_db_connection)
+                self._setup_indexes(_db_connection)
+                self._setup_procedures(_db_connection)
+                self._setup_triggers(_db_connection)            
         except Error as e:
             logging.error(f"(f) _setup_db_cursor - An error occured: {e}")
             raise SystemExit(1)
@@ -520,15 +603,23 @@ class Testing:
                         # cur.execute(f"CREATE DATABASE {db_name};")
                         cur.execute(_command_str)
                         logging.warning(f"Database {db_name} created successfully.")
+                temp_db_connection.close()
+            # the connection string gets validated by the first connection of the pool
             _conn_str = f"dbname='{db_name}' user='{username}' password='{password}' host='{host}' port='{port}'"
-            db_connection = psycopg2.connect(_conn_str)
-            db_connection.autocommit = True
-            db_connection.close()
             return _conn_str
         except Error as e:
             logging.error(f"(f) _get_valid_connection_str - An error occured: {e}")
             raise SystemExit(1)
 
+    def _create_pool(self, _conn_str):
+        try:
+            return DatabasePool(
+                _conn_str, DB_POOL_MIN_CONN, DB_POOL_MAX_CONN, DB_POOL_CHECKOUT_TIMEOUT, DB_POOL_HEALTH_CHECK_IDLE_SEC
+            )
+        except Error as e:
+            logging.error(f"(f) _create_pool - An error occured: {e}")
+            raise SystemExit(1)
+
     def table_exists(self, _conn, table_name):
         with _conn.cursor() as cur:
             cur.execute(
@@ -545,28 +636,49 @@ class Testing:
         ''' Pull all the rows from the table 
         and combine as one big dict by using config_name as key'''
         _combined_configs = {}
-        # pull all data
-        # append each indivadual to _combined_configs
+        try:
+            with self._pool.connection(autocommit=True) as _conn:
+                with _conn.cursor(cursor_factory=DictCursor) as cur:
+                    # the latest active row of every config_name
+                    cur.execute(f"""
+                        SELECT DISTINCT ON (config_name) config_name, config FROM {CONFIGS_RECORD}
+                        WHERE is_active = true
+                        ORDER BY config_name, timestamp DESC;
+                    """)
+                    for row in cur.fetchall():
+                        _combined_configs[row["config_name"]] = row["config"]
+        except Error as e:
+            logging.error(f"(f) _get_all_configs - an error occure : {e}")
         return _combined_configs
+
+    def _load_machine_config(self):
+        ''' serialized once here, every generated command reuses the same string
+        until the trigger on {CONFIGS_RECORD} reports a change '''
+        self._machine_config = self._get_all_configs()
+        self._machine_config_json = json.dumps(self._machine_config)
     
-    def _fetchone_from_current_type_table(self, _conn, _table_name):
+    def _fetchone_from_current_type_table(self, _table_name):
         try:
-            with _conn.cursor(cursor_factory=DictCursor) as cur:
-                cur.execute(f"SELECT * FROM {_table_name};")
-                row = cur.fetchone()
+            with self._pool.connection(autocommit=True) as _conn:
+                with _conn.cursor(cursor_factory=DictCursor) as cur:
+                    cur.execute(f"SELECT * FROM {_table_name};")
+                    row = cur.fetchone()
             return row
         except Error as e:
             logging.error(f"(f) _fetchone_from_current_data - an error occure : {e}")
             
-    def _check_panel_selection(self, _conn, _current_panel_selection):
+    def _check_panel_selection(self, _current_panel_selection):
         ''' fetchone from {CURRENT_PANEL_SELECTION} table 
         and check if the is_processed flog is true 
         if not read the panel selection and excute accordingly'''
         # fetch data
-        _get_data = self._fetchone_from_current_type_table(_conn, CURRENT_PANEL_SELECTION)
+        _get_data = self._fetchone_from_current_type_table(CURRENT_PANEL_SELECTION)
         # check flag and excute accordingly
         if _get_data is not None and not(_get_data["is_processed"]):
             _new_panel_selection = _get_data["panel_selection"]
+            # a newer selection always wins over the start still waiting for the previous one
+            if self._scheduler.cancel(PANEL_DELAYED_START_KEY):
+                logging.info(f"(f) _check_panel_selection - pending delayed start superseded by {_new_panel_selection}")
             _related_command = "ALL_START" if _new_panel_selection in ["aa","a","b","color"] else "ALL_STOP"
             # when panel_selection have to excute check the prev_panel_selection
             if _current_panel_selection != _new_panel_selection:
@@ -575,51 +687,89 @@ class Testing:
                     # and if prev panel_selection is in [aa,a,b,color] generate stop command 
                     logging.warning("(f) _check_panel_selection - get new panel selection to start new batch while a batch is active")
                     logging.warning("(f) _check_panel_selection - generate local stop command to end current active batch")
-                    self._command_generator(_conn, "ALL_STOP", json.dumps(self._machine_config), "local", self._machine_id, _new_panel_selection)
-                    _delay_start_command = threading.Timer(
+                    self._command_generator("ALL_STOP", self._machine_config_json, "local", self._machine_id, _new_panel_selection)
+                    # _command_generator checks out its own pooled connection on the scheduler thread
+                    self._scheduler.schedule(
+                        PANEL_DELAYED_START_KEY,
                         MIN_SEQUENCE_COMMANDS_WAIT_TIME, 
                         self._command_generator, 
-                        [_conn, _related_command, json.dumps(self._machine_config), "local", self._machine_id, _new_panel_selection])
-                    _delay_start_command.start()
+                        _related_command, self._machine_config_json, "local", self._machine_id, _new_panel_selection)
                 else:
-                    self._command_generator(_conn, _related_command, json.dumps(self._machine_config), "local", self._machine_id, _new_panel_selection)
+                    self._command_generator(_related_command, self._machine_config_json, "local", self._machine_id, _new_panel_selection)
             else:
-                self._command_generator(_conn, _related_command, json.dumps(self._machine_config), "local", self._machine_id, _new_panel_selection)
+                self._command_generator(_related_command, self._machine_config_json, "local", self._machine_id, _new_panel_selection)
             try:
-                with _conn.cursor() as cur:
-                    cur.execute(f"""
-                        UPDATE {CURRENT_PANEL_SELECTION}
-                        SET is_processed = true
-                        WHERE is_processed = false
-                    """)
-                    _conn.commit()
+                with self._pool.connection() as _conn:
+                    with _conn.cursor() as cur:
+                        cur.execute(f"""
+                            UPDATE {CURRENT_PANEL_SELECTION}
+                            SET is_processed = true
+                            WHERE is_processed = false
+                        """)
+                        _conn.commit()
             except Error as e:
                 logging.error(f"(f) _check_panel_selection - Error updating data : {e}")
-                _conn.rollback()
             return _new_panel_selection
         return _current_panel_selection
 
-    def _command_generator(self, _conn, _command, _config, _source, _commander, _panel_selection):
+    def _run_panel_selection_loop(self, _current_panel_selection):
+        ''' keep reacting to the operator panel. In notify mode the trigger on {CURRENT_PANEL_SELECTION} 
+        wakes us up, a poll pass is still done on every (re)connect of the listener 
+        to pick up the selections made while nobody was listening'''
+        self._current_panel_selection = _current_panel_selection
+        if PANEL_SELECTION_MODE != "notify":
+            while True:
+                self._current_panel_selection = self._check_panel_selection(self._current_panel_selection)
+                time.sleep(PANEL_SELECTION_POLL_INTERVAL)
+
+        def _poll_once(_payload=None):
+            self._current_panel_selection = self._check_panel_selection(self._current_panel_selection)
+
+        # only the position the selector settled on gets read, the checks all run on the scheduler thread
+        self._panel_debouncer = PanelSelectionDebouncer(self._scheduler, _poll_once)
+
+        def _on_connect():
+            self._load_machine_config()
+            self._panel_debouncer.submit("connect")
+
+        _listener = NotificationListener(self._conn_str, [PANEL_SELECTION_CHANNEL, CONFIGS_CHANNEL], on_connect=_on_connect)
+        _listener.connect()
+        try:
+            while True:
+                _notifies = _listener.wait(PANEL_SELECTION_LISTEN_TIMEOUT)
+                _channels = {_notify.channel for _notify in _notifies}
+                if CONFIGS_CHANNEL in _channels:
+                    self._load_machine_config()
+                for _notify in _notifies:
+                    if _notify.channel == PANEL_SELECTION_CHANNEL:
+                        logging.debug(f"(f) _run_panel_selection_loop - got {_notify.payload}")
+                        # the row itself still holds the is_processed flag, one read handles a burst of notifies
+                        self._panel_debouncer.submit(_notify.payload)
+        finally:
+            _listener.close()
+            logging.info(f"panel selection debounce stats - {self._panel_debouncer.stats()}")
+
+    def _command_generator(self, _command, _config, _source, _commander, _panel_selection):
+        ''' safe to call from any thread, every call checks out its own pooled connection '''
         try:
-            with _conn.cursor(cursor_factory=DictCursor) as cur:
-                cur.execute(f"""
-                    INSERT INTO {COMMANDS_RECORD} (command, machine_config, source, commander_id, panel_selection)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING command_id;
-                """, (_command, _config, _source, _commander, _panel_selection))
-                _new_id = cur.fetchone()["command_id"]
-                logging.info(f"new row with id - {_new_id} insert to table {COMMANDS_RECORD}")
-                _conn.commit()
+            with self._pool.connection() as _conn:
+                with _conn.cursor(cursor_factory=DictCursor) as cur:
+                    cur.execute(f"""
+                        INSERT INTO {COMMANDS_RECORD} (command, machine_config, source, commander_id, panel_selection)
+                        VALUES (%s, %s, %s, %s, %s)
+                        RETURNING command_id;
+                    """, (_command, _config, _source, _commander, _panel_selection))
+                    _new_id = cur.fetchone()["command_id"]
+                    logging.info(f"new row with id - {_new_id} insert to table {COMMANDS_RECORD}")
+                    _conn.commit()
         except Error as e:
             logging.error(f"(f) _command_generator - Error inserting data : {e}")
-            _conn.rollback()
 
 if __name__=="__main__":
     testing = Testing()
-    _conn = psycopg2.connect(testing._conn_str)
-    _conn.autocommit = True
-    _current_panel_selection = "off"
-    for a in range(10):
-        current_panel_selection = testing._check_panel_selection(_conn, _current_panel_selection)
-        time.sleep(2)
-    pass
\ No newline at end of file
+    try:
+        testing._run_panel_selection_loop("off")
+    finally:
+        testing._scheduler.stop()
+        logging.info(f"pool stats - {testing._pool.stats()}")
+        testing._pool.closeall()
\ No newline at end of file
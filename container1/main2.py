@@ -1,3 +1,5 @@
+import csv
+import io
 import logging
 import json
 import threading
@@ -7,17 +9,38 @@ import pytz
 import psycopg2
 
 from psycopg2 import OperationalError, Error, errors
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
 
 from enum import Enum
 from time import monotonic
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from db_pool import DatabasePool
 
 TIMEZONE = os.getenv("TIMEZONE", "Asia/Bangkok")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 # POSTGRES_SERVICE_NAME = os.getenv("POSTGRES_SERVICE_NAME","localhost")
 POSTGRES_DB_IP = "localhost"
+POSTGRES_DB_NAME = os.getenv("POSTGRES_DB_NAME", "aii_sortermachine")
 MIN_SEQUENCE_COMMANDS_WAIT_TIME = os.getenv("MIN_SEQUENCE_COMMANDS_WAIT_TIME", 10)
+DB_POOL_MIN_CONN = int(os.getenv("DB_POOL_MIN_CONN", 1))
+DB_POOL_MAX_CONN = int(os.getenv("DB_POOL_MAX_CONN", 5))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", 10))
+DB_POOL_HEALTH_CHECK_IDLE_SEC = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE_SEC", 30))
+QUERY_PLAN_SEQ_SCAN_MIN_ROWS = int(os.getenv("QUERY_PLAN_SEQ_SCAN_MIN_ROWS", 1000))
+PARTITION_RECORD_TABLES = os.getenv("PARTITION_RECORD_TABLES", "false").lower() == "true"
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", 2))
+SINGLETON_STORAGE_PROFILE = os.getenv("SINGLETON_STORAGE_PROFILE", "false").lower() == "true"
+SINGLETON_FILLFACTOR = int(os.getenv("SINGLETON_FILLFACTOR", 50))
+SINGLETON_BLOAT_DEAD_RATIO = float(os.getenv("SINGLETON_BLOAT_DEAD_RATIO", 0.2))
+# every consumer group gets its own copy of each commands_record row in commands_queue
+# acked commands_queue rows are kept this long for inspection, then deleted by the retention job
+COMMANDS_QUEUE_ACKED_RETENTION_HOURS = int(os.getenv("COMMANDS_QUEUE_ACKED_RETENTION_HOURS", 24))
+COMMANDS_QUEUE_GROUPS = [_group.strip() for _group in os.getenv("COMMANDS_QUEUE_GROUPS", "ros_bridge,uploader,auditor").split(",") if _group.strip()]
+# "sync": the panel_selections_record triggers arbitrate inside the insert, 
+# "deferred": the insert only queues a panel_selection_jobs row, panel_jobs.PanelSelectionJobWorker arbitrates it.
+# The mode is the state of the triggers in the database, switched with panel_arbitration_mode.py only
+PANEL_ARBITRATION_MODES = ("sync", "deferred")
 
 LOGGING_LEVEL_DICT = {
     "CRITICAL": logging.CRITICAL,
@@ -61,6 +84,24 @@ CURRENT_PANEL_SELECTION = "current_panel_selection"
 CURRENT_CREDITS_BALANCE = "current_credits_balance"
 CURRENT_NODES_STATUS = "current_nodes_status"
 CURRENT_SORTER_DISPLAY = "current_sorter_display"
+CURRENT_MACHINE_STATE = "current_machine_state"
+COMMANDS_QUEUE = "commands_queue"
+COMMANDS_QUEUE_VIEW = "commands_queue_view"
+PANEL_SELECTION_JOBS = "panel_selection_jobs"
+COMMAND_STATUS_RECORD = "command_status_record"
+
+MACHINE_STATE_CHANNEL = "current_machine_state_changed"
+ACTIVE_FAULTS_CHANNEL = "ros_nodes_error_changed"
+COMMAND_CONFIG_CHANNEL = "command_config_changed"
+REMOTE_SESSION_CHANNEL = "remote_control_session_changed"
+CURRENT_COMMAND_CHANNEL = "current_command_changed"
+COMMANDS_QUEUE_CHANNEL = "commands_queue_changed"
+PANEL_SELECTION_JOBS_CHANNEL = "panel_selection_jobs_changed"
+COMMAND_STATUS_CHANNEL = "command_status_changed"
+# transaction local setting, while 'on' the command chain triggers leave the work to submit_command()
+SUBMIT_COMMAND_SETTING = "aii.submit_command"
+# transaction local setting, while 'on' the rows of the source tables are handled per statement (bulk ingestion)
+BULK_INGEST_SETTING = "aii.bulk_ingest"
 
 ''' Store Procedures '''
 TURN_OFF_IS_LATEST_FLAG = "turn_off_is_latest_flag"
@@ -68,6 +109,15 @@ TURN_OFF_IS_ACTIVE_FLAG = "turn_off_is_active_flag"
 UPDATE_CURRENT_FACTORY_INFO = "update_current_factory_info"
 UPDATE_CURRENT_MACHINE_CONTROL_FLAGS = "update_machine_control_flags"
 UPDATE_CURRENT_COMMAND = "generate_current_command"
+ARBITRATE_COMMAND = "arbitrate_command"
+ARBITRATION_DECISION = "arbitration_decision"
+ENQUEUE_COMMANDS_RECORD = "enqueue_commands_record"
+ENQUEUE_PANEL_SELECTION_JOB = "enqueue_panel_selection_job"
+PROCESS_PANEL_SELECTION_JOBS = "process_panel_selection_jobs"
+PANEL_SELECTION_IS_DUPLICATE = "panel_selection_is_duplicate"
+COMMAND_AGGREGATE_STATUS = "command_aggregate_status"
+APPLY_COMMAND_STATUS_RECORD = "apply_command_status_record"
+SUBMIT_COMMAND = "submit_command"
 CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD = "check_to_insert_remote_control_false_record"
 INSERT_ROS_NODES_ERROR_RECORD = "insert_ros_nodes_error_record"
 INSERT_PANEL_SELECTIONS_RECORD = "insert_panel_selection_record"
@@ -75,6 +125,18 @@ INSERT_SELF_URGENT_STOP_COMMANDS_RECORD = "insert_self_urgent_stop_commands_reco
 INSERT_COMMANDS_RECORD = "insert_commands_record"
 CHECK_COMMAND_DURATION_TO_STOP = "check_command_duration_to_stop"
 GET_TOWERLIGHT_INDICATOR_FLAGS = "get_towerlight_indication_flags"
+REFRESH_CURRENT_MACHINE_STATE = "refresh_current_machine_state"
+UPDATE_CURRENT_MACHINE_STATE_FAULTS = "update_current_machine_state_faults"
+NOTIFY_CURRENT_MACHINE_STATE = "notify_current_machine_state"
+OPEN_ROS_NODE_FAULT = "open_ros_node_fault"
+CLOSE_ROS_NODE_FAULT = "close_ros_node_fault"
+NOTIFY_ROS_NODES_ERROR_RECORD = "notify_ros_nodes_error_record"
+RESET_IS_UPLOADED_FLAG = "reset_is_uploaded_flag"
+NOTIFY_COMMAND_CONFIG_CHANGED = "notify_command_config_changed"
+EXPIRE_REMOTE_CONTROL_SESSION = "expire_remote_control_session"
+NOTIFY_REMOTE_CONTROL_SESSION = "notify_remote_control_session"
+NOTIFY_CURRENT_COMMAND = "notify_current_command"
+STOP_TIMED_COMMAND = "stop_timed_command"
 
 ''' Triggers '''
 REGISTRATION_RECORD_BEFORE_INSERTED_TRIGGER = "registration_record_before_insert_trigger"
@@ -96,10 +158,49 @@ PANEL_SELECTIONS_RECORD_INSERTED_TRIGGER = "panel_selection_record_inserted_trig
 SELF_URGENT_STOP_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER = "self_urgent_stop_commands_record_before_inserted_trigger"
 SELF_URGENT_STOP_COMMANDS_RECORD_INSERTED_TRIGGER = "self_urgent_stop_commands_record_inserted_trigger"
 CURRENT_PANEL_SELECTION_UPDATED_TRIGGER = "current_panel_selection_updated_trigger"
+CURRENT_PANEL_SELECTION_BEFORE_UPDATED_TRIGGER = "current_panel_selection_before_updated_trigger"
 COMMANDS_RECORD_INSERTED_TRIGGER = "commands_record_inserted_trigger"
 COMMAND_MAP_NODE_CONFIG_MAP_BEFORE_INSERT_TRIGGER = "command_map_node_config_map_before_insert_trigger"
+ROS_NODES_ERROR_RECORD_CHANGED_TRIGGER = "ros_nodes_error_record_changed_trigger"
+ROS_NODES_WARNING_RECORD_CHANGED_TRIGGER = "ros_nodes_warning_record_changed_trigger"
+CURRENT_MACHINE_STATE_UPDATED_TRIGGER = "current_machine_state_updated_trigger"
+ROS_NODES_ERROR_RECORD_NOTIFY_TRIGGER = "ros_nodes_error_record_notify_trigger"
+COMMAND_MAP_CHANGED_TRIGGER = "command_map_changed_trigger"
+COMMAND_MAP_NODE_CONFIG_MAP_CHANGED_TRIGGER = "command_map_node_config_map_changed_trigger"
+ROS_NODES_CONFIGS_CHANGED_TRIGGER = "ros_nodes_configs_changed_trigger"
+REMOTE_CONTROL_RECORD_NOTIFY_TRIGGER = "remote_control_record_notify_trigger"
+CURRENT_COMMAND_UPDATED_TRIGGER = "current_command_updated_trigger"
+COMMANDS_RECORD_ENQUEUE_TRIGGER = "commands_record_enqueue_trigger"
+PANEL_SELECTIONS_RECORD_JOB_TRIGGER = "panel_selection_record_job_trigger"
+COMMAND_STATUS_RECORD_INSERTED_TRIGGER = "command_status_record_inserted_trigger"
+
+# tables carrying an is_uploaded flag, streamed to the cloud by outbox.OutboxUploader
+UPLOAD_TABLES = [
+    MACHINE_REGISTRATION_RECORD,
+    MACHINE_DISABLE_ENABLE_RECORD,
+    REMOTE_CONTROL_RECORD,
+    TECHNICIAN_COMMANDS_RECORD,
+    CALL_CENTER_COMMANDS_RECORD,
+    PANEL_SELECTIONS_RECORD,
+    SELF_URGENT_STOP_COMMANDS_RECORD,
+    COMMANDS_RECORD,
+    ROS_NODES_CONFIGS,
+    CURRENT_PANEL_SELECTION,
+]
+
+TABLES_WITH_DEFAULT_ROW = [CURRENT_FACTORY_INFO, CURRENT_MACHINE_CONTROL_FLAGS, CURRENT_COMMAND, CURRENT_PANEL_SELECTION, CURRENT_MACHINE_STATE]
 
-TABLES_WITH_DEFAULT_ROW = [CURRENT_FACTORY_INFO, CURRENT_MACHINE_CONTROL_FLAGS, CURRENT_COMMAND, CURRENT_PANEL_SELECTION]
+# storage of the single row tables above when SINGLETON_STORAGE_PROFILE is on. The free space left on the page
+# keeps every update HOT (same page, no index entry) and the row is vacuumed after a fixed number of updates
+# instead of a fraction of a table that never grows
+SINGLETON_TABLE_STORAGE = f"""
+    fillfactor = {SINGLETON_FILLFACTOR},
+    autovacuum_vacuum_scale_factor = 0,
+    autovacuum_vacuum_threshold = 200,
+    autovacuum_analyze_scale_factor = 0,
+    autovacuum_analyze_threshold = 5000,
+    autovacuum_vacuum_cost_delay = 0
+"""
 
 ENUMS = {
     "source_enum":"""
@@ -376,45 +477,607 @@ DATABASE_TABLES = {
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
     """,
+    # towerlight / HMI flags, kept up to date by the triggers of the tables they come from
+    CURRENT_MACHINE_STATE: f"""
+        CREATE TABLE {CURRENT_MACHINE_STATE} (
+            id SERIAL PRIMARY KEY,
+            is_remote BOOLEAN NOT NULL DEFAULT false,
+            is_unregistered BOOLEAN NOT NULL DEFAULT false,
+            is_disabled BOOLEAN NOT NULL DEFAULT false,
+            is_service BOOLEAN NOT NULL DEFAULT false,
+            is_error BOOLEAN NOT NULL DEFAULT false,
+            is_warning BOOLEAN NOT NULL DEFAULT false,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """,
+    # one row per (consumer group, commands_record row), claimed with FOR UPDATE SKIP LOCKED (see command_queue.py).
+    # a claim hides the row until visible_at, a row never acked shows up again there with one more attempt.
+    # no foreign key, commands_record may be partitioned
+    COMMANDS_QUEUE: f"""
+        CREATE TABLE {COMMANDS_QUEUE} (
+            id BIGSERIAL PRIMARY KEY,
+            consumer_group VARCHAR(56) NOT NULL,
+            command_record_id INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            visible_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            claimed_by VARCHAR(128),
+            is_acked BOOLEAN NOT NULL DEFAULT false,
+            last_error TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (consumer_group, command_record_id)
+        );
+    """,
+    # deferred panel arbitration, one row per panel_selections_record row, applied in id order.
+    # status / reason are the arbitration outcome (or blocked / duplicate, error / sqlstate)
+    PANEL_SELECTION_JOBS: f"""
+        CREATE TABLE {PANEL_SELECTION_JOBS} (
+            id BIGSERIAL PRIMARY KEY,
+            panel_selection_id INTEGER NOT NULL,
+            command_record_id INTEGER,
+            status VARCHAR(16),
+            reason VARCHAR(32),
+            processed_at TIMESTAMP,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """,
+    # status reports of the ros nodes about a command, the latest one about the current command moves current_command.
+    # no foreign key to commands_record, it may be partitioned
+    COMMAND_STATUS_RECORD: f"""
+        CREATE TABLE {COMMAND_STATUS_RECORD} (
+            id SERIAL PRIMARY KEY,
+            command_record_id INTEGER NOT NULL,
+            command_status_id INTEGER REFERENCES {VALID_COMMAND_STATUS}(id) NOT NULL,
+            node_type VARCHAR(56),
+            node_name VARCHAR(56),
+            error_msg TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """,
     # "CURRENT_SORTER_DISPLAY" : f"""
     #     CREATE TABLE {CURRENT_SORTER_DISPLAY} ();
     # """
 }
 
-PROCEDURES_CREATE_SQL_COMMANDS_DICT = {
-    TURN_OFF_IS_LATEST_FLAG : f"""
-        CREATE OR REPLACE FUNCTION {TURN_OFF_IS_LATEST_FLAG}()
+''' Monthly range partitioned versions of the append only record tables, used instead of the DATABASE_TABLES
+ones when PARTITION_RECORD_TABLES is on (postgres 13 or later, for the row triggers on partitioned tables).
+The primary keys include the partition key and nothing can reference a partitioned table, so the foreign keys
+from commands_record to the source tables and from current_command to commands_record are left out.
+Tables created before the flag got turned on stay as they are '''
+PARTITION_KEYS = {
+    TECHNICIAN_COMMANDS_RECORD: "timestamp",
+    CALL_CENTER_COMMANDS_RECORD: "timestamp",
+    PANEL_SELECTIONS_RECORD: "timestamp",
+    SELF_URGENT_STOP_COMMANDS_RECORD: "timestamp",
+    COMMANDS_RECORD: "timestamp",
+    ROS_NODES_ERROR_RECORD: "error_start_time",
+    ROS_NODES_WARNING_RECORD: "warning_start_time",
+}
+
+PARTITIONED_DATABASE_TABLES = {
+    TECHNICIAN_COMMANDS_RECORD: f"""
+        CREATE TABLE {TECHNICIAN_COMMANDS_RECORD} (
+            id SERIAL,
+            command_str VARCHAR(56),
+            remote_id INTEGER REFERENCES {REMOTE_CONTROL_RECORD}(id) NULL,
+            technician_id VARCHAR(128),
+            command_config JSON,
+            factory_id VARCHAR(56),
+            machine_id INTEGER REFERENCES {MACHINE_INFO}(id) NULL,
+            is_uploaded BOOLEAN NOT NULL DEFAULT false,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+    """,
+    CALL_CENTER_COMMANDS_RECORD: f"""
+        CREATE TABLE {CALL_CENTER_COMMANDS_RECORD} (
+            id SERIAL,
+            command_str VARCHAR(56),
+            remote_id INTEGER REFERENCES {REMOTE_CONTROL_RECORD}(id) NULL,
+            agent_id VARCHAR(128),
+            command_config JSON,
+            factory_id VARCHAR(56),
+            machine_id INTEGER REFERENCES {MACHINE_INFO}(id) NULL,
+            is_uploaded BOOLEAN NOT NULL DEFAULT false,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+    """,
+    PANEL_SELECTIONS_RECORD: f"""
+        CREATE TABLE {PANEL_SELECTIONS_RECORD} (
+            id SERIAL,
+            command_str VARCHAR(8),
+            factory_id VARCHAR(56),
+            machine_id INTEGER REFERENCES {MACHINE_INFO}(id) NULL,
+            is_uploaded BOOLEAN NOT NULL DEFAULT false,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+    """,
+    SELF_URGENT_STOP_COMMANDS_RECORD: f"""
+        CREATE TABLE {SELF_URGENT_STOP_COMMANDS_RECORD} (
+            id SERIAL,
+            command_str VARCHAR(16) NOT NULL DEFAULT 'self_stop' CHECK (command_str = 'self_stop'),
+            disable_enable_id INTEGER NULL,
+            error_id INTEGER NULL,
+            invalid_command_record_id INTEGER NULL,
+            factory_id VARCHAR(56),
+            machine_id INTEGER REFERENCES {MACHINE_INFO}(id) NULL,
+            is_uploaded BOOLEAN NOT NULL DEFAULT false,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+    """,
+    COMMANDS_RECORD: f"""
+        CREATE TABLE {COMMANDS_RECORD} (
+            id SERIAL,
+            command_map_id INTEGER REFERENCES {COMMAND_MAP}(id) NULL,
+            command_config JSON,
+            technician_command_id INTEGER NULL,
+            call_center_command_id INTEGER NULL,
+            panel_selection_id INTEGER NULL,
+            self_urgent_stop_id INTEGER NULL,
+            is_processed BOOLEAN NOT NULL DEFAULT false,
+            is_activated BOOLEAN NOT NULL DEFAULT false,
+            is_uploaded BOOLEAN NOT NULL DEFAULT false,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+    """,
+    ROS_NODES_ERROR_RECORD: f"""
+        CREATE TABLE {ROS_NODES_ERROR_RECORD} (
+            id SERIAL,
+            node_type VARCHAR(56),
+            node_name VARCHAR(56),
+            error_msg VARCHAR(255),
+            factory_id VARCHAR(56),
+            machine_id INTEGER REFERENCES {MACHINE_INFO}(id) NULL,
+            error_start_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            error_end_time TIMESTAMP DEFAULT NULL,
+            PRIMARY KEY (id, error_start_time)
+        ) PARTITION BY RANGE (error_start_time);
+    """,
+    ROS_NODES_WARNING_RECORD: f"""
+        CREATE TABLE {ROS_NODES_WARNING_RECORD} (
+            id SERIAL,
+            node_type VARCHAR(56),
+            node_name VARCHAR(56),
+            warning_msg VARCHAR(255),
+            factory_id VARCHAR(56),
+            machine_id INTEGER REFERENCES {MACHINE_INFO}(id) NULL,
+            warning_start_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            warning_end_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, warning_start_time)
+        ) PARTITION BY RANGE (warning_start_time);
+    """,
+    CURRENT_COMMAND: f"""
+        CREATE TABLE {CURRENT_COMMAND} (
+            id SERIAL PRIMARY KEY,
+            command_record_id INTEGER NULL,
+            command_status_id INTEGER REFERENCES {VALID_COMMAND_STATUS}(id) NULL,
+            consecutive_failed_command_count INTEGER DEFAULT 0,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """,
+}
+
+def partition_name(_table_name, _month_start):
+    return f"{_table_name}_p{_month_start.strftime('%Y_%m')}"
+
+DATABASE_INDEXES = {
+    # at most one latest row per table, the index is also the O(1) pointer used by every WHERE is_latest = true
+    f"{MACHINE_REGISTRATION_RECORD}_latest_idx": f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {MACHINE_REGISTRATION_RECORD}_latest_idx
+        ON {MACHINE_REGISTRATION_RECORD} ((is_latest)) WHERE is_latest = true;
+    """,
+    f"{MACHINE_DISABLE_ENABLE_RECORD}_latest_idx": f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {MACHINE_DISABLE_ENABLE_RECORD}_latest_idx
+        ON {MACHINE_DISABLE_ENABLE_RECORD} ((is_latest)) WHERE is_latest = true;
+    """,
+    f"{REMOTE_CONTROL_RECORD}_latest_idx": f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {REMOTE_CONTROL_RECORD}_latest_idx
+        ON {REMOTE_CONTROL_RECORD} ((is_latest)) WHERE is_latest = true;
+    """,
+    # ORDER BY timestamp DESC LIMIT 1 of the BEFORE INSERT duplicate checks
+    f"{PANEL_SELECTIONS_RECORD}_timestamp_idx": f"""
+        CREATE INDEX IF NOT EXISTS {PANEL_SELECTIONS_RECORD}_timestamp_idx
+        ON {PANEL_SELECTIONS_RECORD} (timestamp DESC);
+    """,
+    f"{TECHNICIAN_COMMANDS_RECORD}_timestamp_idx": f"""
+        CREATE INDEX IF NOT EXISTS {TECHNICIAN_COMMANDS_RECORD}_timestamp_idx
+        ON {TECHNICIAN_COMMANDS_RECORD} (timestamp DESC);
+    """,
+    f"{CALL_CENTER_COMMANDS_RECORD}_timestamp_idx": f"""
+        CREATE INDEX IF NOT EXISTS {CALL_CENTER_COMMANDS_RECORD}_timestamp_idx
+        ON {CALL_CENTER_COMMANDS_RECORD} (timestamp DESC);
+    """,
+    f"{COMMANDS_RECORD}_timestamp_idx": f"""
+        CREATE INDEX IF NOT EXISTS {COMMANDS_RECORD}_timestamp_idx
+        ON {COMMANDS_RECORD} (timestamp DESC);
+    """,
+    # latest activated command, and latest activation of one panel selection
+    f"{COMMANDS_RECORD}_activated_idx": f"""
+        CREATE INDEX IF NOT EXISTS {COMMANDS_RECORD}_activated_idx
+        ON {COMMANDS_RECORD} (timestamp DESC) WHERE is_activated = true;
+    """,
+    f"{COMMANDS_RECORD}_panel_selection_activated_idx": f"""
+        CREATE INDEX IF NOT EXISTS {COMMANDS_RECORD}_panel_selection_activated_idx
+        ON {COMMANDS_RECORD} (panel_selection_id, timestamp DESC) WHERE is_activated = true;
+    """,
+    # recent call center commands looked up on every panel selection change
+    f"{COMMANDS_RECORD}_call_center_idx": f"""
+        CREATE INDEX IF NOT EXISTS {COMMANDS_RECORD}_call_center_idx
+        ON {COMMANDS_RECORD} (timestamp DESC) WHERE call_center_command_id IS NOT NULL;
+    """,
+    f"{COMMAND_MAP}_command_str_idx": f"""
+        CREATE INDEX IF NOT EXISTS {COMMAND_MAP}_command_str_idx
+        ON {COMMAND_MAP} (command_str);
+    """,
+    f"{COMMAND_MAP_NODE_CONFIG_MAP}_command_node_idx": f"""
+        CREATE INDEX IF NOT EXISTS {COMMAND_MAP_NODE_CONFIG_MAP}_command_node_idx
+        ON {COMMAND_MAP_NODE_CONFIG_MAP} (command_map_id, node_type);
+    """,
+    # only the still open errors / warnings are ever looked up, the closed history stays out of the index.
+    # not unique, a node can report the same fault again before the first one got closed
+    f"{ROS_NODES_ERROR_RECORD}_open_idx": f"""
+        CREATE INDEX IF NOT EXISTS {ROS_NODES_ERROR_RECORD}_open_idx
+        ON {ROS_NODES_ERROR_RECORD} (node_type, node_name) WHERE error_end_time IS NULL;
+    """,
+    f"{ROS_NODES_WARNING_RECORD}_open_idx": f"""
+        CREATE INDEX IF NOT EXISTS {ROS_NODES_WARNING_RECORD}_open_idx
+        ON {ROS_NODES_WARNING_RECORD} (node_type, node_name) WHERE warning_end_time IS NULL;
+    """,
+}
+
+# the claimable rows of a consumer group, in claim order. The acked ones leave the index
+DATABASE_INDEXES[f"{COMMANDS_QUEUE}_pending_idx"] = f"""
+    CREATE INDEX IF NOT EXISTS {COMMANDS_QUEUE}_pending_idx
+    ON {COMMANDS_QUEUE} (consumer_group, id) WHERE is_acked = false;
+"""
+DATABASE_INDEXES[f"{COMMAND_STATUS_RECORD}_command_record_idx"] = f"""
+    CREATE INDEX IF NOT EXISTS {COMMAND_STATUS_RECORD}_command_record_idx
+    ON {COMMAND_STATUS_RECORD} (command_record_id, id DESC);
+"""
+DATABASE_INDEXES[f"{PANEL_SELECTION_JOBS}_pending_idx"] = f"""
+    CREATE INDEX IF NOT EXISTS {PANEL_SELECTION_JOBS}_pending_idx
+    ON {PANEL_SELECTION_JOBS} (id) WHERE processed_at IS NULL;
+"""
+
+# the not yet uploaded rows of every upload table, walked in id order by the uploader
+DATABASE_INDEXES.update({
+    f"{_table_name}_not_uploaded_idx": f"""
+        CREATE INDEX IF NOT EXISTS {_table_name}_not_uploaded_idx
+        ON {_table_name} (id) WHERE is_uploaded = false;
+    """
+    for _table_name in UPLOAD_TABLES
+})
+
+''' The queries the trigger functions run on every insert, with sample values in place of the plpgsql variables.
+Testing._check_query_plans explains them and reports the ones planning a Seq Scan on a big table '''
+TRIGGER_HOT_QUERIES = {
+    "latest_panel_selection": f"SELECT * FROM {PANEL_SELECTIONS_RECORD} ORDER BY timestamp DESC LIMIT 1",
+    "latest_technician_command": f"SELECT * FROM {TECHNICIAN_COMMANDS_RECORD} ORDER BY timestamp DESC LIMIT 1",
+    "latest_call_center_command": f"SELECT * FROM {CALL_CENTER_COMMANDS_RECORD} ORDER BY timestamp DESC LIMIT 1",
+    "latest_command_record": f"SELECT panel_selection_id FROM {COMMANDS_RECORD} ORDER BY timestamp DESC LIMIT 1",
+    "latest_activated_command_record": f"""
+        SELECT * FROM {COMMANDS_RECORD} WHERE is_activated = true ORDER BY timestamp DESC LIMIT 1
+    """,
+    "latest_panel_selection_activation": f"""
+        SELECT true FROM {COMMANDS_RECORD} WHERE panel_selection_id = 1 AND is_activated = true 
+        ORDER BY timestamp DESC LIMIT 1
+    """,
+    "recent_call_center_command": f"""
+        SELECT cm.eq_panel_selection_id FROM {COMMANDS_RECORD} AS cr
+        JOIN {COMMAND_MAP} AS cm ON cr.command_map_id = cm.id
+        WHERE cr.call_center_command_id IS NOT NULL
+        AND cr.timestamp > LOCALTIMESTAMP - interval '1 minute'
+        LIMIT 1
+    """,
+    "command_map_by_command_str": f"SELECT id FROM {COMMAND_MAP} WHERE command_str = 'ALL_START'",
+    "activate_node_config_map": f"""
+        UPDATE {COMMAND_MAP_NODE_CONFIG_MAP} SET is_active = true WHERE command_map_id = 1 AND node_type = 'sorter'
+    """,
+    "latest_registration": f"SELECT is_registered FROM {MACHINE_REGISTRATION_RECORD} WHERE is_latest = true",
+    "latest_disable_enable": f"SELECT is_disabled FROM {MACHINE_DISABLE_ENABLE_RECORD} WHERE is_latest = true",
+    "latest_remote_control": f"SELECT session_expired_time FROM {REMOTE_CONTROL_RECORD} WHERE is_latest = true",
+    "turn_off_latest_remote_control": f"UPDATE {REMOTE_CONTROL_RECORD} SET is_latest = false WHERE is_latest = true",
+    "open_errors": f"SELECT true FROM {ROS_NODES_ERROR_RECORD} WHERE error_end_time IS NULL",
+    "open_fault_by_node": f"""
+        SELECT id FROM {ROS_NODES_ERROR_RECORD} 
+        WHERE node_type = 'camera' AND node_name = 'camera_1' AND error_end_time IS NULL LIMIT 1
+    """,
+    "open_warnings": f"SELECT true FROM {ROS_NODES_WARNING_RECORD} WHERE warning_end_time IS NULL",
+}
+
+''' Command source tables and which duplicate check their BEFORE INSERT function runs '''
+CHECK_BEFORE_INSERT_SOURCE_TABLES = {
+    PANEL_SELECTIONS_RECORD: "panel",
+    SELF_URGENT_STOP_COMMANDS_RECORD: "self_stop",
+    TECHNICIAN_COMMANDS_RECORD: "technician",
+    CALL_CENTER_COMMANDS_RECORD: "call_center",
+}
+
+def check_before_insert_procedure_name(_table_name):
+    return f"{_table_name}_check_before_insert"
+
+def build_check_before_insert_procedure(_table_name):
+    ''' Statically planned version of {CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD} for one source table.
+    The table shape is known here, so there is no information_schema lookup and no dynamic EXECUTE per insert.
+    The remote session expiry is not checked here anymore, see expire_remote_control_session '''
+    _kind = CHECK_BEFORE_INSERT_SOURCE_TABLES[_table_name]
+    if _kind == "panel":
+        # shared with the deferred mode and submit_command(), which checks before inserting
+        _duplicate_check = f"""
+            IF current_setting('{SUBMIT_COMMAND_SETTING}', true) IS DISTINCT FROM 'on'
+            AND {PANEL_SELECTION_IS_DUPLICATE}(NEW.command_str) THEN
+                RETURN NULL;
+            END IF;"""
+    elif _kind == "call_center":
+        _duplicate_check = f"""
+            SELECT * INTO _latest_data_before_insert FROM {_table_name}
+            ORDER BY timestamp DESC LIMIT 1;
+            IF FOUND AND (NEW.command_str = _latest_data_before_insert.command_str) 
+            AND (NEW.remote_id = _latest_data_before_insert.remote_id) THEN
+                SELECT * INTO _latest_activated_command_record_data FROM {COMMANDS_RECORD}
+                WHERE is_activated = true ORDER BY timestamp DESC LIMIT 1;
+                IF _latest_activated_command_record_data.call_center_command_id = _latest_data_before_insert.id THEN
+                    RETURN NULL;
+                END IF;
+            END IF;"""
+    elif _kind == "technician":
+        _duplicate_check = f"""
+            SELECT * INTO _latest_data_before_insert FROM {_table_name}
+            ORDER BY timestamp DESC LIMIT 1;
+            IF FOUND AND (NEW.command_str = _latest_data_before_insert.command_str) 
+            AND (NEW.remote_id = _latest_data_before_insert.remote_id) THEN
+                SELECT * INTO _latest_activated_command_record_data FROM {COMMANDS_RECORD}
+                WHERE is_activated = true ORDER BY timestamp DESC LIMIT 1;
+                IF _latest_activated_command_record_data.technician_command_id = _latest_data_before_insert.id THEN
+                    -- if not from cloud, the command can only be diags command which have timeout
+                    -- So, When the command_str is the same, the incoming command should get block until the timeout
+                    SELECT command_duration_sec INTO _timeout_sec FROM {COMMAND_MAP} 
+                    WHERE command_str = _latest_data_before_insert.command_str;
+                    IF _timeout_sec > 0 THEN
+                        _time_difference := EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - _latest_data_before_insert.timestamp))::INTEGER;
+                        IF _time_difference < _timeout_sec THEN
+                            RETURN NULL;
+                        END IF;
+                    END IF;
+                END IF;
+            END IF;"""
+    else:
+        # self urgent stops are never dropped as duplicates
+        _duplicate_check = ""
+    return f"""
+        CREATE OR REPLACE FUNCTION {check_before_insert_procedure_name(_table_name)}()
         RETURNS TRIGGER AS $$
         DECLARE
-            arg_table_name VARCHAR;
+            _factory_id VARCHAR;
+            machine_id INTEGER;
+            _latest_data_before_insert {_table_name}%ROWTYPE;
+            _latest_activated_command_record_data {COMMANDS_RECORD}%ROWTYPE;
+            _is_latest_activated BOOLEAN;
+            _panel_selection_id INTEGER;
+            _timeout_sec INTEGER;
+            _time_difference INTEGER;
         BEGIN
-            arg_table_name := TG_ARGV[0];
-            -- deactive all the is_latest flag
-            EXECUTE 'UPDATE ' || arg_table_name || ' SET is_latest = false';
-            IF to_jsonb(NEW) ? 'session_expired_time' THEN
-                IF NEW.session_requested_time_minute > 0 THEN
-                    NEW.session_expired_time := CURRENT_TIMESTAMP + (NEW.session_requested_time_minute * INTERVAL '1 minutes');
-                END IF;
+            -- bulk loads bring their own factory_id / machine_id and are not checked for duplicates
+            IF current_setting('{BULK_INGEST_SETTING}', true) = 'on' THEN
+                RETURN NEW;
             END IF;
+            SELECT factory_id INTO _factory_id FROM {CURRENT_FACTORY_INFO};
+            SELECT id INTO machine_id FROM {MACHINE_INFO};{_duplicate_check}
+            NEW.factory_id := _factory_id;
+            NEW.machine_id := machine_id;
             RETURN NEW;
         END;
         $$ LANGUAGE plpgsql;
-    """,
-    TURN_OFF_IS_ACTIVE_FLAG : f"""
-        CREATE OR REPLACE FUNCTION {TURN_OFF_IS_ACTIVE_FLAG}()
-        RETURNS TRIGGER AS $$
+    """
+
+''' Bulk ingestion: the column each source table fills in commands_record and the columns a bulk load provides '''
+SOURCE_COMMANDS_RECORD_COLUMNS = {
+    PANEL_SELECTIONS_RECORD: "panel_selection_id",
+    SELF_URGENT_STOP_COMMANDS_RECORD: "self_urgent_stop_id",
+    TECHNICIAN_COMMANDS_RECORD: "technician_command_id",
+    CALL_CENTER_COMMANDS_RECORD: "call_center_command_id",
+}
+
+BULK_SOURCE_COLUMNS = {
+    PANEL_SELECTIONS_RECORD: ("command_str",),
+    SELF_URGENT_STOP_COMMANDS_RECORD: ("command_str", "invalid_command_record_id"),
+    TECHNICIAN_COMMANDS_RECORD: ("command_str", "remote_id", "technician_id"),
+    CALL_CENTER_COMMANDS_RECORD: ("command_str", "remote_id", "agent_id"),
+}
+
+# rows of a bulk load, COPYed there by Testing._bulk_insert_commands, dropped at the end of its transaction
+BULK_STAGING_TABLE = "bulk_staging"
+
+def bulk_ingest_procedure_name(_table_name):
+    return f"{_table_name}_bulk_ingest"
+
+def build_bulk_ingest_procedure(_table_name):
+    ''' Set based counterpart of the row chain for one source table, for replays and fixtures: there is no
+    duplicate check on this path. The rows of the bulk_staging temp table are moved into _table_name and get their
+    commands_record rows with one statement (aii.bulk_ingest on, the row triggers step aside). The batch is then
+    arbitrated in memory with the rules of arbitrate_command (arbitration_decision), in order, on the control flags and
+    the open faults read once and the current panel selection carried from row to row, a self urgent stop generated
+    for a row being arbitrated right after it. The outcome is written once: one UPDATE of the batch rows, one INSERT
+    of the self urgent stops with their commands_record rows and one move of current_command to the last command
+    selected. Return the number of rows loaded. Ordinary inserts are not involved, no trigger is added to the
+    source tables '''
+    _column = SOURCE_COMMANDS_RECORD_COLUMNS[_table_name]
+    _columns = ", ".join(BULK_SOURCE_COLUMNS[_table_name])
+    _source = CHECK_BEFORE_INSERT_SOURCE_TABLES[_table_name]
+    if "remote_id" in BULK_SOURCE_COLUMNS[_table_name]:
+        # same rule as the row chain, the commands of a session that is not the latest one are dropped
+        _remote_check = f"""
+                    WHERE EXISTS (SELECT 1 FROM {REMOTE_CONTROL_RECORD} AS rc WHERE rc.id = n.remote_id AND rc.is_latest = true)"""
+        _command_remote_id = "n.remote_id"
+    else:
+        _remote_check = ""
+        _command_remote_id = "NULL::INTEGER"
+    return f"""
+        CREATE OR REPLACE FUNCTION {bulk_ingest_procedure_name(_table_name)}()
+        RETURNS INTEGER AS $$
+        DECLARE
+            _loaded INTEGER;
+            _record_ids INTEGER[];
+            _factory_id VARCHAR;
+            _machine_id INTEGER;
+            _current_command_panel_selection VARCHAR;
+            _current_remote_id INTEGER;
+            _is_remote BOOLEAN;
+            _is_register BOOLEAN;
+            _is_disabled BOOLEAN;
+            _is_currently_error BOOLEAN;
+            _self_stop_command_map_id INTEGER;
+            _self_stop_mode_type VARCHAR;
+            _self_stop_panel_selection VARCHAR;
+            _row RECORD;
+            _decision RECORD;
+            _self_stop_decision RECORD;
+            _selected_ids INTEGER[] := ARRAY[]::INTEGER[];
+            _self_stop_for_ids INTEGER[] := ARRAY[]::INTEGER[];
+            _self_stop_selected BOOLEAN[] := ARRAY[]::BOOLEAN[];
+            _last_selected_id INTEGER;
+            _is_last_selected_self_stop BOOLEAN := false;
         BEGIN
-            SELECT node_type INTO NEW.node_type FROM {ROS_NODES_CONFIGS} WHERE id = NEW.ros_node_config_id;
-            UPDATE {COMMAND_MAP_NODE_CONFIG_MAP} SET is_active = true WHERE command_map_id = NEW.command_map_id AND node_type = NEW.node_type;
-            RETURN NEW;
+            PERFORM set_config('{BULK_INGEST_SETTING}', 'on', true);
+            SELECT factory_id INTO _factory_id FROM {CURRENT_FACTORY_INFO} LIMIT 1;
+            SELECT id INTO _machine_id FROM {MACHINE_INFO} LIMIT 1;
+            WITH loaded AS (
+                INSERT INTO {_table_name} ({_columns}, factory_id, machine_id)
+                SELECT {_columns}, _factory_id, _machine_id
+                FROM {BULK_STAGING_TABLE} ORDER BY ord
+                RETURNING *
+            ), recorded AS (
+                INSERT INTO {COMMANDS_RECORD} (command_map_id, {_column})
+                SELECT cm.id, n.id FROM loaded AS n
+                LEFT JOIN LATERAL (
+                    SELECT id FROM {COMMAND_MAP} WHERE command_str = n.command_str LIMIT 1
+                ) AS cm ON true{_remote_check}
+                ORDER BY n.id
+                RETURNING id
+            )
+            SELECT (SELECT count(*) FROM loaded), (SELECT array_agg(id ORDER BY id) FROM recorded)
+            INTO _loaded, _record_ids;
+
+            -- the state arbitrate_command reads for every row, read once. current_command stays locked until the
+            -- batch is written so no other command is arbitrated in between
+            SELECT vps.valid_value INTO _current_command_panel_selection FROM {CURRENT_COMMAND} AS cc
+            LEFT JOIN {COMMANDS_RECORD} AS cr ON cc.command_record_id = cr.id
+            LEFT JOIN {COMMAND_MAP} AS cm ON cr.command_map_id = cm.id
+            LEFT JOIN {VALID_PANEL_SELECTION} AS vps ON cm.eq_panel_selection_id = vps.id
+            FOR UPDATE OF cc;
+
+            SELECT cmc.remote_id, rc.is_remote, mr.is_registered, mde.is_disabled 
+            INTO _current_remote_id, _is_remote, _is_register, _is_disabled
+            FROM {CURRENT_MACHINE_CONTROL_FLAGS} AS cmc
+            LEFT JOIN {REMOTE_CONTROL_RECORD} AS rc ON cmc.remote_id = rc.id
+            LEFT JOIN {MACHINE_REGISTRATION_RECORD} AS mr ON cmc.registration_id = mr.id
+            LEFT JOIN {MACHINE_DISABLE_ENABLE_RECORD} AS mde ON cmc.disable_enable_id = mde.id; 
+
+            IF EXISTS (SELECT 1 FROM {ROS_NODES_ERROR_RECORD} WHERE error_end_time IS NULL) THEN
+                _is_currently_error := true;
+            END IF;
+
+            SELECT cm.id, vm.valid_value, vps.valid_value
+            INTO _self_stop_command_map_id, _self_stop_mode_type, _self_stop_panel_selection
+            FROM {COMMAND_MAP} AS cm
+            LEFT JOIN {VALID_MODE} AS vm ON cm.mode_id = vm.id
+            LEFT JOIN {VALID_PANEL_SELECTION} AS vps ON cm.eq_panel_selection_id = vps.id
+            WHERE cm.command_str = 'self_stop';
+
+            FOR _row IN
+                SELECT cr.id, m.mode_type, m.panel_selection, {_command_remote_id} AS command_remote_id
+                FROM {COMMANDS_RECORD} AS cr
+                JOIN {_table_name} AS n ON cr.{_column} = n.id
+                LEFT JOIN LATERAL (
+                    SELECT vm.valid_value AS mode_type, vps.valid_value AS panel_selection FROM {COMMAND_MAP} AS cm
+                    JOIN {VALID_MODE} AS vm ON cm.mode_id = vm.id
+                    JOIN {VALID_PANEL_SELECTION} AS vps ON cm.eq_panel_selection_id = vps.id
+                    WHERE cm.id = cr.command_map_id
+                ) AS m ON true
+                WHERE cr.id = ANY(_record_ids)
+                ORDER BY cr.id
+            LOOP
+                SELECT * INTO _decision FROM {ARBITRATION_DECISION}(
+                    _row.mode_type, _row.panel_selection, '{_source}', _row.command_remote_id, _current_command_panel_selection,
+                    _current_remote_id, _is_remote, _is_register, _is_disabled, _is_currently_error
+                );
+                IF _decision.is_selected THEN
+                    _selected_ids := array_append(_selected_ids, _row.id);
+                    _current_command_panel_selection := _row.panel_selection;
+                    _last_selected_id := _row.id;
+                    _is_last_selected_self_stop := false;
+                ELSIF _decision.is_self_stop_generated THEN
+                    -- the self urgent stop is arbitrated before the next row, as its row chain would
+                    SELECT * INTO _self_stop_decision FROM {ARBITRATION_DECISION}(
+                        _self_stop_mode_type, _self_stop_panel_selection, 'self_stop', NULL, _current_command_panel_selection,
+                        _current_remote_id, _is_remote, _is_register, _is_disabled, _is_currently_error
+                    );
+                    _self_stop_for_ids := array_append(_self_stop_for_ids, _row.id);
+                    _self_stop_selected := array_append(_self_stop_selected, _self_stop_decision.is_selected);
+                    IF _self_stop_decision.is_selected THEN
+                        _current_command_panel_selection := _self_stop_panel_selection;
+                        _last_selected_id := _row.id;
+                        _is_last_selected_self_stop := true;
+                    END IF;
+                END IF;
+            END LOOP;
+
+            -- the previously activated rows keep is_activated, as with arbitrate_command
+            UPDATE {COMMANDS_RECORD} AS cr
+            SET is_processed = true,
+                is_activated = cr.is_activated OR s.id IS NOT NULL
+            FROM unnest(_record_ids) AS r(id)
+            LEFT JOIN unnest(_selected_ids) AS s(id) ON s.id = r.id
+            WHERE cr.id = r.id;
+
+            WITH generated AS (
+                SELECT g.invalid_command_record_id, g.is_selected, g.ord
+                FROM unnest(_self_stop_for_ids, _self_stop_selected) WITH ORDINALITY AS g(invalid_command_record_id, is_selected, ord)
+            ), stopped AS (
+                INSERT INTO {SELF_URGENT_STOP_COMMANDS_RECORD} (invalid_command_record_id, factory_id, machine_id)
+                SELECT invalid_command_record_id, _factory_id, _machine_id FROM generated ORDER BY ord
+                RETURNING id, invalid_command_record_id
+            )
+            INSERT INTO {COMMANDS_RECORD} (command_map_id, self_urgent_stop_id, is_processed, is_activated)
+            SELECT _self_stop_command_map_id, st.id, true, g.is_selected
+            FROM stopped AS st
+            JOIN generated AS g ON g.invalid_command_record_id = st.invalid_command_record_id
+            ORDER BY st.id;
+
+            IF _is_last_selected_self_stop THEN
+                SELECT cr.id INTO _last_selected_id FROM {COMMANDS_RECORD} AS cr
+                JOIN {SELF_URGENT_STOP_COMMANDS_RECORD} AS sus ON cr.self_urgent_stop_id = sus.id
+                WHERE sus.invalid_command_record_id = _last_selected_id
+                ORDER BY cr.id DESC LIMIT 1;
+            END IF;
+            IF _last_selected_id IS NOT NULL THEN
+                UPDATE {CURRENT_COMMAND} 
+                SET command_record_id = _last_selected_id,
+                    command_status_id = 1,
+                    timestamp = CURRENT_TIMESTAMP;
+                -- eq_panel_selection_id 5 is 'service'
+                UPDATE {CURRENT_MACHINE_STATE}
+                SET is_service = COALESCE(cm.eq_panel_selection_id = 5, false), timestamp = CURRENT_TIMESTAMP
+                FROM {COMMANDS_RECORD} AS cr
+                LEFT JOIN {COMMAND_MAP} AS cm ON cm.id = cr.command_map_id
+                WHERE cr.id = _last_selected_id
+                AND {CURRENT_MACHINE_STATE}.is_service IS DISTINCT FROM COALESCE(cm.eq_panel_selection_id = 5, false);
+            END IF;
+            PERFORM set_config('{BULK_INGEST_SETTING}', '', true);
+            RETURN _loaded;
         END;
         $$ LANGUAGE plpgsql;
-    """,
-    CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD : f"""
+    """
+
+# generic version replaced by the per table ones above, kept for the before/after benchmark. The remote session
+# expiry it used to run on every insert is left out, as in the per table ones, so only the lookups are compared
+CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD_ORIG = f"""
         CREATE OR REPLACE FUNCTION {CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD}()
         RETURNS TRIGGER AS $$
         DECLARE
-            _session_expired_time TIMESTAMP;
             _factory_id VARCHAR;
             machine_id INTEGER;
             _is_remote_id_col BOOLEAN;
@@ -429,14 +1092,6 @@ PROCEDURES_CREATE_SQL_COMMANDS_DICT = {
         BEGIN
             SELECT factory_id INTO _factory_id FROM {CURRENT_FACTORY_INFO};
             SELECT id INTO machine_id FROM {MACHINE_INFO};
-            SELECT session_expired_time INTO _session_expired_time FROM {REMOTE_CONTROL_RECORD}
-            WHERE is_latest = true;
-            IF _session_expired_time < CURRENT_TIMESTAMP THEN
-                UPDATE {REMOTE_CONTROL_RECORD}
-                SET is_expired = true WHERE is_latest = true;
-                INSERT INTO {REMOTE_CONTROL_RECORD} (requested_by_id, requested_source_id, factory_id, machine_id)
-                VALUES (machine_id, 1, _factory_id, machine_id);
-            END IF;
             EXECUTE 'SELECT * FROM ' || TG_TABLE_NAME || ' ORDER BY timestamp DESC LIMIT 1' INTO _latest_data_before_insert;
             IF _latest_data_before_insert IS NULL THEN
                 NEW.factory_id := _factory_id;
@@ -498,6 +1153,40 @@ PROCEDURES_CREATE_SQL_COMMANDS_DICT = {
             END IF;
         END;
         $$ LANGUAGE plpgsql;
+    """
+
+PROCEDURES_CREATE_SQL_COMMANDS_DICT = {
+    TURN_OFF_IS_LATEST_FLAG : f"""
+        CREATE OR REPLACE FUNCTION {TURN_OFF_IS_LATEST_FLAG}()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            arg_table_name VARCHAR;
+        BEGIN
+            arg_table_name := TG_ARGV[0];
+            -- concurrent inserts into the same table take turns until commit, otherwise both flip the same
+            -- old row and the second new latest row violates the *_latest_idx unique index
+            PERFORM pg_advisory_xact_lock(hashtext('{TURN_OFF_IS_LATEST_FLAG}/' || arg_table_name));
+            -- deactive the is_latest flag, only one row can have it (see the *_latest_idx indexes) 
+            -- so the update flips that single row whatever the size of the history
+            EXECUTE format('UPDATE %I SET is_latest = false WHERE is_latest = true', arg_table_name);
+            IF to_jsonb(NEW) ? 'session_expired_time' THEN
+                IF NEW.session_requested_time_minute > 0 THEN
+                    NEW.session_expired_time := CURRENT_TIMESTAMP + (NEW.session_requested_time_minute * INTERVAL '1 minutes');
+                END IF;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    TURN_OFF_IS_ACTIVE_FLAG : f"""
+        CREATE OR REPLACE FUNCTION {TURN_OFF_IS_ACTIVE_FLAG}()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            SELECT node_type INTO NEW.node_type FROM {ROS_NODES_CONFIGS} WHERE id = NEW.ros_node_config_id;
+            UPDATE {COMMAND_MAP_NODE_CONFIG_MAP} SET is_active = true WHERE command_map_id = NEW.command_map_id AND node_type = NEW.node_type;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
     """,
     UPDATE_CURRENT_FACTORY_INFO : f"""
         CREATE OR REPLACE FUNCTION {UPDATE_CURRENT_FACTORY_INFO} ()
@@ -513,15 +1202,25 @@ PROCEDURES_CREATE_SQL_COMMANDS_DICT = {
         CREATE OR REPLACE FUNCTION {UPDATE_CURRENT_MACHINE_CONTROL_FLAGS} ()
         RETURNS TRIGGER AS $$
         BEGIN
+            -- {CURRENT_MACHINE_STATE} is only written when the flag really changes, see {NOTIFY_CURRENT_MACHINE_STATE}
             IF TG_NAME = '{DISABLE_ENABLE_RECORD_INSERTED_TRIGGER_TWO}' THEN
                 UPDATE {CURRENT_MACHINE_CONTROL_FLAGS} 
                 SET disable_enable_id = NEW.id;
+                UPDATE {CURRENT_MACHINE_STATE}
+                SET is_disabled = NEW.is_disabled, timestamp = CURRENT_TIMESTAMP
+                WHERE is_disabled IS DISTINCT FROM NEW.is_disabled;
             ELSIF TG_NAME = '{REMOTE_CONTROL_RECORD_INSERTED_TRIGGER}' THEN
                 UPDATE {CURRENT_MACHINE_CONTROL_FLAGS} 
                 SET remote_id = NEW.id;
+                UPDATE {CURRENT_MACHINE_STATE}
+                SET is_remote = NEW.is_remote, timestamp = CURRENT_TIMESTAMP
+                WHERE is_remote IS DISTINCT FROM NEW.is_remote;
             ELSIF TG_NAME = '{REGISTRATION_RECORD_INSERTED_TRIGGER_TWO}' THEN
                 UPDATE {CURRENT_MACHINE_CONTROL_FLAGS} 
                 SET registration_id = NEW.id;
+                UPDATE {CURRENT_MACHINE_STATE}
+                SET is_unregistered = NOT NEW.is_registered, timestamp = CURRENT_TIMESTAMP
+                WHERE is_unregistered IS DISTINCT FROM NOT NEW.is_registered;
             END IF;
             RETURN NEW;
         END;
@@ -566,11 +1265,17 @@ PROCEDURES_CREATE_SQL_COMMANDS_DICT = {
             eq_panel_selection_id INTEGER;
             _command_str VARCHAR;
         BEGIN
+            -- the uploader marking the row as uploaded is not a new panel selection
+            IF NEW.valid_panel_selection_id IS NOT DISTINCT FROM OLD.valid_panel_selection_id 
+            AND NEW.is_uploaded AND NOT OLD.is_uploaded THEN
+                RETURN NEW;
+            END IF;
             SELECT cm.eq_panel_selection_id INTO eq_panel_selection_id
             FROM {COMMANDS_RECORD} AS cr
             JOIN {COMMAND_MAP} AS cm ON cr.command_map_id = cm.id
             WHERE cr.call_center_command_id IS NOT NULL
-            AND age(NOW(), cr.timestamp) < interval '1 minute'
+            -- compared on the bare column so {COMMANDS_RECORD}_call_center_idx can serve it
+            AND cr.timestamp > LOCALTIMESTAMP - interval '1 minute'
             LIMIT 1;
 
             -- If no matching row is found
@@ -593,6 +1298,10 @@ PROCEDURES_CREATE_SQL_COMMANDS_DICT = {
         DECLARE
             _command_map_id INTEGER;
         BEGIN
+            IF current_setting('{SUBMIT_COMMAND_SETTING}', true) = 'on' 
+            OR current_setting('{BULK_INGEST_SETTING}', true) = 'on' THEN
+                RETURN NEW;
+            END IF;
             SELECT id INTO _command_map_id FROM {COMMAND_MAP} WHERE command_str = NEW.command_str;
             IF TG_NAME = '{PANEL_SELECTIONS_RECORD_INSERTED_TRIGGER}' THEN                
                 INSERT INTO {COMMANDS_RECORD} (command_map_id, panel_selection_id)
@@ -619,143 +1328,212 @@ PROCEDURES_CREATE_SQL_COMMANDS_DICT = {
     UPDATE_CURRENT_COMMAND : f"""
         CREATE OR REPLACE FUNCTION {UPDATE_CURRENT_COMMAND} ()
         RETURNS TRIGGER AS $$
-        DECLARE
-            selected_command RECORD;
-            _mode_type VARCHAR;
-            _current_command_panel_selection VARCHAR;
-            _command_record_panel_selection VARCHAR;
-            _current_remote_id INTEGER;
-            _command_remote_id INTEGER;
-            _is_remote BOOLEAN;
-            _is_register BOOLEAN;
-            _is_disabled BOOLEAN;
-            _is_currently_error BOOLEAN;
-            selected_command_id INTEGER;
         BEGIN
-            SELECT vps.valid_value, vm.valid_value INTO _command_record_panel_selection, _mode_type FROM {COMMANDS_RECORD} AS cr
-            JOIN {COMMAND_MAP} AS cm ON cr.command_map_id = cm.id
-            JOIN {VALID_MODE} AS vm ON cm.mode_id = vm.id
-            JOIN {VALID_PANEL_SELECTION} AS vps ON cm.eq_panel_selection_id = vps.id
-            WHERE cr.id = NEW.id;
-
-            SELECT vps.valid_value INTO _current_command_panel_selection FROM {CURRENT_COMMAND} as cc
-            LEFT JOIN {COMMANDS_RECORD} AS cr ON cc.command_record_id = cr.id
-            LEFT JOIN {COMMAND_MAP} AS cm ON cr.command_map_id = cm.id
-            LEFT JOIN {VALID_PANEL_SELECTION} AS vps ON cm.eq_panel_selection_id = vps.id;
-
-            SELECT cmc.remote_id, rc.is_remote, mr.is_registered, mde.is_disabled 
-            INTO _current_remote_id, _is_remote, _is_register, _is_disabled
-            FROM {CURRENT_MACHINE_CONTROL_FLAGS} AS cmc
-            LEFT JOIN {REMOTE_CONTROL_RECORD} AS rc ON cmc.remote_id = rc.id
-            LEFT JOIN {MACHINE_REGISTRATION_RECORD} AS mr ON cmc.registration_id = mr.id
-            LEFT JOIN {MACHINE_DISABLE_ENABLE_RECORD} AS mde ON cmc.disable_enable_id = mde.id; 
-
-            SELECT true INTO _is_currently_error FROM {ROS_NODES_ERROR_RECORD} WHERE error_end_time IS NULL;
-
-            IF _mode_type = 'oper' THEN
+            -- compatibility path for the plain inserts into the source tables, 
+            -- {SUBMIT_COMMAND} and the bulk ingestion arbitrate by themselves
+            IF current_setting('{SUBMIT_COMMAND_SETTING}', true) = 'on' 
+            OR current_setting('{BULK_INGEST_SETTING}', true) = 'on' THEN
+                RETURN NEW;
+            END IF;
+            PERFORM {ARBITRATE_COMMAND}(NEW.id);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    ARBITRATION_DECISION : f"""
+        -- the arbitration rules alone, on the state {ARBITRATE_COMMAND} and the bulk ingestion read,
+        -- arg_source is 'panel', 'self_stop', 'technician' or 'call_center'
+        CREATE OR REPLACE FUNCTION {ARBITRATION_DECISION} (
+            arg_mode_type VARCHAR, arg_panel_selection VARCHAR, arg_source VARCHAR, arg_command_remote_id INTEGER,
+            arg_current_panel_selection VARCHAR, arg_current_remote_id INTEGER,
+            arg_is_remote BOOLEAN, arg_is_register BOOLEAN, arg_is_disabled BOOLEAN, arg_is_currently_error BOOLEAN,
+            OUT is_selected BOOLEAN, OUT is_self_stop_generated BOOLEAN, OUT arbitration_reason VARCHAR
+        ) AS $$
+        BEGIN
+            is_selected := false;
+            is_self_stop_generated := false;
+            IF arg_mode_type = 'oper' THEN
                 -- condition to check if the incoming command should be block or not when it comes to all_start         
-                IF ((_command_record_panel_selection IN ('aa', 'a', 'b') AND _is_currently_error IS NULL) AND (_current_command_panel_selection NOT IN ('aa', 'a', 'b'))) 
-                OR (_command_record_panel_selection = 'off') THEN
-                    IF _is_register THEN
-                        IF _is_remote AND _is_disabled = false THEN
-                            IF EXISTS (SELECT 1 FROM {COMMANDS_RECORD} WHERE id = NEW.id AND call_center_command_id IS NOT NULL) THEN
-                                SELECT ccc.remote_id INTO _command_remote_id FROM {COMMANDS_RECORD} AS cr
-                                JOIN {CALL_CENTER_COMMANDS_RECORD} AS ccc ON cr.call_center_command_id = ccc.id
-                                WHERE cr.id = NEW.id;
-                                IF _command_remote_id = _current_remote_id THEN
-                                    selected_command_id := NEW.id;   
+                IF ((arg_panel_selection IN ('aa', 'a', 'b') AND arg_is_currently_error IS NULL) AND (arg_current_panel_selection NOT IN ('aa', 'a', 'b'))) 
+                OR (arg_panel_selection = 'off') THEN
+                    IF arg_is_register THEN
+                        IF arg_is_remote AND arg_is_disabled = false THEN
+                            IF arg_source = 'call_center' THEN
+                                IF arg_command_remote_id = arg_current_remote_id THEN
+                                    is_selected := true;
+                                ELSE
+                                    arbitration_reason := 'remote_session_mismatch';
                                 END IF;
+                            ELSIF arg_source = 'self_stop' THEN
+                                is_selected := true;
                             ELSE
-                                IF EXISTS (SELECT 1 FROM {COMMANDS_RECORD} 
-                                WHERE id = NEW.id AND self_urgent_stop_id IS NOT NULL) THEN
-                                    selected_command_id := NEW.id;
-                                END IF;
+                                -- only the session owner and the self stops get through while remote
+                                arbitration_reason := 'remote_control_active';
                             END IF;
-                        ELSIF _is_disabled = false THEN
-                            IF EXISTS (SELECT 1 FROM {COMMANDS_RECORD} 
-                            WHERE id = NEW.id AND (panel_selection_id IS NOT NULL OR self_urgent_stop_id IS NOT NULL)) THEN
-                                selected_command_id := NEW.id;
+                        ELSIF arg_is_disabled = false THEN
+                            IF arg_source IN ('panel', 'self_stop') THEN
+                                is_selected := true;
+                            ELSE
+                                arbitration_reason := 'remote_control_inactive';
                             END IF;
                         ELSE
-                            IF EXISTS (SELECT 1 FROM {COMMANDS_RECORD} 
-                            WHERE id = NEW.id AND self_urgent_stop_id IS NOT NULL) THEN
-                                selected_command_id := NEW.id;
+                            IF arg_source = 'self_stop' THEN
+                                is_selected := true;
+                            ELSE
+                                arbitration_reason := 'machine_disabled';
                             END IF;
                         END IF;
+                    ELSE
+                        arbitration_reason := 'not_registered';
                     END IF;
                 ELSE
-                    IF _is_register THEN
+                    arbitration_reason := CASE WHEN arg_is_currently_error AND arg_panel_selection IN ('aa', 'a', 'b')
+                        THEN 'fault_open' ELSE 'batch_active' END;
+                    IF arg_is_register THEN
                         -- only response to remote invalid start command if the remote is true else do not response
-                        IF EXISTS (SELECT 1 FROM {COMMANDS_RECORD} WHERE id = NEW.id AND call_center_command_id IS NOT NULL) AND _is_remote THEN
-                            -- incoming command is invalid start command and get block, then self urgent stop will get generated
-                            INSERT INTO {SELF_URGENT_STOP_COMMANDS_RECORD} (invalid_command_record_id) 
-                            VALUES (NEW.id);
-                        ELSE
-                            -- only response to local invalid start command if both is_disabled and _is_remote are false else do not reponse
-                            IF EXISTS (SELECT 1 FROM {COMMANDS_RECORD} WHERE id = NEW.id AND panel_selection_id IS NOT NULL) AND _is_disabled = false AND _is_remote = false THEN
-                                -- incoming command is invalid start command and get block, then self urgent stop will get generated
-                                INSERT INTO {SELF_URGENT_STOP_COMMANDS_RECORD} (invalid_command_record_id) 
-                                VALUES (NEW.id);
-                            END IF;
+                        IF arg_source = 'call_center' AND arg_is_remote THEN
+                            is_self_stop_generated := true;
+                        -- only response to local invalid start command if both is_disabled and _is_remote are false else do not reponse
+                        ELSIF arg_source = 'panel' AND arg_is_disabled = false AND arg_is_remote = false THEN
+                            is_self_stop_generated := true;
                         END IF;
+                    ELSE
+                        arbitration_reason := 'not_registered';
                     END IF;
                 END IF;
             ELSE
-                IF _is_remote THEN
-                    IF EXISTS (SELECT 1 FROM {COMMANDS_RECORD} WHERE id = NEW.id AND call_center_command_id IS NOT NULL) THEN
-                        SELECT ccc.remote_id INTO _command_remote_id FROM {COMMANDS_RECORD} AS cr
-                        JOIN {CALL_CENTER_COMMANDS_RECORD} AS ccc ON cr.call_center_command_id = ccc.id
-                        WHERE cr.id = NEW.id;
-                        IF (_command_remote_id = _current_remote_id) THEN
-                            IF _current_command_panel_selection IS NOT NULL THEN
-                                IF _current_command_panel_selection NOT IN ('aa','a','b') THEN
-                                    selected_command_id := NEW.id;
-                                ELSE
-                                    -- incoming command is invalid command and get block, then self urgent stop will get generated
-                                    INSERT INTO {SELF_URGENT_STOP_COMMANDS_RECORD} (invalid_command_record_id) 
-                                    VALUES (NEW.id);
-                                END IF;
-                            ELSE
-                                selected_command_id := NEW.id;
-                            END IF;
-                        END IF;
-                    ELSIF EXISTS (SELECT 1 FROM {COMMANDS_RECORD} WHERE id = NEW.id AND technician_command_id IS NOT NULL) THEN
-                        SELECT tc.remote_id INTO _command_remote_id FROM {COMMANDS_RECORD} AS cr
-                        JOIN {TECHNICIAN_COMMANDS_RECORD} AS tc ON cr.technician_command_id = tc.id
-                        WHERE cr.id = NEW.id;
-                        IF (_command_remote_id = _current_remote_id) THEN
-                            IF _current_command_panel_selection IS NOT NULL THEN
-                                IF _current_command_panel_selection NOT IN ('aa','a','b') THEN
-                                    selected_command_id := NEW.id;
-                                ELSE
-                                    -- incoming command is invalid command and get block, then self urgent stop will get generated
-                                    INSERT INTO {SELF_URGENT_STOP_COMMANDS_RECORD} (invalid_command_record_id) 
-                                    VALUES (NEW.id);
-                                END IF;
+                IF arg_is_remote THEN
+                    IF arg_source IN ('call_center', 'technician') THEN
+                        IF arg_command_remote_id = arg_current_remote_id THEN
+                            IF arg_current_panel_selection IN ('aa', 'a', 'b') THEN
+                                -- no other command while a batch runs, a self urgent stop answers it
+                                is_self_stop_generated := true;
+                                arbitration_reason := 'batch_active';
                             ELSE
-                                selected_command_id := NEW.id;
+                                is_selected := true;
                             END IF;
+                        ELSE
+                            arbitration_reason := 'remote_session_mismatch';
                         END IF;
+                    ELSE
+                        arbitration_reason := 'remote_control_active';
                     END IF;
                 ELSE
                     -- will only response to local setup mode if the remote is false
-                    IF EXISTS (SELECT 1 FROM {COMMANDS_RECORD} WHERE id = NEW.id AND panel_selection_id IS NOT NULL) THEN
-                        IF _mode_type = 'setup' THEN
-                            selected_command_id := NEW.id;
+                    IF arg_source = 'panel' THEN
+                        IF arg_mode_type = 'setup' THEN
+                            is_selected := true;
+                        ELSE
+                            arbitration_reason := 'mode_not_allowed';
                         END IF;
+                    ELSE
+                        arbitration_reason := 'remote_control_inactive';
                     END IF;
                 END IF;
             END IF;
+            IF is_selected THEN
+                arbitration_reason := 'selected';
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql IMMUTABLE;
+    """,
+    ARBITRATE_COMMAND : f"""
+        CREATE OR REPLACE FUNCTION {ARBITRATE_COMMAND} (
+            arg_record_id INTEGER, OUT arbitration_status VARCHAR, OUT arbitration_reason VARCHAR
+        ) AS $$
+        DECLARE
+            _mode_type VARCHAR;
+            _current_command_panel_selection VARCHAR;
+            _command_record_panel_selection VARCHAR;
+            _current_remote_id INTEGER;
+            _command_remote_id INTEGER;
+            _is_remote BOOLEAN;
+            _is_register BOOLEAN;
+            _is_disabled BOOLEAN;
+            _is_currently_error BOOLEAN;
+            _source VARCHAR;
+            _decision RECORD;
+            selected_command_id INTEGER;
+            _is_self_stop_generated BOOLEAN := false;
+        BEGIN
+            SELECT vps.valid_value, vm.valid_value INTO _command_record_panel_selection, _mode_type FROM {COMMANDS_RECORD} AS cr
+            JOIN {COMMAND_MAP} AS cm ON cr.command_map_id = cm.id
+            JOIN {VALID_MODE} AS vm ON cm.mode_id = vm.id
+            JOIN {VALID_PANEL_SELECTION} AS vps ON cm.eq_panel_selection_id = vps.id
+            WHERE cr.id = arg_record_id;
+
+            SELECT vps.valid_value INTO _current_command_panel_selection FROM {CURRENT_COMMAND} as cc
+            LEFT JOIN {COMMANDS_RECORD} AS cr ON cc.command_record_id = cr.id
+            LEFT JOIN {COMMAND_MAP} AS cm ON cr.command_map_id = cm.id
+            LEFT JOIN {VALID_PANEL_SELECTION} AS vps ON cm.eq_panel_selection_id = vps.id;
+
+            SELECT cmc.remote_id, rc.is_remote, mr.is_registered, mde.is_disabled 
+            INTO _current_remote_id, _is_remote, _is_register, _is_disabled
+            FROM {CURRENT_MACHINE_CONTROL_FLAGS} AS cmc
+            LEFT JOIN {REMOTE_CONTROL_RECORD} AS rc ON cmc.remote_id = rc.id
+            LEFT JOIN {MACHINE_REGISTRATION_RECORD} AS mr ON cmc.registration_id = mr.id
+            LEFT JOIN {MACHINE_DISABLE_ENABLE_RECORD} AS mde ON cmc.disable_enable_id = mde.id; 
+
+            -- EXISTS stops at the first open fault of the partial index, _is_currently_error stays NULL without one
+            IF EXISTS (SELECT 1 FROM {ROS_NODES_ERROR_RECORD} WHERE error_end_time IS NULL) THEN
+                _is_currently_error := true;
+            END IF;
+
+            -- where the command comes from and the remote session it was sent in
+            SELECT CASE
+                    WHEN cr.call_center_command_id IS NOT NULL THEN 'call_center'
+                    WHEN cr.technician_command_id IS NOT NULL THEN 'technician'
+                    WHEN cr.panel_selection_id IS NOT NULL THEN 'panel'
+                    WHEN cr.self_urgent_stop_id IS NOT NULL THEN 'self_stop'
+                END, COALESCE(ccc.remote_id, tc.remote_id)
+            INTO _source, _command_remote_id
+            FROM {COMMANDS_RECORD} AS cr
+            LEFT JOIN {CALL_CENTER_COMMANDS_RECORD} AS ccc ON cr.call_center_command_id = ccc.id
+            LEFT JOIN {TECHNICIAN_COMMANDS_RECORD} AS tc ON cr.technician_command_id = tc.id
+            WHERE cr.id = arg_record_id;
+
+            SELECT * INTO _decision FROM {ARBITRATION_DECISION}(
+                _mode_type, _command_record_panel_selection, _source, _command_remote_id, _current_command_panel_selection,
+                _current_remote_id, _is_remote, _is_register, _is_disabled, _is_currently_error
+            );
+            IF _decision.is_self_stop_generated THEN
+                -- incoming command is invalid command and get block, then self urgent stop will get generated
+                INSERT INTO {SELF_URGENT_STOP_COMMANDS_RECORD} (invalid_command_record_id) 
+                VALUES (arg_record_id);
+                _is_self_stop_generated := true;
+            END IF;
+            IF _decision.is_selected THEN
+                selected_command_id := arg_record_id;
+            END IF;
+            arbitration_reason := _decision.arbitration_reason;
             IF selected_command_id IS NOT NULL THEN
                 UPDATE {CURRENT_COMMAND} 
                 SET command_record_id = selected_command_id,
                     command_status_id = 1,
                     timestamp = CURRENT_TIMESTAMP;
+                -- eq_panel_selection_id 5 is 'service'
+                UPDATE {CURRENT_MACHINE_STATE}
+                SET is_service = COALESCE(cm.eq_panel_selection_id = 5, false), timestamp = CURRENT_TIMESTAMP
+                FROM {COMMANDS_RECORD} AS cr
+                LEFT JOIN {COMMAND_MAP} AS cm ON cm.id = cr.command_map_id
+                WHERE cr.id = selected_command_id
+                AND {CURRENT_MACHINE_STATE}.is_service IS DISTINCT FROM COALESCE(cm.eq_panel_selection_id = 5, false);
             END IF;
+            -- every earlier row was already processed by its own trigger call, so only the new row gets written.
+            -- the previously activated row keeps is_activated, the duplicate checks read that activation history
             UPDATE {COMMANDS_RECORD} 
             SET is_processed = true, 
-                is_activated = CASE WHEN id = selected_command_id THEN true ELSE is_activated END;
-            RETURN NEW;
+                is_activated = CASE WHEN id = selected_command_id THEN true ELSE is_activated END
+            WHERE id = arg_record_id;
+            IF selected_command_id IS NOT NULL THEN
+                arbitration_status := 'accepted';
+                arbitration_reason := 'selected';
+            ELSIF _is_self_stop_generated THEN
+                -- blocked, and the self urgent stop generated for it took over
+                arbitration_status := 'superseded';
+            ELSE
+                arbitration_status := 'blocked';
+            END IF;
         END;
         $$ LANGUAGE plpgsql;
     """,
@@ -781,30 +1559,598 @@ PROCEDURES_CREATE_SQL_COMMANDS_DICT = {
     GET_TOWERLIGHT_INDICATOR_FLAGS : f"""
         CREATE OR REPLACE FUNCTION {GET_TOWERLIGHT_INDICATOR_FLAGS}()
         RETURNS jsonb AS $$
+            -- one row read, the flags are maintained by the triggers (see {CURRENT_MACHINE_STATE})
+            SELECT jsonb_build_object(
+                'is_remote', is_remote,
+                'is_unregistered', is_unregistered,
+                'is_disabled', is_disabled,
+                'is_service', is_service,
+                'is_error', is_error,
+                'is_warning', is_warning
+            ) FROM {CURRENT_MACHINE_STATE};
+        $$ LANGUAGE sql STABLE;
+    """,
+    REFRESH_CURRENT_MACHINE_STATE : f"""
+        CREATE OR REPLACE FUNCTION {REFRESH_CURRENT_MACHINE_STATE}()
+        RETURNS VOID AS $$
+        BEGIN
+            -- full recompute from the source tables, the triggers only apply the changes on top of it
+            UPDATE {CURRENT_MACHINE_STATE} SET
+                is_remote = COALESCE((SELECT is_remote FROM {REMOTE_CONTROL_RECORD} WHERE is_latest = true), false),
+                is_unregistered = COALESCE((SELECT NOT is_registered FROM {MACHINE_REGISTRATION_RECORD} WHERE is_latest = true), false),
+                is_disabled = COALESCE((SELECT is_disabled FROM {MACHINE_DISABLE_ENABLE_RECORD} WHERE is_latest = true), false),
+                is_service = EXISTS (
+                    SELECT 1 FROM {CURRENT_COMMAND} AS ccmd
+                    JOIN {COMMANDS_RECORD} AS cr ON cr.id = ccmd.command_record_id
+                    JOIN {COMMAND_MAP} AS cmp ON cmp.id = cr.command_map_id WHERE cmp.eq_panel_selection_id = 5
+                ),
+                is_error = EXISTS (SELECT 1 FROM {ROS_NODES_ERROR_RECORD} WHERE error_end_time IS NULL),
+                is_warning = EXISTS (SELECT 1 FROM {ROS_NODES_WARNING_RECORD} WHERE warning_end_time IS NULL),
+                timestamp = CURRENT_TIMESTAMP;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    UPDATE_CURRENT_MACHINE_STATE_FAULTS : f"""
+        CREATE OR REPLACE FUNCTION {UPDATE_CURRENT_MACHINE_STATE_FAULTS}()
+        RETURNS TRIGGER AS $$
         DECLARE
-            _is_remote BOOLEAN := false;
-            _is_unregistered BOOLEAN := false;
-            _is_disabled BOOLEAN := false;
-            _is_service BOOLEAN := false;
-            _is_error BOOLEAN := false;
-            _is_warning BOOLEAN := false;
-        BEGIN
-            SELECT is_remote INTO _is_remote FROM {REMOTE_CONTROL_RECORD} WHERE is_latest = true;
-            SELECT true INTO _is_unregistered FROM {MACHINE_REGISTRATION_RECORD} WHERE is_latest = true and is_registered = false;
-            SELECT is_disabled INTO _is_disabled FROM {MACHINE_DISABLE_ENABLE_RECORD} WHERE is_latest = true;
-            SELECT true INTO _is_service FROM current_command as ccmd 
-            LEFT JOIN commands_record AS cr ON cr.id = ccmd.command_record_id
-            LEFT JOIN command_map AS cmp ON cmp.id = cr.command_map_id WHERE cmp.eq_panel_selection_id = 5;
-            SELECT true INTO _is_error FROM {ROS_NODES_ERROR_RECORD} WHERE error_end_time IS NULL;
-            SELECT true INTO _is_warning FROM {ROS_NODES_WARNING_RECORD} WHERE warning_end_time IS NULL;
-            RETURN jsonb_build_object(
-                'is_remote', _is_remote,
-                'is_unregistered', _is_unregistered,
-                'is_disabled', _is_disabled,
-                'is_service', _is_service,
-                'is_error', _is_error,
-                'is_warning', _is_warning
-            );
+            _is_open BOOLEAN;
+        BEGIN
+            -- statement level, one EXISTS on the open rows partial index per statement whatever the number of rows
+            IF TG_TABLE_NAME = '{ROS_NODES_ERROR_RECORD}' THEN
+                _is_open := EXISTS (SELECT 1 FROM {ROS_NODES_ERROR_RECORD} WHERE error_end_time IS NULL);
+                UPDATE {CURRENT_MACHINE_STATE} SET is_error = _is_open, timestamp = CURRENT_TIMESTAMP
+                WHERE is_error IS DISTINCT FROM _is_open;
+            ELSIF TG_TABLE_NAME = '{ROS_NODES_WARNING_RECORD}' THEN
+                _is_open := EXISTS (SELECT 1 FROM {ROS_NODES_WARNING_RECORD} WHERE warning_end_time IS NULL);
+                UPDATE {CURRENT_MACHINE_STATE} SET is_warning = _is_open, timestamp = CURRENT_TIMESTAMP
+                WHERE is_warning IS DISTINCT FROM _is_open;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    OPEN_ROS_NODE_FAULT : f"""
+        CREATE OR REPLACE FUNCTION {OPEN_ROS_NODE_FAULT}(arg_node_type VARCHAR, arg_node_name VARCHAR, arg_error_msg VARCHAR)
+        RETURNS INTEGER AS $$
+        DECLARE
+            _error_id INTEGER;
+        BEGIN
+            -- serialize open / close of the same node so a fault is never opened twice,
+            -- each open row generates a self urgent stop
+            PERFORM pg_advisory_xact_lock(hashtext(arg_node_type || '/' || arg_node_name));
+            SELECT id INTO _error_id FROM {ROS_NODES_ERROR_RECORD}
+            WHERE node_type = arg_node_type AND node_name = arg_node_name AND error_end_time IS NULL
+            LIMIT 1;
+            IF _error_id IS NULL THEN
+                INSERT INTO {ROS_NODES_ERROR_RECORD} (node_type, node_name, error_msg)
+                VALUES (arg_node_type, arg_node_name, arg_error_msg)
+                RETURNING id INTO _error_id;
+            END IF;
+            RETURN _error_id;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    CLOSE_ROS_NODE_FAULT : f"""
+        CREATE OR REPLACE FUNCTION {CLOSE_ROS_NODE_FAULT}(arg_node_type VARCHAR, arg_node_name VARCHAR)
+        RETURNS INTEGER AS $$
+        DECLARE
+            _closed_count INTEGER;
+        BEGIN
+            PERFORM pg_advisory_xact_lock(hashtext(arg_node_type || '/' || arg_node_name));
+            UPDATE {ROS_NODES_ERROR_RECORD} SET error_end_time = CURRENT_TIMESTAMP
+            WHERE node_type = arg_node_type AND node_name = arg_node_name AND error_end_time IS NULL;
+            GET DIAGNOSTICS _closed_count = ROW_COUNT;
+            RETURN _closed_count;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    NOTIFY_ROS_NODES_ERROR_RECORD : f"""
+        CREATE OR REPLACE FUNCTION {NOTIFY_ROS_NODES_ERROR_RECORD}()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            -- a deleted row (cleanup, retention) is a closed fault for the mirrors
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('{ACTIVE_FAULTS_CHANNEL}', json_build_object(
+                    'id', OLD.id,
+                    'node_type', OLD.node_type,
+                    'node_name', OLD.node_name,
+                    'is_open', false
+                )::text);
+            ELSE
+                PERFORM pg_notify('{ACTIVE_FAULTS_CHANNEL}', json_build_object(
+                    'id', NEW.id,
+                    'node_type', NEW.node_type,
+                    'node_name', NEW.node_name,
+                    'is_open', NEW.error_end_time IS NULL
+                )::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    RESET_IS_UPLOADED_FLAG : f"""
+        CREATE OR REPLACE FUNCTION {RESET_IS_UPLOADED_FLAG}()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            -- rows updated in place after their upload (is_latest / is_expired flips, factory_id set by the job
+            -- worker, a new current selection, ...) have to be uploaded again when any other column changes.
+            -- the outbox's own is_uploaded = true update changes nothing else and is left alone
+            IF OLD.is_uploaded AND (to_jsonb(NEW) - 'is_uploaded') IS DISTINCT FROM (to_jsonb(OLD) - 'is_uploaded') THEN
+                NEW.is_uploaded := false;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    NOTIFY_CURRENT_MACHINE_STATE : f"""
+        CREATE OR REPLACE FUNCTION {NOTIFY_CURRENT_MACHINE_STATE}()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify('{MACHINE_STATE_CHANNEL}', row_to_json(NEW)::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    EXPIRE_REMOTE_CONTROL_SESSION : f"""
+        CREATE OR REPLACE FUNCTION {EXPIRE_REMOTE_CONTROL_SESSION}()
+        RETURNS DOUBLE PRECISION AS $$
+        DECLARE
+            _latest {REMOTE_CONTROL_RECORD}%ROWTYPE;
+            _factory_id VARCHAR;
+            _machine_id INTEGER;
+        BEGIN
+            -- the row lock serializes the schedulers, only one of them closes a given session
+            SELECT * INTO _latest FROM {REMOTE_CONTROL_RECORD} WHERE is_latest = true FOR UPDATE;
+            IF NOT FOUND OR NOT _latest.is_remote OR _latest.is_expired OR _latest.session_expired_time IS NULL THEN
+                RETURN NULL;
+            END IF;
+            IF _latest.session_expired_time > CURRENT_TIMESTAMP THEN
+                -- seconds left, the scheduler sleeps until then
+                RETURN EXTRACT(EPOCH FROM (_latest.session_expired_time - CURRENT_TIMESTAMP));
+            END IF;
+            UPDATE {REMOTE_CONTROL_RECORD} SET is_expired = true WHERE id = _latest.id;
+            SELECT factory_id INTO _factory_id FROM {CURRENT_FACTORY_INFO};
+            SELECT id INTO _machine_id FROM {MACHINE_INFO};
+            INSERT INTO {REMOTE_CONTROL_RECORD} (requested_by_id, requested_source_id, factory_id, machine_id)
+            VALUES (_machine_id, 1, _factory_id, _machine_id);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    NOTIFY_REMOTE_CONTROL_SESSION : f"""
+        CREATE OR REPLACE FUNCTION {NOTIFY_REMOTE_CONTROL_SESSION}()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify('{REMOTE_SESSION_CHANNEL}', json_build_object(
+                'id', NEW.id,
+                'is_remote', NEW.is_remote,
+                'session_expired_time', NEW.session_expired_time
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    NOTIFY_CURRENT_COMMAND : f"""
+        CREATE OR REPLACE FUNCTION {NOTIFY_CURRENT_COMMAND}()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            _command_duration_sec INTEGER;
+        BEGIN
+            SELECT cm.command_duration_sec INTO _command_duration_sec FROM {COMMANDS_RECORD} AS cr
+            JOIN {COMMAND_MAP} AS cm ON cm.id = cr.command_map_id
+            WHERE cr.id = NEW.command_record_id;
+            -- remaining_sec is NULL for the commands without a duration, the watchdog drops their deadline
+            PERFORM pg_notify('{CURRENT_COMMAND_CHANNEL}', json_build_object(
+                'id', NEW.id,
+                'command_record_id', NEW.command_record_id,
+                'remaining_sec', CASE WHEN _command_duration_sec > 0 
+                    THEN _command_duration_sec - EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - NEW.timestamp)) END
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    SUBMIT_COMMAND : f"""
+        CREATE OR REPLACE FUNCTION {SUBMIT_COMMAND} (
+            arg_source VARCHAR, arg_command_str VARCHAR, arg_remote_id INTEGER DEFAULT NULL, arg_requester_id VARCHAR DEFAULT NULL,
+            OUT decision VARCHAR, OUT reason_code VARCHAR, OUT record_id INTEGER, OUT current_record_id INTEGER
+        ) AS $$
+        DECLARE
+            _source_id INTEGER;
+            _command_map_id INTEGER;
+        BEGIN
+            IF arg_source IN ('technician', 'call_center') THEN
+                -- checked before the source row goes in, a command of a session that is not the latest one leaves
+                -- no row behind. The session row stays locked so it cannot be replaced before this command is in
+                PERFORM 1 FROM {REMOTE_CONTROL_RECORD} WHERE id = arg_remote_id AND is_latest = true FOR SHARE;
+                IF NOT FOUND THEN
+                    decision := 'blocked';
+                    reason_code := 'remote_session_not_latest';
+                    SELECT command_record_id INTO current_record_id FROM {CURRENT_COMMAND};
+                    RETURN;
+                END IF;
+            END IF;
+            -- the source row still goes through its BEFORE INSERT duplicate check (the panel one is done below), 
+            -- the commands_record row and the arbitration are done here instead of in the AFTER INSERT chain
+            PERFORM set_config('{SUBMIT_COMMAND_SETTING}', 'on', true);
+            IF arg_source = 'panel' THEN
+                -- checked here rather than in the BEFORE INSERT trigger, which the deferred mode disables.
+                -- factory_id / machine_id are set for the same reason, the trigger overwrites them in sync mode
+                IF NOT {PANEL_SELECTION_IS_DUPLICATE}(arg_command_str) THEN
+                    INSERT INTO {PANEL_SELECTIONS_RECORD} (command_str, factory_id, machine_id) 
+                    VALUES (
+                        arg_command_str,
+                        (SELECT factory_id FROM {CURRENT_FACTORY_INFO} LIMIT 1),
+                        (SELECT id FROM {MACHINE_INFO} LIMIT 1)
+                    )
+                    RETURNING id INTO _source_id;
+                END IF;
+            ELSIF arg_source = 'technician' THEN
+                INSERT INTO {TECHNICIAN_COMMANDS_RECORD} (command_str, remote_id, technician_id) 
+                VALUES (arg_command_str, arg_remote_id, arg_requester_id)
+                RETURNING id INTO _source_id;
+            ELSIF arg_source = 'call_center' THEN
+                INSERT INTO {CALL_CENTER_COMMANDS_RECORD} (command_str, remote_id, agent_id) 
+                VALUES (arg_command_str, arg_remote_id, arg_requester_id)
+                RETURNING id INTO _source_id;
+            ELSIF arg_source = 'self_stop' THEN
+                INSERT INTO {SELF_URGENT_STOP_COMMANDS_RECORD} DEFAULT VALUES 
+                RETURNING id, command_str INTO _source_id, arg_command_str;
+            ELSE
+                RAISE EXCEPTION 'unknown command source %', arg_source;
+            END IF;
+
+            IF _source_id IS NULL THEN
+                -- dropped by the duplicate check, the same command is still the active one
+                decision := 'blocked';
+                reason_code := 'duplicate';
+            ELSE
+                SELECT id INTO _command_map_id FROM {COMMAND_MAP} WHERE command_str = arg_command_str;
+                INSERT INTO {COMMANDS_RECORD} (
+                    command_map_id, panel_selection_id, technician_command_id, call_center_command_id, self_urgent_stop_id
+                ) VALUES (
+                    _command_map_id,
+                    CASE WHEN arg_source = 'panel' THEN _source_id END,
+                    CASE WHEN arg_source = 'technician' THEN _source_id END,
+                    CASE WHEN arg_source = 'call_center' THEN _source_id END,
+                    CASE WHEN arg_source = 'self_stop' THEN _source_id END
+                ) RETURNING id INTO record_id;
+                -- a self urgent stop generated by the arbitration has to run the whole chain again
+                PERFORM set_config('{SUBMIT_COMMAND_SETTING}', '', true);
+                SELECT a.arbitration_status, a.arbitration_reason INTO decision, reason_code 
+                FROM {ARBITRATE_COMMAND}(record_id) AS a;
+            END IF;
+            PERFORM set_config('{SUBMIT_COMMAND_SETTING}', '', true);
+            SELECT command_record_id INTO current_record_id FROM {CURRENT_COMMAND};
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    ENQUEUE_COMMANDS_RECORD : f"""
+        CREATE OR REPLACE FUNCTION {ENQUEUE_COMMANDS_RECORD}()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            -- once per statement, a bulk load fans out with one INSERT. The group list is rebuilt on every setup
+            INSERT INTO {COMMANDS_QUEUE} (consumer_group, command_record_id)
+            SELECT g.consumer_group, n.id FROM new_rows AS n
+            CROSS JOIN unnest(ARRAY[{', '.join(repr(_group) for _group in COMMANDS_QUEUE_GROUPS)}]::varchar[]) AS g(consumer_group)
+            ORDER BY n.id
+            ON CONFLICT (consumer_group, command_record_id) DO NOTHING;
+            IF FOUND THEN
+                PERFORM pg_notify('{COMMANDS_QUEUE_CHANNEL}', TG_OP);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    PANEL_SELECTION_IS_DUPLICATE : f"""
+        CREATE OR REPLACE FUNCTION {PANEL_SELECTION_IS_DUPLICATE}(
+            arg_command_str VARCHAR, arg_before_id INTEGER DEFAULT NULL, arg_before_timestamp TIMESTAMP DEFAULT NULL
+        ) RETURNS BOOLEAN AS $$
+        DECLARE
+            _latest_data_before_insert {PANEL_SELECTIONS_RECORD}%ROWTYPE;
+            _panel_selection_id INTEGER;
+            _is_latest_activated BOOLEAN;
+        BEGIN
+            -- the panel duplicate check of both modes: compared with the latest panel selection (sync, before the
+            -- insert) or with the one made just before arg_before_id (deferred, the row is already in)
+            IF arg_before_id IS NULL THEN
+                SELECT * INTO _latest_data_before_insert FROM {PANEL_SELECTIONS_RECORD}
+                ORDER BY timestamp DESC, id DESC LIMIT 1;
+            ELSE
+                SELECT * INTO _latest_data_before_insert FROM {PANEL_SELECTIONS_RECORD}
+                WHERE (timestamp, id) < (arg_before_timestamp, arg_before_id)
+                ORDER BY timestamp DESC, id DESC LIMIT 1;
+            END IF;
+            IF NOT FOUND OR NOT COALESCE(arg_command_str = _latest_data_before_insert.command_str, false) THEN
+                RETURN false;
+            END IF;
+            SELECT panel_selection_id INTO _panel_selection_id FROM {COMMANDS_RECORD}
+            ORDER BY timestamp DESC LIMIT 1;
+            SELECT true INTO _is_latest_activated FROM {COMMANDS_RECORD}
+            WHERE panel_selection_id = _latest_data_before_insert.id AND is_activated = true 
+            ORDER BY timestamp DESC LIMIT 1;
+            -- _is_latest_activated can be null if row not found with the condition provided
+            -- _panel_selection_id will be null if not the latest, 
+            -- this condition is required to check, unlike the remote commands 
+            -- because it does not have session period indicator like remote_id
+            RETURN COALESCE(_is_latest_activated AND _panel_selection_id IS NOT NULL, false);
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    ENQUEUE_PANEL_SELECTION_JOB : f"""
+        CREATE OR REPLACE FUNCTION {ENQUEUE_PANEL_SELECTION_JOB}()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            -- deferred mode only (the trigger is disabled otherwise), submit_command() and the bulk loads arbitrate by themselves
+            IF current_setting('{SUBMIT_COMMAND_SETTING}', true) = 'on' 
+            OR current_setting('{BULK_INGEST_SETTING}', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            INSERT INTO {PANEL_SELECTION_JOBS} (panel_selection_id) VALUES (NEW.id);
+            PERFORM pg_notify('{PANEL_SELECTION_JOBS_CHANNEL}', NEW.id::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    PROCESS_PANEL_SELECTION_JOBS : f"""
+        CREATE OR REPLACE FUNCTION {PROCESS_PANEL_SELECTION_JOBS}(arg_limit INTEGER DEFAULT 100)
+        RETURNS TABLE (
+            job_id BIGINT, panel_selection_id INTEGER, command_record_id INTEGER, 
+            status VARCHAR, reason VARCHAR, lag_sec DOUBLE PRECISION
+        ) AS $$
+        #variable_conflict use_column
+        DECLARE
+            _job RECORD;
+            _selection {PANEL_SELECTIONS_RECORD}%ROWTYPE;
+            _factory_id VARCHAR;
+            _machine_id INTEGER;
+            _command_map_id INTEGER;
+            _record_id INTEGER;
+            _status VARCHAR;
+            _reason VARCHAR;
+        BEGIN
+            -- one worker at a time so the selections are applied in the order they were made, NULL limit drains all
+            IF NOT pg_try_advisory_xact_lock(hashtext('{PANEL_SELECTION_JOBS}')) THEN
+                RETURN;
+            END IF;
+            SELECT factory_id INTO _factory_id FROM {CURRENT_FACTORY_INFO};
+            SELECT id INTO _machine_id FROM {MACHINE_INFO};
+            FOR _job IN 
+                SELECT j.id, j.panel_selection_id, j.timestamp FROM {PANEL_SELECTION_JOBS} AS j
+                WHERE j.processed_at IS NULL ORDER BY j.id LIMIT arg_limit
+            LOOP
+                _record_id := NULL;
+                _status := NULL;
+                _reason := NULL;
+                BEGIN
+                    -- what the panel_selections_record BEFORE / AFTER INSERT triggers do in sync mode
+                    UPDATE {PANEL_SELECTIONS_RECORD} SET factory_id = _factory_id, machine_id = _machine_id
+                    WHERE id = _job.panel_selection_id
+                    RETURNING * INTO _selection;
+                    IF NOT FOUND THEN
+                        _status := 'blocked';
+                        _reason := 'not_found';
+                    ELSE
+                        IF {PANEL_SELECTION_IS_DUPLICATE}(_selection.command_str, _selection.id, _selection.timestamp) THEN
+                            _status := 'blocked';
+                            _reason := 'duplicate';
+                        ELSE
+                            SELECT id INTO _command_map_id FROM {COMMAND_MAP} WHERE command_str = _selection.command_str;
+                            PERFORM set_config('{SUBMIT_COMMAND_SETTING}', 'on', true);
+                            INSERT INTO {COMMANDS_RECORD} (command_map_id, panel_selection_id)
+                            VALUES (_command_map_id, _selection.id)
+                            RETURNING id INTO _record_id;
+                            PERFORM set_config('{SUBMIT_COMMAND_SETTING}', '', true);
+                            SELECT a.arbitration_status, a.arbitration_reason INTO _status, _reason 
+                            FROM {ARBITRATE_COMMAND}(_record_id) AS a;
+                        END IF;
+                    END IF;
+                EXCEPTION WHEN OTHERS THEN
+                    -- a failing job is recorded and skipped instead of blocking the ones behind it
+                    _record_id := NULL;
+                    _status := 'error';
+                    _reason := SQLSTATE;
+                    RAISE WARNING 'panel selection job % failed : %', _job.id, SQLERRM;
+                END;
+                UPDATE {PANEL_SELECTION_JOBS} 
+                SET processed_at = CURRENT_TIMESTAMP, command_record_id = _record_id, status = _status, reason = _reason
+                WHERE id = _job.id;
+                job_id := _job.id;
+                panel_selection_id := _job.panel_selection_id;
+                command_record_id := _record_id;
+                status := _status;
+                reason := _reason;
+                lag_sec := EXTRACT(EPOCH FROM (clock_timestamp()::timestamp - _job.timestamp));
+                RETURN NEXT;
+            END LOOP;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    COMMAND_AGGREGATE_STATUS : f"""
+        DO $$
+        BEGIN
+            -- the first version had no pending_nodes, the OUT parameters of a function cannot be replaced
+            IF EXISTS (
+                SELECT 1 FROM pg_proc WHERE proname = '{COMMAND_AGGREGATE_STATUS}' AND NOT 'pending_nodes' = ANY(proargnames)
+            ) THEN
+                DROP FUNCTION {COMMAND_AGGREGATE_STATUS}(INTEGER);
+            END IF;
+        END $$;
+        CREATE OR REPLACE FUNCTION {COMMAND_AGGREGATE_STATUS}(
+            arg_command_record_id INTEGER,
+            OUT status VARCHAR, OUT nodes INTEGER, OUT pending_nodes INTEGER, OUT reported_at TIMESTAMP,
+            OUT error_node_type VARCHAR, OUT error_node_name VARCHAR, OUT error_msg TEXT
+        ) AS $$
+            -- the status of a command over its ROS nodes, from the latest report of each node: error as soon as one
+            -- node is in error, satisfied once every reporting node is and every node type expected by the command 
+            -- (its active command_map_node_config_map rows) has a satisfied node, inprogress while one node is working
+            -- on it (or already done), none otherwise. pending_nodes counts the expected node types not satisfied yet,
+            -- reported_at is the last report taken into account
+            WITH latest AS (
+                SELECT DISTINCT ON (csr.node_type, csr.node_name) csr.id, csr.node_type, csr.node_name, csr.error_msg, 
+                csr.timestamp, vcs.valid_value AS status
+                FROM {COMMAND_STATUS_RECORD} AS csr
+                JOIN {VALID_COMMAND_STATUS} AS vcs ON vcs.id = csr.command_status_id
+                WHERE csr.command_record_id = arg_command_record_id
+                ORDER BY csr.node_type, csr.node_name, csr.id DESC
+            ), pending AS (
+                SELECT count(*)::INTEGER AS pending_nodes FROM (
+                    SELECT DISTINCT m.node_type FROM {COMMAND_MAP_NODE_CONFIG_MAP} AS m
+                    JOIN {COMMANDS_RECORD} AS cr ON cr.command_map_id = m.command_map_id
+                    WHERE cr.id = arg_command_record_id AND m.is_active = true
+                ) AS expected
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM latest AS l WHERE l.node_type = expected.node_type AND l.status = 'satisfied'
+                )
+            )
+            SELECT CASE 
+                WHEN bool_or(l.status = 'error') THEN 'error'
+                WHEN bool_and(l.status = 'satisfied') AND p.pending_nodes = 0 THEN 'satisfied'
+                WHEN bool_or(l.status IN ('inprogress', 'satisfied')) THEN 'inprogress'
+                ELSE 'none' END,
+            count(l.id)::INTEGER,
+            p.pending_nodes,
+            max(l.timestamp),
+            (array_agg(l.node_type ORDER BY l.id DESC) FILTER (WHERE l.status = 'error'))[1],
+            (array_agg(l.node_name ORDER BY l.id DESC) FILTER (WHERE l.status = 'error'))[1],
+            (array_agg(l.error_msg ORDER BY l.id DESC) FILTER (WHERE l.status = 'error'))[1]
+            FROM pending AS p
+            LEFT JOIN latest AS l ON true
+            GROUP BY p.pending_nodes;
+        $$ LANGUAGE sql STABLE;
+    """,
+    APPLY_COMMAND_STATUS_RECORD : f"""
+        CREATE OR REPLACE FUNCTION {APPLY_COMMAND_STATUS_RECORD}()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            _current_record_id INTEGER;
+            _status VARCHAR;
+            _status_id INTEGER;
+        BEGIN
+            -- once per statement, a batch of reports is one UPDATE of current_command at most, with the status
+            -- aggregated over the nodes (command_aggregate_status), not the one of the last node reporting.
+            -- the consecutive failures count the moves into error, a satisfied command resets them.
+            -- FOR UPDATE: a concurrent batch on the same command waits for this one to commit, its aggregate
+            -- (a new snapshot once the lock is granted) then sees these reports too
+            SELECT command_record_id INTO _current_record_id FROM {CURRENT_COMMAND} FOR UPDATE;
+            IF EXISTS (SELECT 1 FROM new_rows WHERE command_record_id = _current_record_id) THEN
+                SELECT a.status INTO _status FROM {COMMAND_AGGREGATE_STATUS}(_current_record_id) AS a;
+                SELECT id INTO _status_id FROM {VALID_COMMAND_STATUS} WHERE valid_value = _status;
+                UPDATE {CURRENT_COMMAND}
+                SET command_status_id = _status_id,
+                    consecutive_failed_command_count = CASE 
+                        WHEN _status = 'error' THEN COALESCE(consecutive_failed_command_count, 0) + 1
+                        WHEN _status = 'satisfied' THEN 0
+                        ELSE consecutive_failed_command_count END
+                WHERE command_record_id = _current_record_id
+                AND command_status_id IS DISTINCT FROM _status_id;
+            END IF;
+            -- one event per command of the batch, with its aggregated status, the node in error if any
+            -- and how long after the command the last report counted came
+            PERFORM pg_notify('{COMMAND_STATUS_CHANNEL}', json_build_object(
+                'command_record_id', c.command_record_id,
+                'status', a.status,
+                'nodes', a.nodes,
+                'pending_nodes', a.pending_nodes,
+                'node_type', a.error_node_type,
+                'node_name', a.error_node_name,
+                'error_msg', a.error_msg,
+                'latency_sec', EXTRACT(EPOCH FROM (a.reported_at - cr.timestamp))
+            )::text)
+            FROM (SELECT DISTINCT command_record_id FROM new_rows) AS c
+            CROSS JOIN LATERAL {COMMAND_AGGREGATE_STATUS}(c.command_record_id) AS a
+            LEFT JOIN {COMMANDS_RECORD} AS cr ON cr.id = c.command_record_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    STOP_TIMED_COMMAND : f"""
+        DO $$
+        BEGIN
+            -- the first version only returned the seconds left, a return type cannot be replaced
+            IF EXISTS (
+                SELECT 1 FROM pg_proc WHERE proname = '{STOP_TIMED_COMMAND}' AND prorettype = 'double precision'::regtype
+            ) THEN
+                DROP FUNCTION {STOP_TIMED_COMMAND}(INTEGER);
+            END IF;
+        END $$;
+        CREATE OR REPLACE FUNCTION {STOP_TIMED_COMMAND}(
+            arg_command_record_id INTEGER,
+            OUT remaining_sec DOUBLE PRECISION, OUT decision VARCHAR, OUT reason_code VARCHAR, OUT record_id INTEGER,
+            OUT is_escalated BOOLEAN
+        ) AS $$
+        DECLARE
+            _current_command {CURRENT_COMMAND}%ROWTYPE;
+            _command_record {COMMANDS_RECORD}%ROWTYPE;
+            _command_map {COMMAND_MAP}%ROWTYPE;
+            _stop_command_str VARCHAR;
+            _remote_id INTEGER;
+            _requester_id VARCHAR;
+            _self_stop_id INTEGER;
+        BEGIN
+            -- remaining_sec is NULL when there is nothing to stop anymore, 0 when the stop got submitted, 
+            -- otherwise the seconds left before the command is due. decision / reason_code are the arbitration
+            -- outcome of the stop, a stop not accepted is escalated to a self urgent stop (is_escalated)
+            is_escalated := false;
+            SELECT * INTO _current_command FROM {CURRENT_COMMAND} 
+            WHERE command_record_id = arg_command_record_id FOR UPDATE;
+            IF NOT FOUND THEN
+                RETURN;
+            END IF;
+            SELECT * INTO _command_record FROM {COMMANDS_RECORD} WHERE id = arg_command_record_id;
+            SELECT * INTO _command_map FROM {COMMAND_MAP} WHERE id = _command_record.command_map_id;
+            IF NOT FOUND OR _command_map.command_duration_sec <= 0 OR _command_map.ros_command_str = 'ALL_STOP' THEN
+                RETURN;
+            END IF;
+            remaining_sec := _command_map.command_duration_sec - EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - _current_command.timestamp));
+            IF remaining_sec > 0 THEN
+                RETURN;
+            END IF;
+            remaining_sec := 0;
+            -- the stop of a timed command is the ALL_STOP of the same mode, e.g. sys_diag_start_all -> sys_diag_stop_all
+            SELECT command_str INTO _stop_command_str FROM {COMMAND_MAP} 
+            WHERE mode_id = _command_map.mode_id AND ros_command_str = 'ALL_STOP'
+            ORDER BY id LIMIT 1;
+            IF _command_record.technician_command_id IS NOT NULL THEN
+                SELECT remote_id, technician_id INTO _remote_id, _requester_id FROM {TECHNICIAN_COMMANDS_RECORD}
+                WHERE id = _command_record.technician_command_id;
+            ELSIF _command_record.call_center_command_id IS NOT NULL THEN
+                SELECT remote_id, agent_id INTO _remote_id, _requester_id FROM {CALL_CENTER_COMMANDS_RECORD}
+                WHERE id = _command_record.call_center_command_id;
+            END IF;
+            IF _stop_command_str IS NOT NULL AND _remote_id IS NOT NULL THEN
+                SELECT s.decision, s.reason_code, s.record_id INTO decision, reason_code, record_id
+                FROM {SUBMIT_COMMAND}(
+                    CASE WHEN _command_record.technician_command_id IS NOT NULL THEN 'technician' ELSE 'call_center' END,
+                    _stop_command_str, _remote_id, _requester_id
+                ) AS s;
+            END IF;
+            -- superseded: blocked, but the self urgent stop generated for it took over
+            IF decision IS NULL OR decision NOT IN ('accepted', 'superseded') THEN
+                -- no stop of that mode, the session that started the command is over or the stop got blocked,
+                -- the machine stops itself. The row goes through the AFTER INSERT chain, which records and arbitrates it
+                is_escalated := decision IS NOT NULL;
+                INSERT INTO {SELF_URGENT_STOP_COMMANDS_RECORD} (invalid_command_record_id) VALUES (arg_command_record_id)
+                RETURNING id INTO _self_stop_id;
+                -- recorded in this transaction, the timestamp prunes the partitions of commands_record
+                SELECT id, CASE WHEN is_activated THEN 'accepted' ELSE 'blocked' END INTO record_id, decision 
+                FROM {COMMANDS_RECORD} WHERE self_urgent_stop_id = _self_stop_id AND timestamp >= LOCALTIMESTAMP;
+                -- escalated, reason_code stays the one the stop got rejected for
+                IF NOT is_escalated THEN
+                    reason_code := 'no_remote_stop';
+                END IF;
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    NOTIFY_COMMAND_CONFIG_CHANGED : f"""
+        CREATE OR REPLACE FUNCTION {NOTIFY_COMMAND_CONFIG_CHANGED}()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            -- once per statement, the payload only says which table changed, the bundles are rebuilt as a whole
+            PERFORM pg_notify('{COMMAND_CONFIG_CHANNEL}', TG_TABLE_NAME);
+            RETURN NULL;
         END;
         $$ LANGUAGE plpgsql;
     """,
@@ -935,11 +2281,15 @@ TRIGGERS_CREATE_SQL_COMMAND_STRING = f"""
         -- Trigger on before new panel_selection_command data inserted to check and insert remote control
         DO $$
         BEGIN
-            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{PANEL_SELECTIONS_RECORD_BEFORE_INSERTED_TRIGGER}') THEN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger WHERE tgname = '{PANEL_SELECTIONS_RECORD_BEFORE_INSERTED_TRIGGER}'
+                AND tgfoid = '{check_before_insert_procedure_name(PANEL_SELECTIONS_RECORD)}'::regproc
+            ) THEN
+                DROP TRIGGER IF EXISTS {PANEL_SELECTIONS_RECORD_BEFORE_INSERTED_TRIGGER} ON {PANEL_SELECTIONS_RECORD};
                 CREATE TRIGGER {PANEL_SELECTIONS_RECORD_BEFORE_INSERTED_TRIGGER}
                 BEFORE INSERT ON {PANEL_SELECTIONS_RECORD}
                 FOR EACH ROW
-                EXECUTE FUNCTION {CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD}();
+                EXECUTE FUNCTION {check_before_insert_procedure_name(PANEL_SELECTIONS_RECORD)}();
             END IF;
         END $$;
 
@@ -954,14 +2304,31 @@ TRIGGERS_CREATE_SQL_COMMAND_STRING = f"""
             END IF;
         END $$;
 
+        -- Trigger on new panel selection data inserted to queue its arbitration, deferred mode only.
+        -- Created disabled (sync mode), later setups leave the mode as it is
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{PANEL_SELECTIONS_RECORD_JOB_TRIGGER}') THEN
+                CREATE TRIGGER {PANEL_SELECTIONS_RECORD_JOB_TRIGGER}
+                AFTER INSERT ON {PANEL_SELECTIONS_RECORD}
+                FOR EACH ROW
+                EXECUTE FUNCTION {ENQUEUE_PANEL_SELECTION_JOB}();
+                ALTER TABLE {PANEL_SELECTIONS_RECORD} DISABLE TRIGGER {PANEL_SELECTIONS_RECORD_JOB_TRIGGER};
+            END IF;
+        END $$;
+
         -- Trigger on before new self_urgent_stop_command data inserted to check and insert remote control
         DO $$
         BEGIN
-            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{SELF_URGENT_STOP_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER}') THEN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger WHERE tgname = '{SELF_URGENT_STOP_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER}'
+                AND tgfoid = '{check_before_insert_procedure_name(SELF_URGENT_STOP_COMMANDS_RECORD)}'::regproc
+            ) THEN
+                DROP TRIGGER IF EXISTS {SELF_URGENT_STOP_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER} ON {SELF_URGENT_STOP_COMMANDS_RECORD};
                 CREATE TRIGGER {SELF_URGENT_STOP_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER}
                 BEFORE INSERT ON {SELF_URGENT_STOP_COMMANDS_RECORD}
                 FOR EACH ROW
-                EXECUTE FUNCTION {CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD}();
+                EXECUTE FUNCTION {check_before_insert_procedure_name(SELF_URGENT_STOP_COMMANDS_RECORD)}();
             END IF;
         END $$;
 
@@ -979,11 +2346,15 @@ TRIGGERS_CREATE_SQL_COMMAND_STRING = f"""
         -- Trigger on before new technician command data inserted to check and insert remote control
         DO $$
         BEGIN
-            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{TECHNICIAN_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER}') THEN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger WHERE tgname = '{TECHNICIAN_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER}'
+                AND tgfoid = '{check_before_insert_procedure_name(TECHNICIAN_COMMANDS_RECORD)}'::regproc
+            ) THEN
+                DROP TRIGGER IF EXISTS {TECHNICIAN_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER} ON {TECHNICIAN_COMMANDS_RECORD};
                 CREATE TRIGGER {TECHNICIAN_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER}
                 BEFORE INSERT ON {TECHNICIAN_COMMANDS_RECORD}
                 FOR EACH ROW
-                EXECUTE FUNCTION {CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD}();
+                EXECUTE FUNCTION {check_before_insert_procedure_name(TECHNICIAN_COMMANDS_RECORD)}();
             END IF;
         END $$;
 
@@ -1001,11 +2372,15 @@ TRIGGERS_CREATE_SQL_COMMAND_STRING = f"""
         -- Trigger on before new call center command data inserted to check and insert remote control
         DO $$
         BEGIN
-            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{CALL_CENTER_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER}') THEN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger WHERE tgname = '{CALL_CENTER_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER}'
+                AND tgfoid = '{check_before_insert_procedure_name(CALL_CENTER_COMMANDS_RECORD)}'::regproc
+            ) THEN
+                DROP TRIGGER IF EXISTS {CALL_CENTER_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER} ON {CALL_CENTER_COMMANDS_RECORD};
                 CREATE TRIGGER {CALL_CENTER_COMMANDS_RECORD_BEFORE_INSERTED_TRIGGER}
                 BEFORE INSERT ON {CALL_CENTER_COMMANDS_RECORD}
                 FOR EACH ROW
-                EXECUTE FUNCTION {CHECK_TO_INSERT_REMOTE_CONTROL_FALSE_RECORD}();
+                EXECUTE FUNCTION {check_before_insert_procedure_name(CALL_CENTER_COMMANDS_RECORD)}();
             END IF;
         END $$;
 
@@ -1041,11 +2416,314 @@ TRIGGERS_CREATE_SQL_COMMAND_STRING = f"""
                 EXECUTE FUNCTION {TURN_OFF_IS_ACTIVE_FLAG}();
             END IF;
         END $$;
+
+        -- Trigger on ros nodes error opened or closed to update the current machine state
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{ROS_NODES_ERROR_RECORD_CHANGED_TRIGGER}') THEN
+                CREATE TRIGGER {ROS_NODES_ERROR_RECORD_CHANGED_TRIGGER}
+                AFTER INSERT OR UPDATE OF error_end_time OR DELETE ON {ROS_NODES_ERROR_RECORD}
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {UPDATE_CURRENT_MACHINE_STATE_FAULTS}();
+            END IF;
+        END $$;
+
+        -- Trigger on ros nodes warning opened or closed to update the current machine state
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{ROS_NODES_WARNING_RECORD_CHANGED_TRIGGER}') THEN
+                CREATE TRIGGER {ROS_NODES_WARNING_RECORD_CHANGED_TRIGGER}
+                AFTER INSERT OR UPDATE OF warning_end_time OR DELETE ON {ROS_NODES_WARNING_RECORD}
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {UPDATE_CURRENT_MACHINE_STATE_FAULTS}();
+            END IF;
+        END $$;
+
+        -- Trigger on before current panel selection updated to upload the new selection again
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{CURRENT_PANEL_SELECTION_BEFORE_UPDATED_TRIGGER}') THEN
+                CREATE TRIGGER {CURRENT_PANEL_SELECTION_BEFORE_UPDATED_TRIGGER}
+                BEFORE UPDATE ON {CURRENT_PANEL_SELECTION}
+                FOR EACH ROW
+                EXECUTE FUNCTION {RESET_IS_UPLOADED_FLAG}();
+            END IF;
+        END $$;
+
+        -- Trigger on ros nodes error opened, closed or deleted to notify the active fault mirrors,
+        -- the first version of it did not fire on DELETE (bit 8 of tgtype) and is replaced
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger WHERE tgname = '{ROS_NODES_ERROR_RECORD_NOTIFY_TRIGGER}' AND tgtype & 8 <> 0
+            ) THEN
+                DROP TRIGGER IF EXISTS {ROS_NODES_ERROR_RECORD_NOTIFY_TRIGGER} ON {ROS_NODES_ERROR_RECORD};
+                CREATE TRIGGER {ROS_NODES_ERROR_RECORD_NOTIFY_TRIGGER}
+                AFTER INSERT OR UPDATE OF error_end_time OR DELETE ON {ROS_NODES_ERROR_RECORD}
+                FOR EACH ROW
+                EXECUTE FUNCTION {NOTIFY_ROS_NODES_ERROR_RECORD}();
+            END IF;
+        END $$;
+
+        -- Trigger on current machine state changed to notify the cached readers
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{CURRENT_MACHINE_STATE_UPDATED_TRIGGER}') THEN
+                CREATE TRIGGER {CURRENT_MACHINE_STATE_UPDATED_TRIGGER}
+                AFTER UPDATE ON {CURRENT_MACHINE_STATE}
+                FOR EACH ROW
+                WHEN (OLD.* IS DISTINCT FROM NEW.*)
+                EXECUTE FUNCTION {NOTIFY_CURRENT_MACHINE_STATE}();
+            END IF;
+        END $$;
+
+        -- Trigger on new remote control session to reschedule the session expiry
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{REMOTE_CONTROL_RECORD_NOTIFY_TRIGGER}') THEN
+                CREATE TRIGGER {REMOTE_CONTROL_RECORD_NOTIFY_TRIGGER}
+                AFTER INSERT ON {REMOTE_CONTROL_RECORD}
+                FOR EACH ROW
+                EXECUTE FUNCTION {NOTIFY_REMOTE_CONTROL_SESSION}();
+            END IF;
+        END $$;
+
+        -- Trigger on current command changed to (re)schedule the deadline of the timed commands
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{CURRENT_COMMAND_UPDATED_TRIGGER}') THEN
+                CREATE TRIGGER {CURRENT_COMMAND_UPDATED_TRIGGER}
+                AFTER UPDATE OF command_record_id ON {CURRENT_COMMAND}
+                FOR EACH ROW
+                WHEN (OLD.command_record_id IS DISTINCT FROM NEW.command_record_id)
+                EXECUTE FUNCTION {NOTIFY_CURRENT_COMMAND}();
+            END IF;
+        END $$;
+
+        -- Trigger on new command status reports to move the current command and notify the waiters, once per statement
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{COMMAND_STATUS_RECORD_INSERTED_TRIGGER}') THEN
+                CREATE TRIGGER {COMMAND_STATUS_RECORD_INSERTED_TRIGGER}
+                AFTER INSERT ON {COMMAND_STATUS_RECORD}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {APPLY_COMMAND_STATUS_RECORD}();
+            END IF;
+        END $$;
+
+        -- Trigger on new commands record rows to queue them for every consumer group, once per statement
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{COMMANDS_RECORD_ENQUEUE_TRIGGER}') THEN
+                CREATE TRIGGER {COMMANDS_RECORD_ENQUEUE_TRIGGER}
+                AFTER INSERT ON {COMMANDS_RECORD}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {ENQUEUE_COMMANDS_RECORD}();
+            END IF;
+        END $$;
+
+        -- Trigger on command map changed to invalidate the cached command config bundles
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{COMMAND_MAP_CHANGED_TRIGGER}') THEN
+                CREATE TRIGGER {COMMAND_MAP_CHANGED_TRIGGER}
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {COMMAND_MAP}
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {NOTIFY_COMMAND_CONFIG_CHANGED}();
+            END IF;
+        END $$;
+
+        -- Trigger on command map node config map changed to invalidate the cached command config bundles
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{COMMAND_MAP_NODE_CONFIG_MAP_CHANGED_TRIGGER}') THEN
+                CREATE TRIGGER {COMMAND_MAP_NODE_CONFIG_MAP_CHANGED_TRIGGER}
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {COMMAND_MAP_NODE_CONFIG_MAP}
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {NOTIFY_COMMAND_CONFIG_CHANGED}();
+            END IF;
+        END $$;
+
+        -- Trigger on ros nodes configs changed to invalidate the cached command config bundles, only the columns
+        -- the bundles are built from count (the uploader flips is_uploaded). The first version of it fired on every
+        -- UPDATE (no column in tgattr) and is replaced
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger WHERE tgname = '{ROS_NODES_CONFIGS_CHANGED_TRIGGER}' AND cardinality(tgattr::int2[]) > 0
+            ) THEN
+                DROP TRIGGER IF EXISTS {ROS_NODES_CONFIGS_CHANGED_TRIGGER} ON {ROS_NODES_CONFIGS};
+                CREATE TRIGGER {ROS_NODES_CONFIGS_CHANGED_TRIGGER}
+                AFTER INSERT OR UPDATE OF node_type, config OR DELETE OR TRUNCATE ON {ROS_NODES_CONFIGS}
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {NOTIFY_COMMAND_CONFIG_CHANGED}();
+            END IF;
+        END $$;
+    """
+
+DATABASE_VIEWS = {
+    # what every consumer group still has to process, with the command it is about
+    COMMANDS_QUEUE_VIEW: f"""
+        CREATE OR REPLACE VIEW {COMMANDS_QUEUE_VIEW} AS
+        SELECT q.id AS queue_id, q.consumer_group, q.attempts, q.visible_at, q.claimed_by, q.last_error,
+        q.visible_at > LOCALTIMESTAMP AS is_claimed,
+        q.command_record_id, cr.command_map_id, cm.command_str, cm.ros_command_str,
+        cr.technician_command_id, cr.call_center_command_id, cr.panel_selection_id, cr.self_urgent_stop_id,
+        cr.is_activated, COALESCE(cr.timestamp, q.timestamp) AS timestamp
+        FROM {COMMANDS_QUEUE} AS q
+        LEFT JOIN {COMMANDS_RECORD} AS cr ON cr.id = q.command_record_id
+        LEFT JOIN {COMMAND_MAP} AS cm ON cm.id = cr.command_map_id
+        WHERE q.is_acked = false;
+    """,
+}
+
+# the statement triggers of the first bulk ingestion version, they built a transition table on every insert
+BULK_TRIGGERS_DROP_SQL_COMMAND_STRING = "".join(
+    f"""
+        DROP TRIGGER IF EXISTS {_table_name}_bulk_inserted_trigger ON {_table_name};
+        DROP FUNCTION IF EXISTS {_table_name}_bulk_inserted();
+    """
+    for _table_name in CHECK_BEFORE_INSERT_SOURCE_TABLES
+)
+
+# the upload tables with rows changed in place once written, current_panel_selection has its own trigger above
+RESET_IS_UPLOADED_TABLES = [
+    MACHINE_REGISTRATION_RECORD,
+    MACHINE_DISABLE_ENABLE_RECORD,
+    REMOTE_CONTROL_RECORD,
+    PANEL_SELECTIONS_RECORD,
+    ROS_NODES_CONFIGS,
+]
+RESET_IS_UPLOADED_TRIGGERS_SQL_COMMAND_STRING = "".join(
+    f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{_table_name}_before_updated_upload_trigger') THEN
+                CREATE TRIGGER {_table_name}_before_updated_upload_trigger
+                BEFORE UPDATE ON {_table_name}
+                FOR EACH ROW
+                EXECUTE FUNCTION {RESET_IS_UPLOADED_FLAG}();
+            END IF;
+        END $$;
     """
+    for _table_name in RESET_IS_UPLOADED_TABLES
+)
+
+''' Data access statements, shared by Testing and the asyncio AsyncTesting '''
+INSERT_MACHINE_REGISTRATION_DATA_SQL = f"""
+    INSERT INTO {MACHINE_REGISTRATION_RECORD} (
+        is_registered, registered_by_id, registered_source_id, factory_id, factory_name, machine_id
+    ) VALUES (%s, %s, %s, %s, %s, %s)
+    RETURNING id;
+"""
+INSERT_MACHINE_DISABLE_ENABLE_DATA_SQL = f"""
+    INSERT INTO {MACHINE_DISABLE_ENABLE_RECORD} (
+        is_disabled, disabled_by_id, disabled_source_id, factory_id, machine_id
+    ) VALUES (%s, %s, %s, %s, %s)
+    RETURNING id;
+"""
+INSERT_MACHINE_REMOTE_CONTROL_DATA_SQL = f"""
+    INSERT INTO {REMOTE_CONTROL_RECORD} (
+        is_remote, session_requested_time_minute, requested_by_id, requested_source_id, factory_id, machine_id
+    ) VALUES (%s, %s, %s, %s, %s, %s)
+    RETURNING id;
+"""
+# dead tuples and HOT update share of the single row tables, from the statistics collector
+SINGLETON_TABLE_BLOAT_SQL = """
+    SELECT s.relname AS table_name, s.n_live_tup, s.n_dead_tup,
+    COALESCE(round(s.n_dead_tup::numeric / NULLIF(s.n_live_tup + s.n_dead_tup, 0), 4), 0) AS dead_ratio,
+    s.n_tup_upd, s.n_tup_hot_upd,
+    COALESCE(round(s.n_tup_hot_upd::numeric / NULLIF(s.n_tup_upd, 0), 4), 0) AS hot_ratio,
+    pg_relation_size(s.relid) AS relation_bytes,
+    s.last_autovacuum, s.autovacuum_count
+    FROM pg_stat_user_tables AS s
+    WHERE s.relname = ANY(%s)
+    ORDER BY s.relname;
+"""
+# the whole command submission in one round trip, see submit_command()
+SUBMIT_COMMAND_SQL = f"""
+    SELECT decision, reason_code, record_id, current_record_id FROM {SUBMIT_COMMAND}(%s, %s, %s, %s);
+"""
+# the operator panel position, a no-op (no row returned) when the panel already is in that position
+UPDATE_CURRENT_PANEL_SELECTION_SQL = f"""
+    UPDATE {CURRENT_PANEL_SELECTION} AS cps
+    SET valid_panel_selection_id = vps.id, timestamp = CURRENT_TIMESTAMP
+    FROM {VALID_PANEL_SELECTION} AS vps
+    WHERE vps.valid_value = %s AND cps.valid_panel_selection_id IS DISTINCT FROM vps.id
+    RETURNING cps.id;
+"""
+# seconds left of every current command with a duration, the same numbers the current_command NOTIFY carries
+CURRENT_TIMED_COMMANDS_SQL = f"""
+    SELECT cc.id, cc.command_record_id,
+    cm.command_duration_sec - EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - cc.timestamp)) AS remaining_sec
+    FROM {CURRENT_COMMAND} AS cc
+    JOIN {COMMANDS_RECORD} AS cr ON cr.id = cc.command_record_id
+    JOIN {COMMAND_MAP} AS cm ON cm.id = cr.command_map_id
+    WHERE cm.command_duration_sec > 0 AND cm.ros_command_str <> 'ALL_STOP';
+"""
+# one serialized bundle per command_map id, the active config of every node type taken from its latest mapping
+COMMAND_CONFIG_BUNDLES_SQL = f"""
+    SELECT cm.id, json_build_object(
+        'command_map_id', cm.id,
+        'command_str', cm.command_str,
+        'ros_command_str', cm.ros_command_str,
+        'mode_id', cm.mode_id,
+        'command_duration_sec', cm.command_duration_sec,
+        'node_configs', COALESCE(
+            (
+                SELECT json_object_agg(m.node_type, m.config) FROM (
+                    SELECT DISTINCT ON (cnm.node_type) cnm.node_type, rnc.config
+                    FROM {COMMAND_MAP_NODE_CONFIG_MAP} AS cnm
+                    JOIN {ROS_NODES_CONFIGS} AS rnc ON rnc.id = cnm.ros_node_config_id
+                    WHERE cnm.command_map_id = cm.id AND cnm.is_active = true
+                    ORDER BY cnm.node_type, cnm.id DESC
+                ) AS m
+            ),
+            '{{}}'::json
+        )
+    )::text AS bundle, cm.command_str, cm.mode_id
+    FROM {COMMAND_MAP} AS cm
+    ORDER BY cm.id;
+"""
+# the valid_command_status values, in the order a command goes through them
+COMMAND_STATUSES = ("none", "inprogress", "satisfied", "error")
+# %s is a list of (command_record_id, status, node_type, node_name, error_msg) tuples, for execute_values
+REPORT_COMMAND_STATUSES_SQL = f"""
+    INSERT INTO {COMMAND_STATUS_RECORD} (command_record_id, command_status_id, node_type, node_name, error_msg)
+    SELECT v.command_record_id, vcs.id, v.node_type, v.node_name, v.error_msg
+    FROM (VALUES %s) AS v (command_record_id, status, node_type, node_name, error_msg)
+    JOIN {VALID_COMMAND_STATUS} AS vcs ON vcs.valid_value = v.status;
+"""
+LATEST_COMMAND_STATUS_SQL = f"""
+    SELECT ids.command_record_id, a.status, a.nodes, a.pending_nodes, a.error_node_type AS node_type, a.error_node_name AS node_name,
+    a.error_msg, EXTRACT(EPOCH FROM (a.reported_at - cr.timestamp)) AS latency_sec
+    FROM unnest(%s::INTEGER[]) AS ids(command_record_id)
+    CROSS JOIN LATERAL {COMMAND_AGGREGATE_STATUS}(ids.command_record_id) AS a
+    LEFT JOIN {COMMANDS_RECORD} AS cr ON cr.id = ids.command_record_id
+    WHERE a.nodes > 0;
+"""
+PURGE_ACKED_COMMANDS_QUEUE_SQL = f"""
+    DELETE FROM {COMMANDS_QUEUE} WHERE is_acked = true AND timestamp < LOCALTIMESTAMP - %s * INTERVAL '1 hour';
+"""
+PROCESS_PANEL_SELECTION_JOBS_SQL = f"""
+    SELECT * FROM {PROCESS_PANEL_SELECTION_JOBS}(%s);
+"""
+PANEL_SELECTION_JOBS_DEPTH_SQL = f"""
+    SELECT count(*) AS pending,
+    COALESCE(EXTRACT(EPOCH FROM (LOCALTIMESTAMP - min(timestamp))), 0)::DOUBLE PRECISION AS oldest_sec
+    FROM {PANEL_SELECTION_JOBS} WHERE processed_at IS NULL;
+"""
+INSERT_COMMAND_SQL = f"""
+    INSERT INTO {COMMANDS_RECORD} (command, machine_config, source, commander_id, panel_selection)
+    VALUES (%s, %s, %s, %s, %s)
+    RETURNING id;
+"""
 
 
 class Testing:
-    def __init__(self) -> None:
+    def __init__(self, db_name=POSTGRES_DB_NAME) -> None:
         self._current_timezone = pytz.timezone(TIMEZONE)
         _log_filename = (
             f"{datetime.now(self._current_timezone).strftime('%d-%m-%Y_%H:%M:%S')}.txt"
@@ -1057,7 +2735,8 @@ class Testing:
             style="{",
         )
         self._machine_id = "machine123"
-        self._conn_str = self._get_valid_connection_str('aii_sortermachine', 'postgres', 'entersecretpassword', POSTGRES_DB_IP)
+        self._conn_str = self._get_valid_connection_str(db_name, 'postgres', 'entersecretpassword', POSTGRES_DB_IP)
+        self._pool = self._create_pool(self._conn_str)
         self._setup_database()
         # self._machine_config = self._get_all_configs()
 
@@ -1070,22 +2749,172 @@ class Testing:
                     continue
 
     def _setup_tables(self, _conn):
-        for _table_name, _comamnd in DATABASE_TABLES.items():
+        _tables = {**DATABASE_TABLES, **PARTITIONED_DATABASE_TABLES} if PARTITION_RECORD_TABLES else DATABASE_TABLES
+        for _table_name, _comamnd in _tables.items():
             if not self.table_exists(_conn, _table_name):
                 with _conn.cursor() as cur:
                     cur.execute(_comamnd)
                     logging.info(f"{_table_name} Table Created.")
             else:
                 logging.debug(f"Table name {_table_name} already exists.")
+        if PARTITION_RECORD_TABLES:
+            self._create_record_partitions(_conn)
+
+    def _create_record_partitions(self, _conn, _months_ahead=PARTITION_PREMAKE_MONTHS):
+        ''' Create the partitions of the current month and the _months_ahead next ones, plus a default partition
+        catching anything outside of them. Run again at least once a month (the retention job does) '''
+        _month_start = datetime.now(self._current_timezone).replace(tzinfo=None, day=1, hour=0, minute=0, second=0, microsecond=0)
+        with _conn.cursor() as cur:
+            for _table_name in PARTITION_KEYS:
+                cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s);", (_table_name,))
+                _row = cur.fetchone()
+                if not _row or not _row[0]:
+                    logging.warning(f"(f) _create_record_partitions - table {_table_name} is not partitioned, skipped")
+                    continue
+                _start = _month_start
+                try:
+                    for _ in range(_months_ahead + 1):
+                        _end = (_start + timedelta(days=32)).replace(day=1)
+                        self._create_record_partition(cur, _table_name, _start, _end)
+                        _start = _end
+                    cur.execute(f"CREATE TABLE IF NOT EXISTS {_table_name}_default PARTITION OF {_table_name} DEFAULT;")
+                except Error as e:
+                    logging.error(f"(f) _create_record_partitions - table {_table_name}, partition of {_start.date()} : {e}")
+
+    def _create_record_partition(self, cur, _table_name, _start, _end):
+        ''' create the [_start, _end) partition of _table_name. Rows of that month already caught by the default
+        partition would make CREATE ... PARTITION OF fail, they are moved into the new partition before attaching it '''
+        _partition_name = partition_name(_table_name, _start)
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL, to_regclass(%s) IS NOT NULL;", (_partition_name, f"{_table_name}_default"))
+        _is_existing, _has_default = cur.fetchone()
+        if _is_existing:
+            return
+        _key = PARTITION_KEYS[_table_name]
+        _bounds = f"FROM ('{_start.isoformat()}') TO ('{_end.isoformat()}')"
+        _is_moving = False
+        if _has_default:
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {_table_name}_default WHERE {_key} >= %s AND {_key} < %s);", (_start, _end))
+            _is_moving = cur.fetchone()[0]
+        if not _is_moving:
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {_partition_name} PARTITION OF {_table_name} FOR VALUES {_bounds};")
+            return
+        # one statement string, one transaction: the rows are never visible twice or lost if the attach fails
+        cur.execute(f"""
+            CREATE TABLE {_partition_name} (LIKE {_table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+            WITH moved AS (
+                DELETE FROM {_table_name}_default WHERE {_key} >= '{_start.isoformat()}' AND {_key} < '{_end.isoformat()}'
+                RETURNING *
+            )
+            INSERT INTO {_partition_name} SELECT * FROM moved;
+            ALTER TABLE {_table_name} ATTACH PARTITION {_partition_name} FOR VALUES {_bounds};
+        """)
+        logging.warning(f"(f) _create_record_partition - rows of {_table_name}_default moved into {_partition_name}")
 
     def _setup_procedures(self, _conn):
         for _procedure_name, _command in PROCEDURES_CREATE_SQL_COMMANDS_DICT.items():
             with _conn.cursor() as cur:
                 cur.execute(_command)
+        for _table_name in CHECK_BEFORE_INSERT_SOURCE_TABLES:
+            with _conn.cursor() as cur:
+                cur.execute(build_check_before_insert_procedure(_table_name))
+                cur.execute(build_bulk_ingest_procedure(_table_name))
+
+    def _setup_views(self, _conn):
+        for _view_name, _command in DATABASE_VIEWS.items():
+            with _conn.cursor() as cur:
+                cur.execute(_command)
+
+    def _setup_indexes(self, _conn):
+        for _index_name, _command in DATABASE_INDEXES.items():
+            with _conn.cursor() as cur:
+                cur.execute(_command)
+
+    def _seq_scans(self, _plan):
+        ''' relation names of every Seq Scan node of an EXPLAIN (FORMAT JSON) plan '''
+        _found = []
+        if _plan.get("Node Type") == "Seq Scan":
+            _found.append(_plan["Relation Name"])
+        for _child in _plan.get("Plans", []):
+            _found += self._seq_scans(_child)
+        return _found
+
+    def _check_query_plans(self, _conn, _min_rows=QUERY_PLAN_SEQ_SCAN_MIN_ROWS):
+        ''' Explain every TRIGGER_HOT_QUERIES entry and return the ones that plan a sequential scan
+        on a table holding more than _min_rows rows (pg_class estimate, run ANALYZE first) '''
+        _violations = []
+        with _conn.cursor() as cur:
+            for _query_name, _query in TRIGGER_HOT_QUERIES.items():
+                cur.execute(f"EXPLAIN (FORMAT JSON) {_query};")
+                _plan = cur.fetchone()[0][0]["Plan"]
+                for _relation in self._seq_scans(_plan):
+                    cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass;", (_relation,))
+                    _rows = cur.fetchone()[0]
+                    if _rows > _min_rows:
+                        _violations.append({"query": _query_name, "table": _relation, "rows": _rows})
+                        logging.warning(f"(f) _check_query_plans - {_query_name} seq scans {_relation} ({_rows} rows)")
+        return _violations
 
     def _setup_triggers(self, _conn):
         with _conn.cursor() as cur:
             cur.execute(TRIGGERS_CREATE_SQL_COMMAND_STRING)
+            cur.execute(BULK_TRIGGERS_DROP_SQL_COMMAND_STRING)
+            cur.execute(RESET_IS_UPLOADED_TRIGGERS_SQL_COMMAND_STRING)
+
+    def _get_panel_arbitration_mode(self, _conn):
+        ''' "deferred" when the job trigger of panel_selections_record is enabled, "sync" otherwise '''
+        with _conn.cursor() as cur:
+            cur.execute("""
+                SELECT tgenabled <> 'D' FROM pg_trigger 
+                WHERE tgname = %s AND tgrelid = to_regclass(%s);
+            """, (PANEL_SELECTIONS_RECORD_JOB_TRIGGER, PANEL_SELECTIONS_RECORD))
+            _row = cur.fetchone()
+        return "deferred" if _row and _row[0] else "sync"
+
+    def _set_panel_arbitration_mode(self, _conn, _mode):
+        ''' Admin operation (panel_arbitration_mode.py), not part of the setup: switch the panel_selections_record
+        triggers between the sync chain and the job queue of the deferred mode (see panel_jobs.py).
+        The switch is one transaction (committed here, also on an autocommit connection) holding panel_selections_record
+        in SHARE ROW EXCLUSIVE mode, so no selection is inserted while neither chain is enabled.
+        Going back to sync first applies the jobs left in the queue, then enables the sync chain '''
+        if _mode not in PANEL_ARBITRATION_MODES:
+            raise ValueError(f"unknown panel arbitration mode {_mode}")
+        _is_deferred = _mode == "deferred"
+        _autocommit = _conn.autocommit
+        if _autocommit:
+            _conn.autocommit = False
+        try:
+            with _conn.cursor() as cur:
+                cur.execute(f"LOCK TABLE {PANEL_SELECTIONS_RECORD} IN SHARE ROW EXCLUSIVE MODE;")
+                # checked under the lock, the ALTER TABLE below would otherwise take it for nothing
+                if self._get_panel_arbitration_mode(_conn) == _mode:
+                    _conn.rollback()
+                    logging.info(f"panel arbitration mode already {_mode}")
+                    return
+                if not _is_deferred:
+                    # waits for a worker busy with a batch, then applies whatever is left in order
+                    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (PANEL_SELECTION_JOBS,))
+                    cur.execute(PROCESS_PANEL_SELECTION_JOBS_SQL, (None,))
+                    if cur.rowcount > 0:
+                        logging.info(f"{cur.rowcount} pending panel selection job(s) applied before switching to sync")
+                for _trigger_name, _is_enabled in (
+                    (PANEL_SELECTIONS_RECORD_JOB_TRIGGER, _is_deferred),
+                    (PANEL_SELECTIONS_RECORD_BEFORE_INSERTED_TRIGGER, not _is_deferred),
+                    (PANEL_SELECTIONS_RECORD_INSERTED_TRIGGER, not _is_deferred),
+                ):
+                    cur.execute(f"ALTER TABLE {PANEL_SELECTIONS_RECORD} {'ENABLE' if _is_enabled else 'DISABLE'} TRIGGER {_trigger_name};")
+            _conn.commit()
+        except Exception:
+            _conn.rollback()
+            raise
+        finally:
+            if _autocommit:
+                _conn.autocommit = True
+        logging.info(f"panel arbitration mode - {_mode}")
+
+    def _refresh_current_machine_state(self, _conn):
+        ''' rebuild the current_machine_state row from the source tables, e.g. after a restore '''
+        with _conn.cursor() as cur:
+            cur.execute(f"SELECT {REFRESH_CURRENT_MACHINE_STATE}();")
 
     def _set_default_tables_row(self, _conn):
         for _table_name in TABLES_WITH_DEFAULT_ROW:            
@@ -1108,6 +2937,42 @@ class Testing:
                 )
             except errors.UniqueViolation as e:
                 logging.warning(f"(f) _set_default_tables_row - table {_table_name} : {e}")
+        self._refresh_current_machine_state(_conn)
+
+    def _setup_singleton_storage(self, _conn):
+        ''' Apply SINGLETON_TABLE_STORAGE to the single row tables. The fillfactor only counts for the pages
+        written after it is set, so a table getting it for the first time is rewritten (one row, done at setup) '''
+        with _conn.cursor() as cur:
+            for _table_name in TABLES_WITH_DEFAULT_ROW:
+                cur.execute("SELECT reloptions FROM pg_class WHERE oid = to_regclass(%s);", (_table_name,))
+                _row = cur.fetchone()
+                if _row is None:
+                    continue
+                _is_new_fillfactor = f"fillfactor={SINGLETON_FILLFACTOR}" not in (_row[0] or [])
+                cur.execute(f"ALTER TABLE {_table_name} SET ({SINGLETON_TABLE_STORAGE});")
+                if _is_new_fillfactor:
+                    cur.execute(f"VACUUM FULL {_table_name};")
+                    logging.info(f"{_table_name} rewritten with fillfactor {SINGLETON_FILLFACTOR}")
+                # an index on an updated column turns the updates into non HOT ones, only the primary key is expected
+                cur.execute("""
+                    SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname <> %s;
+                """, (_table_name, f"{_table_name}_pkey"))
+                for (_index_name,) in cur.fetchall():
+                    logging.warning(f"(f) _setup_singleton_storage - index {_index_name} on {_table_name} may prevent HOT updates")
+
+    def _singleton_table_bloat(self, _conn, _max_dead_ratio=SINGLETON_BLOAT_DEAD_RATIO):
+        ''' dead tuple ratio, HOT update ratio and size of every single row table, 
+        the ones above _max_dead_ratio are logged as warnings '''
+        with _conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(SINGLETON_TABLE_BLOAT_SQL, (TABLES_WITH_DEFAULT_ROW,))
+            _report = [dict(_row) for _row in cur.fetchall()]
+        for _row in _report:
+            if _row["dead_ratio"] > _max_dead_ratio:
+                logging.warning(
+                    f"(f) _singleton_table_bloat - {_row['table_name']} dead ratio {_row['dead_ratio']} "
+                    f"({_row['n_dead_tup']} dead, {_row['relation_bytes']} bytes, hot ratio {_row['hot_ratio']})"
+                )
+        return _report
 
     def _insert_default_valid_types(self, _conn):
         with _conn.cursor() as cur:
@@ -1141,14 +3006,17 @@ class Testing:
     
     def _setup_database(self):
         try:
-            _db_connection = psycopg2.connect(self._conn_str)
-            _db_connection.autocommit = True
-            self._setup_tables(_db_connection)
-            self._setup_procedures(_db_connection)
-            self._setup_triggers(_db_connection)       
-            # self._insert_default_valid_types(_db_connection)
-            # self._set_default_tables_row(_db_connection)
-            _db_connection.close()
+            with self._pool.connection(autocommit=True) as _db_connection:
+                self._setup_tables(_db_connection)
+                self._setup_indexes(_db_connection)
+                self._setup_views(_db_connection)
+                self._setup_procedures(_db_connection)
+                self._setup_triggers(_db_connection)
+                if SINGLETON_STORAGE_PROFILE:
+                    self._setup_singleton_storage(_db_connection)
+                self._refresh_current_machine_state(_db_connection)
+                # self._insert_default_valid_types(_db_connection)
+                # self._set_default_tables_row(_db_connection)
         except Error as e:
             logging.error(f"(f) _setup_db_cursor - An error occured: {e}")
             raise SystemExit(1)
@@ -1168,15 +3036,23 @@ class Testing:
                         # cur.execute(f"CREATE DATABASE {db_name};")
                         cur.execute(_command_str)
                         logging.warning(f"Database {db_name} created successfully.")
+                temp_db_connection.close()
+            # the connection string gets validated by the first connection of the pool
             _conn_str = f"dbname='{db_name}' user='{username}' password='{password}' host='{host}' port='{port}'"
-            db_connection = psycopg2.connect(_conn_str)
-            db_connection.autocommit = True
-            db_connection.close()
             return _conn_str
         except Error as e:
             logging.error(f"(f) _get_valid_connection_str - An error occured: {e}")
             raise SystemExit(1)
 
+    def _create_pool(self, _conn_str):
+        try:
+            return DatabasePool(
+                _conn_str, DB_POOL_MIN_CONN, DB_POOL_MAX_CONN, DB_POOL_CHECKOUT_TIMEOUT, DB_POOL_HEALTH_CHECK_IDLE_SEC
+            )
+        except Error as e:
+            logging.error(f"(f) _create_pool - An error occured: {e}")
+            raise SystemExit(1)
+
     def table_exists(self, _conn, table_name):
         with _conn.cursor() as cur:
             cur.execute(
@@ -1189,90 +3065,189 @@ class Testing:
             )
             return cur.fetchone()[0]
 
-    def _insert_machine_registration_data(self, _conn, _is_registered,_factory_id, _factory_name, _registered_by_id, registered_source_id):
-        with _conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute(
-                f"""
-                    INSERT INTO {MACHINE_REGISTRATION_RECORD} (
-                        is_registered, registered_by_id, registered_source_id, factory_id, factory_name, machine_id
-                    ) VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING id;
-                """, (_is_registered, _registered_by_id, registered_source_id, _factory_id, _factory_name, 1)
-            )
-            _new_id = cur.fetchone()["id"]
-            logging.info(f"new row with id - {_new_id} insert to table {MACHINE_REGISTRATION_RECORD}")
-            _conn.commit()
+    def _insert_machine_registration_data(self, _is_registered,_factory_id, _factory_name, _registered_by_id, registered_source_id):
+        with self._pool.connection() as _conn:
+            with _conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(
+                    INSERT_MACHINE_REGISTRATION_DATA_SQL,
+                    (_is_registered, _registered_by_id, registered_source_id, _factory_id, _factory_name, 1)
+                )
+                _new_id = cur.fetchone()["id"]
+                logging.info(f"new row with id - {_new_id} insert to table {MACHINE_REGISTRATION_RECORD}")
+                _conn.commit()
+        return _new_id
 
-    def _insert_machine_disable_enable_data(self, _conn, _is_disable,_factory_id, _disabled_by_id, disabled_source_id):
-        with _conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute(
-                f"""
-                    INSERT INTO {MACHINE_DISABLE_ENABLE_RECORD} (
-                        is_disabled, disabled_by_id, disabled_source_id, factory_id, machine_id
-                    ) VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id;
-                """, (_is_disable, _disabled_by_id, disabled_source_id, _factory_id, 1)
-            )
-            _new_id = cur.fetchone()["id"]
-            logging.info(f"new row with id - {_new_id} insert to table {MACHINE_DISABLE_ENABLE_RECORD}")
-            _conn.commit()
+    def _insert_machine_disable_enable_data(self, _is_disable,_factory_id, _disabled_by_id, disabled_source_id):
+        with self._pool.connection() as _conn:
+            with _conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(
+                    INSERT_MACHINE_DISABLE_ENABLE_DATA_SQL,
+                    (_is_disable, _disabled_by_id, disabled_source_id, _factory_id, 1)
+                )
+                _new_id = cur.fetchone()["id"]
+                logging.info(f"new row with id - {_new_id} insert to table {MACHINE_DISABLE_ENABLE_RECORD}")
+                _conn.commit()
+        return _new_id
 
-    def _insert_machine_remote_control_data(self, _conn, _is_remote, _requested_time_minute, _factory_id, _requested_by_id, _requested_source_id):
-        with _conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute(
-                f"""
-                    INSERT INTO {REMOTE_CONTROL_RECORD} (
-                        is_remote, session_requested_time_minute, requested_by_id, requested_source_id, factory_id, machine_id
-                    ) VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING id;
-                """, (_is_remote, _requested_time_minute, _requested_by_id, _requested_source_id, _factory_id, 1)
-            )
-            _new_id = cur.fetchone()["id"]
-            logging.info(f"new row with id - {_new_id} insert to table {REMOTE_CONTROL_RECORD}")
-            _conn.commit()
+    def _insert_machine_remote_control_data(self, _is_remote, _requested_time_minute, _factory_id, _requested_by_id, _requested_source_id):
+        with self._pool.connection() as _conn:
+            with _conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(
+                    INSERT_MACHINE_REMOTE_CONTROL_DATA_SQL,
+                    (_is_remote, _requested_time_minute, _requested_by_id, _requested_source_id, _factory_id, 1)
+                )
+                _new_id = cur.fetchone()["id"]
+                logging.info(f"new row with id - {_new_id} insert to table {REMOTE_CONTROL_RECORD}")
+                _conn.commit()
+        return _new_id
+
+    def _submit_command(self, _source, _command_str, _remote_id=None, _requester_id=None):
+        ''' insert a command of _source ('panel', 'technician', 'call_center' or 'self_stop') and arbitrate it
+        in one call. Return {"decision": accepted / blocked / superseded, "reason_code", "record_id", "current_record_id"} '''
+        with self._pool.connection() as _conn:
+            with _conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(SUBMIT_COMMAND_SQL, (_source, _command_str, _remote_id, _requester_id))
+                _result = dict(cur.fetchone())
+                _conn.commit()
+        logging.info(f"command {_command_str} from {_source} - {_result['decision']} ({_result['reason_code']})")
+        return _result
+
+    def _bulk_insert_commands(self, _table_name, _rows):
+        ''' COPY _rows (tuples matching BULK_SOURCE_COLUMNS[_table_name]) into a temp staging table and move them
+        into a command source table with its bulk ingest function, in one transaction. Every command is arbitrated
+        in order like on the row chain, there is no duplicate check on this path, it is meant for replays and fixtures.
+        Return the number of rows loaded '''
+        _columns = BULK_SOURCE_COLUMNS[_table_name]
+        _buffer = io.StringIO()
+        _writer = csv.writer(_buffer)
+        for _values in _rows:
+            # None is written as an empty unquoted field, which COPY csv reads as NULL
+            _writer.writerow(tuple(_values))
+        _buffer.seek(0)
+        with self._pool.connection() as _conn:
+            with _conn.cursor() as cur:
+                cur.execute(f"""
+                    CREATE TEMP TABLE {BULK_STAGING_TABLE} ON COMMIT DROP AS
+                    SELECT {', '.join(_columns)} FROM {_table_name} LIMIT 0;
+                    ALTER TABLE {BULK_STAGING_TABLE} ADD COLUMN ord BIGINT GENERATED ALWAYS AS IDENTITY;
+                """)
+                cur.copy_expert(
+                    f"COPY {BULK_STAGING_TABLE} ({', '.join(_columns)}) FROM STDIN WITH (FORMAT csv);",
+                    _buffer
+                )
+                cur.execute(f"SELECT {bulk_ingest_procedure_name(_table_name)}();")
+                _loaded = cur.fetchone()[0]
+                _conn.commit()
+        logging.info(f"{_loaded} row(s) bulk loaded into {_table_name}")
+        return _loaded
+
+    def _report_command_statuses(self, _statuses):
+        ''' record a batch of status reports in one statement, _statuses being
+        (command_record_id, status, node_type, node_name, error_msg) tuples with status one of COMMAND_STATUSES.
+        The latest report about the current command moves current_command, every command of the batch gets a
+        command_status_changed event (see command_status.CommandStatusWaiter). Return the number of rows written '''
+        _statuses = [tuple(_status) for _status in _statuses]
+        for _status in _statuses:
+            if _status[1] not in COMMAND_STATUSES:
+                raise ValueError(f"unknown command status {_status[1]} for command record {_status[0]}")
+        if not _statuses:
+            return 0
+        with self._pool.connection() as _conn:
+            with _conn.cursor() as cur:
+                execute_values(cur, REPORT_COMMAND_STATUSES_SQL, _statuses, page_size=len(_statuses))
+                _written = cur.rowcount
+                _conn.commit()
+        logging.debug(f"(f) _report_command_statuses - {_written} status report(s) written")
+        return _written
+
+    def _update_current_panel_selection(self, _panel_selection):
+        ''' move the panel to _panel_selection (valid_panel_selection value, e.g. 'aa'), the triggers turn it
+        into a panel_selections_record row and a command. Feed it through panel_debounce.PanelSelectionDebouncer
+        so that only the settled position of a quick turn of the selector gets here '''
+        with self._pool.connection() as _conn:
+            with _conn.cursor() as cur:
+                cur.execute(UPDATE_CURRENT_PANEL_SELECTION_SQL, (_panel_selection,))
+                _is_changed = cur.fetchone() is not None
+                _conn.commit()
+        logging.info(f"panel selection {_panel_selection} - {'updated' if _is_changed else 'unchanged'}")
+        return _is_changed
+
+    def _expire_remote_control_session(self):
+        ''' close the latest remote session when it is over,
+        return the seconds it has left or None when there is no running session '''
+        with self._pool.connection() as _conn:
+            with _conn.cursor() as cur:
+                cur.execute(f"SELECT {EXPIRE_REMOTE_CONTROL_SESSION}();")
+                _remaining_sec = cur.fetchone()[0]
+                _conn.commit()
+        return _remaining_sec
+
+    def _open_ros_node_fault(self, _node_type, _node_name, _error_msg):
+        ''' open a fault for the node, return the id of the open ros_nodes_error_record row (an already open one is reused) '''
+        with self._pool.connection() as _conn:
+            with _conn.cursor() as cur:
+                cur.execute(f"SELECT {OPEN_ROS_NODE_FAULT}(%s, %s, %s);", (_node_type, _node_name, _error_msg))
+                _error_id = cur.fetchone()[0]
+                logging.info(f"fault open for {_node_type}/{_node_name} with id - {_error_id}")
+                _conn.commit()
+        return _error_id
+
+    def _close_ros_node_fault(self, _node_type, _node_name):
+        ''' close the open faults of the node, return how many were closed '''
+        with self._pool.connection() as _conn:
+            with _conn.cursor() as cur:
+                cur.execute(f"SELECT {CLOSE_ROS_NODE_FAULT}(%s, %s);", (_node_type, _node_name))
+                _closed_count = cur.fetchone()[0]
+                logging.info(f"{_closed_count} fault(s) closed for {_node_type}/{_node_name}")
+                _conn.commit()
+        return _closed_count
 
     def _get_all_configs(self):
-        ''' Pull all the rows from the table 
-        and combine as one big dict by using config_name as key'''
+        ''' Pull the config bundles of every command_map in one query,
+        return {command_map_id: serialized bundle}, see config_resolver.ConfigResolver for the cached version '''
         _combined_configs = {}
-        # pull all data
-        # append each indivadual to _combined_configs
+        try:
+            with self._pool.connection(autocommit=True) as _conn:
+                with _conn.cursor() as cur:
+                    cur.execute(COMMAND_CONFIG_BUNDLES_SQL)
+                    for _command_map_id, _bundle, _, _ in cur.fetchall():
+                        _combined_configs[_command_map_id] = _bundle
+        except Error as e:
+            logging.error(f"(f) _get_all_configs - an error occure : {e}")
         return _combined_configs
     
-    def _fetchone_from_current_type_table(self, _conn, _table_name):
+    def _fetchone_from_current_type_table(self, _table_name):
         try:
-            with _conn.cursor(cursor_factory=DictCursor) as cur:
-                cur.execute(f"SELECT * FROM {_table_name};")
-                row = cur.fetchone()
+            with self._pool.connection(autocommit=True) as _conn:
+                with _conn.cursor(cursor_factory=DictCursor) as cur:
+                    cur.execute(f"SELECT * FROM {_table_name};")
+                    row = cur.fetchone()
             return row
         except Error as e:
             logging.error(f"(f) _fetchone_from_current_data - an error occure : {e}")
         
-    def _command_generator(self, _conn, _command, _config, _source, _commander, _panel_selection):
+    def _command_generator(self, _command, _config, _source, _commander, _panel_selection):
         try:
-            with _conn.cursor(cursor_factory=DictCursor) as cur:
-                cur.execute(f"""
-                    INSERT INTO {COMMANDS_RECORD} (command, machine_config, source, commander_id, panel_selection)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id;
-                """, (_command, _config, _source, _commander, _panel_selection))
-                _new_id = cur.fetchone()["id"]
-                logging.info(f"new row with id - {_new_id} insert to table {COMMANDS_RECORD}")
-                _conn.commit()
+            with self._pool.connection() as _conn:
+                with _conn.cursor(cursor_factory=DictCursor) as cur:
+                    cur.execute(INSERT_COMMAND_SQL, (_command, _config, _source, _commander, _panel_selection))
+                    _new_id = cur.fetchone()["id"]
+                    logging.info(f"new row with id - {_new_id} insert to table {COMMANDS_RECORD}")
+                    _conn.commit()
+            return _new_id
         except Error as e:
             logging.error(f"(f) _command_generator - Error inserting data : {e}")
-            _conn.rollback()
 
 if __name__=="__main__":
     testing = Testing()
-    _conn = psycopg2.connect(testing._conn_str)
-    # testing._insert_machine_registration_data(_conn, True, "FACTORY001","Longan Factory 1", "user001", 2)
-    # testing._insert_machine_registration_data(_conn, False, None,None, "user001", 2)
+    # testing._insert_machine_registration_data(True, "FACTORY001","Longan Factory 1", "user001", 2)
+    # testing._insert_machine_registration_data(False, None,None, "user001", 2)
 
-    # testing._insert_machine_disable_enable_data(_conn, True, "FACTORY001", "user001", 2)
-    # testing._insert_machine_disable_enable_data(_conn, False, "FACTORY001", "user001", 2)
+    # testing._insert_machine_disable_enable_data(True, "FACTORY001", "user001", 2)
+    # testing._insert_machine_disable_enable_data(False, "FACTORY001", "user001", 2)
 
-    # testing._insert_machine_remote_control_data(_conn, True, 5, "FACTORY001", "user001", 2)
-    # testing._insert_machine_disable_enable_data(_conn, False, "FACTORY001", "user001", 2)
-    _conn.close()
+    # testing._insert_machine_remote_control_data(True, 5, "FACTORY001", "user001", 2)
+    # testing._insert_machine_disable_enable_data(False, "FACTORY001", "user001", 2)
+    logging.info(f"pool stats - {testing._pool.stats()}")
+    testing._pool.closeall()
     
\ No newline at end of file
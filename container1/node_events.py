@@ -0,0 +1,236 @@
+import logging
+import os
+import threading
+
+from datetime import datetime, timezone
+from psycopg2 import Error
+from psycopg2.extras import execute_values
+
+from main2 import ROS_NODES_ERROR_RECORD, ROS_NODES_WARNING_RECORD
+
+NODE_EVENTS_FLUSH_INTERVAL = float(os.getenv("NODE_EVENTS_FLUSH_INTERVAL", 1.0))
+NODE_EVENTS_MAX_BATCH = int(os.getenv("NODE_EVENTS_MAX_BATCH", 500))
+
+NODE_ERROR = "error"
+NODE_WARNING = "warning"
+
+# event kind -> (table, message column, start time column, end time column)
+NODE_EVENT_TABLES = {
+    NODE_ERROR: (ROS_NODES_ERROR_RECORD, "error_msg", "error_start_time", "error_end_time"),
+    NODE_WARNING: (ROS_NODES_WARNING_RECORD, "warning_msg", "warning_start_time", "warning_end_time"),
+}
+# the per node lock of open_ros_node_fault / close_ros_node_fault, taken in one order so two writers cannot deadlock
+LOCK_ROS_NODES_SQL = """
+    SELECT pg_advisory_xact_lock(s.node_lock) FROM (
+        SELECT DISTINCT hashtext(u.node_type || '/' || u.node_name) AS node_lock
+        FROM unnest(%s::varchar[], %s::varchar[]) AS u(node_type, node_name)
+        ORDER BY node_lock
+    ) AS s;
+"""
+
+
+class NodeEventWriter:
+    ''' Buffer the warnings / errors reported by the ros nodes and write them in batches.
+    An event is keyed by (kind, node_type, node_name, msg), repeats of an already open event are
+    coalesced into the open interval and only open -> closed transitions reach the database:
+    one multi row INSERT per table for the new intervals and one UPDATE per table for the closed ones,
+    every flush_interval_sec. The error rows are written under the per node lock of open_ros_node_fault /
+    close_ros_node_fault. The writer expects to be the only producer for the nodes it reports
+
+        writer = NodeEventWriter(testing._pool).start()
+        writer.report(NODE_WARNING, "camera", "camera_1", "frame dropped")
+        writer.report(NODE_WARNING, "camera", "camera_1", "frame dropped", is_active=False)
+    '''
+    def __init__(self, pool, flush_interval_sec=NODE_EVENTS_FLUSH_INTERVAL, max_batch=NODE_EVENTS_MAX_BATCH) -> None:
+        self._pool = pool
+        self._flush_interval_sec = flush_interval_sec
+        self._max_batch = max_batch
+        self._lock = threading.Lock()
+        # key -> row id of the interval open in the database
+        self._open = {}
+        # key -> start time of the intervals opened since the last flush
+        self._pending_open = {}
+        # key -> end time of intervals open in the database, closed since the last flush
+        self._pending_close = {}
+        # (key, start time, end time) of intervals opened and closed again since the last flush
+        self._pending_intervals = []
+        # keys of the opens / closes being written by the running flush
+        self._in_flight_open = set()
+        self._in_flight_close = set()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats = {
+            "reported": 0,
+            "coalesced": 0,
+            "rows_inserted": 0,
+            "rows_closed": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+        }
+
+    def load_open(self):
+        ''' pick up the intervals left open by a previous run so they get closed instead of opened twice '''
+        with self._pool.connection(autocommit=True) as _conn:
+            with _conn.cursor() as cur:
+                for _kind, (_table_name, _msg_column, _, _end_column) in NODE_EVENT_TABLES.items():
+                    cur.execute(f"""
+                        SELECT id, node_type, node_name, {_msg_column} FROM {_table_name} WHERE {_end_column} IS NULL;
+                    """)
+                    with self._lock:
+                        for _id, _node_type, _node_name, _msg in cur.fetchall():
+                            self._open[(_kind, _node_type, _node_name, _msg)] = _id
+
+    def report(self, _kind, _node_type, _node_name, _msg, is_active=True):
+        ''' record that the event is (still) active or cleared, never blocks on the database '''
+        _key = (_kind, _node_type, _node_name, _msg)
+        _now = datetime.now(timezone.utc)
+        with self._lock:
+            self._stats["reported"] += 1
+            _is_open = (
+                _key in self._pending_open 
+                or _key in self._in_flight_open 
+                or (_key in self._open and _key not in self._in_flight_close)
+            )
+            if is_active:
+                if _key in self._pending_close:
+                    # cleared and raised again before the flush, the interval just stays open
+                    del self._pending_close[_key]
+                    self._stats["coalesced"] += 1
+                elif _is_open:
+                    self._stats["coalesced"] += 1
+                else:
+                    self._pending_open[_key] = _now
+            else:
+                if _key in self._pending_open:
+                    self._pending_intervals.append((_key, self._pending_open.pop(_key), _now))
+                elif _is_open and _key not in self._pending_close:
+                    self._pending_close[_key] = _now
+                else:
+                    self._stats["coalesced"] += 1
+
+    def _insert_rows(self, cur, _kind, _rows):
+        _table_name, _msg_column, _start_column, _end_column = NODE_EVENT_TABLES[_kind]
+        # the end time is always given, the warning table would default it to the insert time
+        return execute_values(
+            cur,
+            f"""
+                INSERT INTO {_table_name} (node_type, node_name, {_msg_column}, {_start_column}, {_end_column})
+                VALUES %s
+                RETURNING id, node_type, node_name, {_msg_column}, {_end_column} IS NULL;
+            """,
+            _rows,
+            page_size=self._max_batch,
+            fetch=True,
+        )
+
+    def _close_rows(self, cur, _kind, _rows):
+        _table_name, _, _, _end_column = NODE_EVENT_TABLES[_kind]
+        execute_values(
+            cur,
+            f"""
+                UPDATE {_table_name} AS t SET {_end_column} = v.end_time
+                FROM (VALUES %s) AS v(id, end_time)
+                WHERE t.id = v.id AND t.{_end_column} IS NULL;
+            """,
+            _rows,
+            template="(%s, %s::timestamptz)",
+            page_size=self._max_batch,
+        )
+
+    def flush(self):
+        ''' write everything buffered so far, return the number of rows written '''
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        with self._lock:
+            _opens, self._pending_open = self._pending_open, {}
+            # a close of an interval whose open is not written yet waits for the next flush
+            _closes = {_key: _end for _key, _end in self._pending_close.items() if _key in self._open}
+            self._pending_close = {_key: _end for _key, _end in self._pending_close.items() if _key not in _closes}
+            _intervals, self._pending_intervals = self._pending_intervals, []
+            _close_ids = {_key: self._open[_key] for _key in _closes}
+            self._in_flight_open = set(_opens)
+            self._in_flight_close = set(_closes)
+        if not (_opens or _closes or _intervals):
+            return 0
+        _opened = {}
+        _written = 0
+        try:
+            with self._pool.connection() as _conn:
+                with _conn.cursor() as cur:
+                    _nodes = list({
+                        _key[1:3] for _key in list(_opens) + list(_closes) + [_interval[0] for _interval in _intervals]
+                        if _key[0] == NODE_ERROR
+                    })
+                    if _nodes:
+                        cur.execute(LOCK_ROS_NODES_SQL, ([_node[0] for _node in _nodes], [_node[1] for _node in _nodes]))
+                    for _kind in NODE_EVENT_TABLES:
+                        _rows = [_key[1:] + (_start, None) for _key, _start in _opens.items() if _key[0] == _kind]
+                        _rows += [_key[1:] + (_start, _end) for _key, _start, _end in _intervals if _key[0] == _kind]
+                        if _rows:
+                            for _id, _node_type, _node_name, _msg, _is_open in self._insert_rows(cur, _kind, _rows):
+                                if _is_open:
+                                    _opened[(_kind, _node_type, _node_name, _msg)] = _id
+                            _written += len(_rows)
+                        _rows = [(_close_ids[_key], _end) for _key, _end in _closes.items() if _key[0] == _kind]
+                        if _rows:
+                            self._close_rows(cur, _kind, _rows)
+                            _written += len(_rows)
+                _conn.commit()
+        except Error as e:
+            logging.error(f"(f) flush - unable to write {len(_opens) + len(_closes) + len(_intervals)} node event(s), retry next flush : {e}")
+            with self._lock:
+                self._stats["flush_errors"] += 1
+                # put the batch back in front of what got reported while it was being written
+                for _key, _start in _opens.items():
+                    if _key in self._pending_close:
+                        self._pending_intervals.append((_key, _start, self._pending_close.pop(_key)))
+                    else:
+                        self._pending_open[_key] = _start
+                for _key, _end in _closes.items():
+                    if _key in self._pending_open:
+                        # raised again meanwhile, the interval never stopped
+                        del self._pending_open[_key]
+                    else:
+                        self._pending_close.setdefault(_key, _end)
+                self._pending_intervals = _intervals + self._pending_intervals
+                self._in_flight_open = set()
+                self._in_flight_close = set()
+            return 0
+        with self._lock:
+            for _key in _closes:
+                self._open.pop(_key, None)
+            self._open.update(_opened)
+            self._in_flight_open = set()
+            self._in_flight_close = set()
+            self._stats["rows_inserted"] += len(_opens) + len(_intervals)
+            self._stats["rows_closed"] += len(_closes)
+            self._stats["flushes"] += 1
+        return _written
+
+    def _run(self):
+        while not self._stop_event.wait(self._flush_interval_sec):
+            self.flush()
+        self.flush()
+
+    def start(self):
+        self.load_open()
+        self._thread = threading.Thread(target=self._run, name="node_event_writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        ''' stop the flush thread, whatever is still buffered gets written first '''
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            _stats = dict(self._stats)
+            _stats["open"] = len(self._open)
+            _stats["pending"] = len(self._pending_open) + len(self._pending_close) + len(self._pending_intervals)
+        return _stats
@@ -0,0 +1,236 @@
+''' Cloud upload of the rows flagged is_uploaded = false
+
+    python outbox.py            # one cycle against a local HTTP stand-in, prints the metrics
+'''
+import json
+import logging
+import os
+import threading
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+from psycopg2 import Error
+from psycopg2.extras import RealDictCursor
+
+from main2 import UPLOAD_TABLES
+from columnar_batch import encode_batch, decode_batch
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 500))
+OUTBOX_INTERVAL = float(os.getenv("OUTBOX_INTERVAL", 5.0))
+OUTBOX_SINK_URL = os.getenv("OUTBOX_SINK_URL", "http://localhost:8080/upload")
+OUTBOX_SINK_TIMEOUT = float(os.getenv("OUTBOX_SINK_TIMEOUT", 10.0))
+
+
+class HttpJsonSink:
+    ''' POST every batch as {"table": ..., "rows": [...]} to url, any non 2xx answer fails the batch '''
+    def __init__(self, url=OUTBOX_SINK_URL, timeout_sec=OUTBOX_SINK_TIMEOUT) -> None:
+        self._url = url
+        self._timeout_sec = timeout_sec
+
+    def send(self, _table_name, _rows):
+        _body = json.dumps({"table": _table_name, "rows": _rows}, default=str).encode()
+        _request = urllib.request.Request(
+            self._url, data=_body, headers={"Content-Type": "application/json"}, method="POST"
+        )
+        # urlopen raises HTTPError for the non 2xx answers
+        with urllib.request.urlopen(_request, timeout=self._timeout_sec) as _response:
+            _response.read()
+
+
+class ColumnarHttpSink(HttpJsonSink):
+    ''' POST every batch in the compressed columnar format (columnar_batch.py), for the metered links '''
+    def send(self, _table_name, _rows):
+        _request = urllib.request.Request(
+            self._url, data=encode_batch(_table_name, _rows),
+            headers={"Content-Type": "application/octet-stream"}, method="POST"
+        )
+        with urllib.request.urlopen(_request, timeout=self._timeout_sec) as _response:
+            _response.read()
+
+
+class OutboxUploader:
+    ''' Stream the not uploaded rows of every UPLOAD_TABLES table to a sink.
+    Rows are read in id order, batch_size at a time (keyset pagination on the *_not_uploaded_idx partial indexes),
+    handed to sink.send(table_name, rows) and marked uploaded in bulk once the sink accepted them.
+    A failed send stops the table for this cycle, the next cycle starts again from the lowest not uploaded id.
+    The sink is anything with a send(table_name, rows) method that raises on failure '''
+    def __init__(self, pool, sink, tables=UPLOAD_TABLES, batch_size=OUTBOX_BATCH_SIZE, interval_sec=OUTBOX_INTERVAL) -> None:
+        self._pool = pool
+        self._sink = sink
+        self._tables = list(tables)
+        self._batch_size = batch_size
+        self._interval_sec = interval_sec
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._metrics = {
+            "cycles": 0,
+            "batches": 0,
+            "rows_uploaded": 0,
+            "send_errors": 0,
+            "db_errors": 0,
+            "last_cycle_sec": 0.0,
+            "last_cycle_rows_per_sec": 0.0,
+            # table -> age in seconds of its oldest not uploaded row, 0 when nothing is waiting
+            "lag_sec": {},
+        }
+
+    def _fetch_batch(self, cur, _table_name, _after_id):
+        # xmin identifies the row version, a row updated in place after the read is not marked (see _mark_uploaded)
+        cur.execute(f"""
+            SELECT xmin::text AS _row_version, * FROM {_table_name}
+            WHERE is_uploaded = false AND id > %s
+            ORDER BY id LIMIT %s;
+        """, (_after_id, self._batch_size))
+        return cur.fetchall()
+
+    def _mark_uploaded(self, cur, _table_name, _ids, _versions):
+        # the id range keeps the update on the primary key index, the version check on the uploaded rows only
+        cur.execute(f"""
+            UPDATE {_table_name} SET is_uploaded = true
+            WHERE id BETWEEN %s AND %s AND is_uploaded = false
+            AND (id, xmin::text) IN (SELECT * FROM unnest(%s::integer[], %s::text[]));
+        """, (_ids[0], _ids[-1], _ids, _versions))
+        return cur.rowcount
+
+    def upload_table(self, _table_name):
+        ''' upload everything currently waiting in one table, return the number of rows marked uploaded '''
+        _uploaded = 0
+        _after_id = 0
+        while not self._stop_event.is_set():
+            try:
+                with self._pool.connection() as _conn:
+                    with _conn.cursor(cursor_factory=RealDictCursor) as cur:
+                        _rows = self._fetch_batch(cur, _table_name, _after_id)
+                    _conn.rollback()
+            except Error as e:
+                logging.error(f"(f) upload_table - unable to read {_table_name} : {e}")
+                with self._lock:
+                    self._metrics["db_errors"] += 1
+                break
+            if not _rows:
+                break
+            _versions = [_row.pop("_row_version") for _row in _rows]
+            _ids = [_row["id"] for _row in _rows]
+            # no pooled connection is held during the send, the xmin check of the mark covers the rows changed meanwhile
+            try:
+                self._sink.send(_table_name, [dict(_row) for _row in _rows])
+            except Exception as e:
+                logging.error(f"(f) upload_table - sink refused {len(_rows)} row(s) of {_table_name} : {e}")
+                with self._lock:
+                    self._metrics["send_errors"] += 1
+                break
+            try:
+                with self._pool.connection() as _conn:
+                    with _conn.cursor() as cur:
+                        _marked = self._mark_uploaded(cur, _table_name, _ids, _versions)
+                    _conn.commit()
+            except Error as e:
+                # sent but not marked, the rows are sent again by the next cycle
+                logging.error(f"(f) upload_table - unable to mark {len(_ids)} row(s) of {_table_name} uploaded : {e}")
+                with self._lock:
+                    self._metrics["db_errors"] += 1
+                break
+            _uploaded += _marked
+            _after_id = _ids[-1]
+            with self._lock:
+                self._metrics["batches"] += 1
+                self._metrics["rows_uploaded"] += _marked
+            if len(_rows) < self._batch_size:
+                break
+        return _uploaded
+
+    def _measure_lag(self):
+        _lag = {}
+        try:
+            with self._pool.connection(autocommit=True) as _conn:
+                with _conn.cursor() as cur:
+                    for _table_name in self._tables:
+                        # lowest not uploaded id is the oldest waiting row, read from the partial index
+                        cur.execute(f"""
+                            SELECT EXTRACT(EPOCH FROM LOCALTIMESTAMP - timestamp) FROM {_table_name}
+                            WHERE is_uploaded = false ORDER BY id LIMIT 1;
+                        """)
+                        _row = cur.fetchone()
+                        _lag[_table_name] = max(float(_row[0]), 0.0) if _row and _row[0] is not None else 0.0
+        except Error as e:
+            logging.error(f"(f) _measure_lag - {e}")
+            with self._lock:
+                self._metrics["db_errors"] += 1
+            return
+        with self._lock:
+            self._metrics["lag_sec"] = _lag
+
+    def run_once(self):
+        ''' one upload cycle over all the tables, return {table: rows uploaded} '''
+        _start = monotonic()
+        _uploaded = {_table_name: self.upload_table(_table_name) for _table_name in self._tables}
+        _elapsed = monotonic() - _start
+        self._measure_lag()
+        with self._lock:
+            self._metrics["cycles"] += 1
+            self._metrics["last_cycle_sec"] = round(_elapsed, 4)
+            self._metrics["last_cycle_rows_per_sec"] = round(sum(_uploaded.values()) / _elapsed, 1) if _elapsed else 0.0
+        return _uploaded
+
+    def metrics(self):
+        with self._lock:
+            _metrics = dict(self._metrics)
+            _metrics["lag_sec"] = dict(self._metrics["lag_sec"])
+        return _metrics
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.run_once()
+            self._stop_event.wait(self._interval_sec)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="outbox_uploader", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        _body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers["Content-Type"] == "application/octet-stream":
+            _table_name, _rows = decode_batch(_body)
+            _batch = {"table": _table_name, "rows": _rows}
+        else:
+            _batch = json.loads(_body)
+        self.server.received.append(_batch)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_local_http_stand_in(port=0):
+    ''' Local stand-in for the cloud endpoint, keeps every received batch in server.received.
+    Return the running server, its url is f"http://localhost:{server.server_port}/upload" '''
+    _server = ThreadingHTTPServer(("localhost", port), _StandInHandler)
+    _server.received = []
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+if __name__=="__main__":
+    from main2 import Testing
+
+    testing = Testing()
+    _server = start_local_http_stand_in()
+    try:
+        uploader = OutboxUploader(testing._pool, HttpJsonSink(f"http://localhost:{_server.server_port}/upload"))
+        logging.info(f"uploaded - {uploader.run_once()}")
+        logging.info(f"outbox metrics - {uploader.metrics()}")
+    finally:
+        _server.shutdown()
+        testing._pool.closeall()
@@ -0,0 +1,22 @@
+''' Show or switch the panel arbitration mode of the database (see PANEL_ARBITRATION_MODES in main2.py)
+
+    python panel_arbitration_mode.py                # current mode
+    python panel_arbitration_mode.py deferred       # switch, run panel_jobs.py alongside
+    python panel_arbitration_mode.py sync           # switch back, the queued jobs are applied first
+'''
+import logging
+import sys
+
+from main2 import Testing, PANEL_ARBITRATION_MODES
+
+if __name__=="__main__":
+    if len(sys.argv) > 1 and sys.argv[1] not in PANEL_ARBITRATION_MODES:
+        raise SystemExit(f"mode should be one of {PANEL_ARBITRATION_MODES}")
+    testing = Testing()
+    try:
+        with testing._pool.connection(autocommit=True) as _conn:
+            if len(sys.argv) > 1:
+                testing._set_panel_arbitration_mode(_conn, sys.argv[1])
+            logging.info(f"panel arbitration mode - {testing._get_panel_arbitration_mode(_conn)}")
+    finally:
+        testing._pool.closeall()
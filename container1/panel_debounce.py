@@ -0,0 +1,73 @@
+import logging
+import os
+import threading
+
+from time import monotonic
+
+PANEL_SELECTION_DEBOUNCE_SEC = float(os.getenv("PANEL_SELECTION_DEBOUNCE_SEC", 0.5))
+# a selector never left alone for this long still gets its latest position through
+PANEL_SELECTION_DEBOUNCE_MAX_SEC = float(os.getenv("PANEL_SELECTION_DEBOUNCE_MAX_SEC", 3.0))
+
+
+class PanelSelectionDebouncer:
+    ''' Coalesce the panel selections made in quick succession (off -> b -> a -> aa in under a second).
+    Every submit() restarts the window_sec timer on the scheduler, on_settled(selection) is only called with the
+    last selection once the selector stayed still for window_sec (or max_delay_sec after the first one of a burst).
+    The selections replaced inside the window are counted as suppressed. window_sec <= 0 disables the debounce
+
+        debouncer = PanelSelectionDebouncer(scheduler, on_settled=testing._update_current_panel_selection)
+        debouncer.submit("aa")
+    '''
+    def __init__(self, scheduler, on_settled, window_sec=PANEL_SELECTION_DEBOUNCE_SEC,
+                 max_delay_sec=PANEL_SELECTION_DEBOUNCE_MAX_SEC, key="panel_selection_debounce") -> None:
+        self._scheduler = scheduler
+        self._on_settled = on_settled
+        self._window_sec = window_sec
+        self._max_delay_sec = max(max_delay_sec, window_sec)
+        self._key = key
+        self._lock = threading.Lock()
+        self._is_pending = False
+        self._latest = None
+        # monotonic time the burst has to settle by, max_delay_sec after its first selection
+        self._burst_deadline = None
+        self._stats = {"submitted": 0, "settled": 0, "suppressed": 0}
+
+    def submit(self, _selection):
+        if self._window_sec <= 0:
+            with self._lock:
+                self._stats["submitted"] += 1
+                self._stats["settled"] += 1
+            self._on_settled(_selection)
+            return
+        with self._lock:
+            self._stats["submitted"] += 1
+            if self._is_pending:
+                self._stats["suppressed"] += 1
+                logging.debug(f"(f) submit - panel selection {self._latest} replaced by {_selection} before settling")
+                _delay_sec = min(self._window_sec, max(self._burst_deadline - monotonic(), 0.0))
+            else:
+                self._is_pending = True
+                self._burst_deadline = monotonic() + self._max_delay_sec
+                _delay_sec = self._window_sec
+            self._latest = _selection
+            self._scheduler.schedule(self._key, _delay_sec, self._settle)
+
+    def _settle(self):
+        with self._lock:
+            if not self._is_pending:
+                return
+            _selection = self._latest
+            self._is_pending = False
+            self._latest = None
+            self._burst_deadline = None
+            self._stats["settled"] += 1
+        self._on_settled(_selection)
+
+    def flush(self):
+        ''' settle the pending selection right away, if any '''
+        self._scheduler.cancel(self._key)
+        self._settle()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
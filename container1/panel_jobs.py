@@ -0,0 +1,102 @@
+''' Arbitration of the panel selections queued by the deferred mode (see panel_arbitration_mode.py)
+
+    python panel_jobs.py        # run the worker until interrupted
+'''
+import logging
+import os
+import threading
+
+from psycopg2 import Error
+from psycopg2.extras import DictCursor
+
+from pg_notify import NotificationService
+from main2 import PANEL_SELECTION_JOBS_CHANNEL, PROCESS_PANEL_SELECTION_JOBS_SQL, PANEL_SELECTION_JOBS_DEPTH_SQL
+
+PANEL_JOBS_BATCH_SIZE = int(os.getenv("PANEL_JOBS_BATCH_SIZE", 100))
+PANEL_JOBS_POLL_INTERVAL = float(os.getenv("PANEL_JOBS_POLL_INTERVAL", 5.0))
+PANEL_JOBS_RETRY_SEC = float(os.getenv("PANEL_JOBS_RETRY_SEC", 1.0))
+
+
+class PanelSelectionJobWorker(NotificationService):
+    ''' Apply the panel_selection_jobs rows in order with process_panel_selection_jobs(), woken up by the NOTIFY
+    of every queued job (and every poll_interval_sec, for the ones queued while not listening).
+    The panel driver's insert only pays for the job row, the duplicate check, the commands_record row and the
+    arbitration happen here. Exports the queue depth and the lag between the insert and its arbitration
+
+        worker = PanelSelectionJobWorker(testing._pool, testing._conn_str).start()
+        worker.stats()      # {"processed", "accepted", "blocked", "superseded", "error", "last_lag_sec", "max_lag_sec", ...}
+    '''
+    def __init__(self, pool, conn_str, batch_size=PANEL_JOBS_BATCH_SIZE, poll_interval_sec=PANEL_JOBS_POLL_INTERVAL,
+                 retry_sec=PANEL_JOBS_RETRY_SEC, on_job=None) -> None:
+        self._pool = pool
+        self._batch_size = batch_size
+        self._poll_interval_sec = poll_interval_sec
+        self._retry_sec = retry_sec
+        # called with every processed job row, e.g. to forward the accepted commands
+        self._on_job = on_job
+        self._lock = threading.Lock()
+        super().__init__(conn_str, [PANEL_SELECTION_JOBS_CHANNEL], "panel_selection_jobs", poll_interval_sec)
+        self._stats = {
+            "processed": 0, "accepted": 0, "blocked": 0, "superseded": 0, "error": 0,
+            "db_errors": 0, "last_lag_sec": None, "max_lag_sec": 0.0,
+        }
+
+    def run_once(self):
+        ''' apply the next batch_size queued jobs, return them as dicts (empty when another worker holds the queue) '''
+        with self._pool.connection() as _conn:
+            with _conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(PROCESS_PANEL_SELECTION_JOBS_SQL, (self._batch_size,))
+                _jobs = [dict(_row) for _row in cur.fetchall()]
+            _conn.commit()
+        with self._lock:
+            for _job in _jobs:
+                self._stats["processed"] += 1
+                self._stats[_job["status"] if _job["status"] in self._stats else "error"] += 1
+                self._stats["last_lag_sec"] = _job["lag_sec"]
+                self._stats["max_lag_sec"] = max(self._stats["max_lag_sec"], _job["lag_sec"])
+        for _job in _jobs:
+            logging.debug(f"(f) run_once - panel selection {_job['panel_selection_id']} {_job['status']} ({_job['reason']}) after {_job['lag_sec']:.3f}s")
+            if self._on_job is not None:
+                self._on_job(_job)
+        return _jobs
+
+    def queue_depth(self):
+        ''' {"pending": jobs not applied yet, "oldest_sec": age of the oldest of them} '''
+        with self._pool.connection(autocommit=True) as _conn:
+            with _conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(PANEL_SELECTION_JOBS_DEPTH_SQL)
+                return dict(cur.fetchone())
+
+    def _poll(self):
+        try:
+            _jobs = self.run_once()
+        except Error as e:
+            logging.error(f"(f) _poll - unable to process the panel selection jobs, retry in {self._retry_sec}s : {e}")
+            with self._lock:
+                self._stats["db_errors"] += 1
+            return self._retry_sec
+        return self._poll_interval_sec if len(_jobs) < self._batch_size else 0.0
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+
+if __name__=="__main__":
+    from main2 import Testing
+
+    testing = Testing()
+    with testing._pool.connection(autocommit=True) as _conn:
+        if testing._get_panel_arbitration_mode(_conn) != "deferred":
+            logging.warning("panel arbitration mode is sync, only the jobs left in the queue will be applied")
+    worker = PanelSelectionJobWorker(testing._pool, testing._conn_str).start()
+    try:
+        while True:
+            threading.Event().wait(60.0)
+            logging.info(f"panel selection jobs - {worker.stats()}, queue {worker.queue_depth()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.stop()
+        testing._pool.closeall()
@@ -0,0 +1,174 @@
+''' Retention of the monthly record partitions (PARTITION_RECORD_TABLES on)
+
+    python partition_retention.py       # one run, meant for a daily cron / systemd timer
+'''
+import gzip
+import logging
+import os
+import re
+
+from datetime import datetime
+from psycopg2 import Error
+
+from main2 import (
+    Testing,
+    PARTITION_KEYS,
+    UPLOAD_TABLES,
+    COMMANDS_RECORD,
+    COMMANDS_QUEUE,
+    COMMANDS_QUEUE_ACKED_RETENTION_HOURS,
+    PURGE_ACKED_COMMANDS_QUEUE_SQL,
+    CURRENT_COMMAND,
+    ROS_NODES_ERROR_RECORD,
+    ROS_NODES_WARNING_RECORD,
+    SOURCE_COMMANDS_RECORD_COLUMNS,
+)
+
+PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", 3))
+PARTITION_EXPORT_DIR = os.getenv("PARTITION_EXPORT_DIR", os.path.join(os.getcwd(), "partition_exports"))
+
+# an interval still open (end time NULL) is an active fault / warning, its partition is kept however old it is
+OPEN_INTERVAL_COLUMNS = {
+    ROS_NODES_ERROR_RECORD: "error_end_time",
+    ROS_NODES_WARNING_RECORD: "warning_end_time",
+}
+
+
+class PartitionRetentionJob:
+    ''' Detach, export (gzip csv in export_dir) and drop the monthly partitions older than retention_months.
+    The acked commands_queue rows are purged on the same run.
+    A partition is kept while it has rows to upload (upload tables), open errors / warnings, or holds the current
+    command (its commands_record row or the source row of it), there are no foreign keys to protect those.
+    Detaching commits on its own so the parent table is locked only for that, the export then reads the
+    detached table and the drop happens after the export file is complete. Partitions left detached by a failed
+    run are picked up again by the next one '''
+    def __init__(self, testing, retention_months=PARTITION_RETENTION_MONTHS, export_dir=PARTITION_EXPORT_DIR) -> None:
+        self._testing = testing
+        self._pool = testing._pool
+        self._retention_months = retention_months
+        self._export_dir = export_dir
+
+    def _cutoff(self):
+        ''' first day of the oldest month to keep '''
+        # same local time as the partition bounds, see Testing._create_record_partitions
+        _now = datetime.now(self._testing._current_timezone).replace(tzinfo=None)
+        _months = _now.year * 12 + _now.month - 1 - self._retention_months
+        return datetime(_months // 12, _months % 12 + 1, 1)
+
+    def _old_partitions(self, cur, _table_name):
+        ''' (partition name, is attached) of the monthly partitions of _table_name older than the cutoff '''
+        cur.execute("""
+            SELECT c.relname, i.inhrelid IS NOT NULL FROM pg_class AS c
+            LEFT JOIN pg_inherits AS i ON i.inhrelid = c.oid AND i.inhparent = to_regclass(%s)
+            WHERE c.relkind = 'r' AND c.relname LIKE %s;
+        """, (_table_name, f"{_table_name}\\_p%"))
+        _cutoff = self._cutoff()
+        _found = []
+        for _name, _is_attached in cur.fetchall():
+            _match = re.fullmatch(rf"{_table_name}_p(\d{{4}})_(\d{{2}})", _name)
+            if _match and datetime(int(_match.group(1)), int(_match.group(2)), 1) < _cutoff:
+                _found.append((_name, _is_attached))
+        return sorted(_found)
+
+    def _export(self, _conn, _partition_name):
+        os.makedirs(self._export_dir, exist_ok=True)
+        _path = os.path.join(self._export_dir, f"{_partition_name}.csv.gz")
+        _tmp_path = f"{_path}.part"
+        with gzip.open(_tmp_path, "wt") as _file:
+            with _conn.cursor() as cur:
+                cur.copy_expert(f"COPY {_partition_name} TO STDOUT WITH (FORMAT csv, HEADER);", _file)
+        _conn.commit()
+        os.replace(_tmp_path, _path)
+        return _path
+
+    def _keep_reason(self, cur, _table_name, _partition_name):
+        ''' why _partition_name cannot be retired yet, None when it can '''
+        if _table_name in UPLOAD_TABLES:
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {_partition_name} WHERE is_uploaded = false);")
+            if cur.fetchone()[0]:
+                return "rows to upload"
+        if _table_name in OPEN_INTERVAL_COLUMNS:
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {_partition_name} WHERE {OPEN_INTERVAL_COLUMNS[_table_name]} IS NULL);")
+            if cur.fetchone()[0]:
+                return "open intervals"
+        if _table_name == COMMANDS_RECORD:
+            cur.execute(f"""
+                SELECT EXISTS (SELECT 1 FROM {_partition_name} AS p JOIN {CURRENT_COMMAND} AS cc ON cc.command_record_id = p.id);
+            """)
+            if cur.fetchone()[0]:
+                return "current command"
+        if _table_name in SOURCE_COMMANDS_RECORD_COLUMNS:
+            cur.execute(f"""
+                SELECT EXISTS (
+                    SELECT 1 FROM {CURRENT_COMMAND} AS cc
+                    JOIN {COMMANDS_RECORD} AS cr ON cr.id = cc.command_record_id
+                    JOIN {_partition_name} AS p ON p.id = cr.{SOURCE_COMMANDS_RECORD_COLUMNS[_table_name]}
+                );
+            """)
+            if cur.fetchone()[0]:
+                return "source of the current command"
+        return None
+
+    def _retire(self, _table_name, _partition_name, _is_attached):
+        with self._pool.connection() as _conn:
+            with _conn.cursor() as cur:
+                # checked in the transaction of the detach, nothing new gets written into a past month
+                _keep_reason = self._keep_reason(cur, _table_name, _partition_name)
+                if _keep_reason is not None:
+                    logging.info(f"(f) _retire - {_partition_name} kept, {_keep_reason}")
+                    _conn.rollback()
+                    return False
+                if _is_attached:
+                    cur.execute(f"ALTER TABLE {_table_name} DETACH PARTITION {_partition_name};")
+                if _table_name == COMMANDS_RECORD:
+                    # no foreign key from the queue, its rows would outlive the commands they are about
+                    cur.execute(f"DELETE FROM {COMMANDS_QUEUE} WHERE command_record_id IN (SELECT id FROM {_partition_name});")
+            _conn.commit()
+            _path = self._export(_conn, _partition_name)
+            with _conn.cursor() as cur:
+                cur.execute(f"DROP TABLE {_partition_name};")
+            _conn.commit()
+        logging.info(f"partition {_partition_name} exported to {_path} and dropped")
+        return True
+
+    def run_once(self):
+        ''' retire what is due and make sure the coming months have their partitions, return the retired names '''
+        _retired = []
+        with self._pool.connection(autocommit=True) as _conn:
+            try:
+                self._testing._create_record_partitions(_conn)
+            except Error as e:
+                # the retirement does not depend on it, the next run tries again
+                logging.error(f"(f) run_once - unable to create the coming partitions : {e}")
+            with _conn.cursor() as cur:
+                _candidates = [
+                    (_table_name, _name, _is_attached)
+                    for _table_name in PARTITION_KEYS
+                    for _name, _is_attached in self._old_partitions(cur, _table_name)
+                ]
+        for _table_name, _name, _is_attached in _candidates:
+            try:
+                if self._retire(_table_name, _name, _is_attached):
+                    _retired.append(_name)
+            except (Error, OSError) as e:
+                logging.error(f"(f) run_once - unable to retire {_name}, retry next run : {e}")
+        self._purge_commands_queue()
+        return _retired
+
+    def _purge_commands_queue(self):
+        ''' delete the commands_queue rows acked more than COMMANDS_QUEUE_ACKED_RETENTION_HOURS ago '''
+        try:
+            with self._pool.connection(autocommit=True) as _conn:
+                with _conn.cursor() as cur:
+                    cur.execute(PURGE_ACKED_COMMANDS_QUEUE_SQL, (COMMANDS_QUEUE_ACKED_RETENTION_HOURS,))
+                    logging.info(f"{cur.rowcount} acked {COMMANDS_QUEUE} row(s) purged")
+        except Error as e:
+            logging.error(f"(f) _purge_commands_queue - unable to purge {COMMANDS_QUEUE}, retry next run : {e}")
+
+
+if __name__=="__main__":
+    testing = Testing()
+    try:
+        logging.info(f"retired partitions - {PartitionRetentionJob(testing).run_once()}")
+    finally:
+        testing._pool.closeall()
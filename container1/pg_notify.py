@@ -0,0 +1,153 @@
+import logging
+import select
+import threading
+import time
+import psycopg2
+
+from psycopg2 import Error
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+
+class NotificationListener:
+    ''' Dedicated LISTEN connection for postgres NOTIFY events.
+    The connection is opened outside of any pool because a LISTEN session
+    has to stay open for as long as we want to receive the events '''
+    def __init__(self, conn_str, channels, on_connect=None, on_disconnect=None, reconnect_delay_sec=1.0,
+                 max_reconnect_delay_sec=30.0) -> None:
+        self._conn_str = conn_str
+        self._channels = list(channels)
+        # called after every (re)connect so the caller can catch up on anything missed while not listening
+        self._on_connect = on_connect
+        # called when the session is lost, the events sent until the next connect are missed
+        self._on_disconnect = on_disconnect
+        self._reconnect_delay_sec = reconnect_delay_sec
+        self._max_reconnect_delay_sec = max_reconnect_delay_sec
+        self._conn = None
+        self.reconnect_count = 0
+
+    def connect(self):
+        self._conn = psycopg2.connect(self._conn_str)
+        self._conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with self._conn.cursor() as cur:
+            for _channel in self._channels:
+                cur.execute(f'LISTEN "{_channel}";')
+        logging.info(f"(f) connect - listening on {self._channels}")
+        if self._on_connect is not None:
+            self._on_connect()
+
+    def close(self):
+        if self._conn is not None and not self._conn.closed:
+            self._conn.close()
+        self._conn = None
+
+    def _reconnect(self):
+        _delay = self._reconnect_delay_sec
+        while True:
+            self.close()
+            try:
+                self.connect()
+                break
+            except Error as e:
+                logging.error(f"(f) _reconnect - unable to listen on {self._channels}, retry in {_delay}s : {e}")
+                time.sleep(_delay)
+                _delay = min(_delay * 2, self._max_reconnect_delay_sec)
+        self.reconnect_count += 1
+
+    def wait(self, timeout_sec):
+        ''' Block until at least one notification arrives or timeout_sec elapsed.
+        Return the list of received psycopg2 Notify objects (empty on timeout) '''
+        if self._conn is None or self._conn.closed:
+            self._reconnect()
+        try:
+            if not self._conn.notifies:
+                if select.select([self._conn], [], [], timeout_sec) == ([], [], []):
+                    return []
+                self._conn.poll()
+        except (Error, OSError, ValueError) as e:
+            logging.error(f"(f) wait - listen connection lost : {e}")
+            if self._on_disconnect is not None:
+                self._on_disconnect()
+            self._reconnect()
+            return []
+        _notifies = list(self._conn.notifies)
+        self._conn.notifies.clear()
+        return _notifies
+
+
+class NotificationService:
+    ''' Background thread handling the events of a NotificationListener, the base of the listening services.
+    Subclasses implement _handle(notify) for every event (a bad payload raises ValueError / KeyError and falls back
+    to reload()) and _reload() to read their state again, which happens after every (re)connect of the LISTEN session.
+    From a lost session or a failed reload until the next successful reload the state may have missed events,
+    is_stale() tells so and the reload is retried on every turn of the thread. _poll() runs on every turn before
+    the wait and returns how long to wait for events
+
+        class Mirror(NotificationService):
+            def _reload(self): ...              # raises psycopg2.Error when the database cannot be read
+            def _handle(self, _notify): ...
+    '''
+    def __init__(self, conn_str, channels, name, listen_timeout_sec=5.0) -> None:
+        self._name = name
+        self._listen_timeout_sec = listen_timeout_sec
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._listener = NotificationListener(conn_str, channels, on_connect=self.reload, on_disconnect=self._set_stale)
+        # nothing is loaded before the first connect
+        self._is_stale = True
+        self.reloads = 0
+        self.reload_failures = 0
+        self.notifications = 0
+
+    def _reload(self):
+        pass
+
+    def _handle(self, _notify):
+        pass
+
+    def _poll(self):
+        return self._listen_timeout_sec
+
+    def _set_stale(self):
+        self._is_stale = True
+
+    def is_stale(self):
+        ''' True while the state may have missed events (not loaded yet, session lost or the last reload failed) '''
+        return self._is_stale
+
+    def reload(self):
+        ''' read the state again, return False (and stay stale) when the database could not be read '''
+        try:
+            self._reload()
+        except Error as e:
+            logging.error(f"(f) reload - {self._name} unable to reload, its state is stale : {e}")
+            self._is_stale = True
+            self.reload_failures += 1
+            return False
+        self._is_stale = False
+        self.reloads += 1
+        return True
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if self._is_stale:
+                self.reload()
+            for _notify in self._listener.wait(self._poll()):
+                try:
+                    self._handle(_notify)
+                    self.notifications += 1
+                except (ValueError, KeyError) as e:
+                    logging.warning(f"(f) _run - bad {_notify.channel} payload, reload instead : {e}")
+                    self.reload()
+        self._listener.close()
+
+    def start(self):
+        self._listener.connect()
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
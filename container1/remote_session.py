@@ -0,0 +1,69 @@
+''' Remote control session expiry
+
+    python remote_session.py        # run the scheduler until interrupted
+'''
+import logging
+import os
+import threading
+
+from psycopg2 import Error
+
+from pg_notify import NotificationService
+from main2 import EXPIRE_REMOTE_CONTROL_SESSION, REMOTE_SESSION_CHANNEL
+
+# upper bound of a sleep, also the retry delay after a database error
+REMOTE_SESSION_MAX_SLEEP = float(os.getenv("REMOTE_SESSION_MAX_SLEEP", 60.0))
+
+
+class RemoteSessionExpiryScheduler(NotificationService):
+    ''' Close the running remote control session at its session_expired_time.
+    The scheduler asks expire_remote_control_session() how long the latest session has left and sleeps on its
+    LISTEN connection until then, a new remote_control_record row (NOTIFY) wakes it up to reschedule.
+    Expiry does not depend on commands being inserted anymore, an idle machine leaves remote control on time
+
+        scheduler = RemoteSessionExpiryScheduler(testing._pool, testing._conn_str).start()
+    '''
+    def __init__(self, pool, conn_str, max_sleep_sec=REMOTE_SESSION_MAX_SLEEP) -> None:
+        self._pool = pool
+        self._max_sleep_sec = max_sleep_sec
+        super().__init__(conn_str, [REMOTE_SESSION_CHANNEL], "remote_session_expiry", max_sleep_sec)
+        self.checks = 0
+
+    def check_once(self):
+        ''' expire the latest session when it is due, return the seconds to sleep before the next check '''
+        try:
+            with self._pool.connection() as _conn:
+                with _conn.cursor() as cur:
+                    cur.execute(f"SELECT {EXPIRE_REMOTE_CONTROL_SESSION}();")
+                    _remaining_sec = cur.fetchone()[0]
+                _conn.commit()
+        except Error as e:
+            logging.error(f"(f) check_once - unable to expire the remote control session : {e}")
+            return self._max_sleep_sec
+        self.checks += 1
+        if _remaining_sec is None:
+            return self._max_sleep_sec
+        return min(max(_remaining_sec, 0.0), self._max_sleep_sec)
+
+    def _poll(self):
+        _sleep_sec = self.check_once()
+        logging.debug(f"(f) _poll - next remote session check in {_sleep_sec:.3f}s")
+        return _sleep_sec
+
+    def _handle(self, _notify):
+        # a new session (or the row closing the old one), the next turn checks again right away
+        pass
+
+
+if __name__=="__main__":
+    from main2 import Testing
+
+    testing = Testing()
+    scheduler = RemoteSessionExpiryScheduler(testing._pool, testing._conn_str).start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop()
+        testing._pool.closeall()
@@ -0,0 +1,26 @@
+''' Report the bloat of the single row current_* tables, exit code 1 when one of them is above the dead ratio
+
+    python singleton_bloat.py                        # POSTGRES_DB_NAME, SINGLETON_BLOAT_DEAD_RATIO
+    python singleton_bloat.py aii_sortermachine 0.5
+'''
+import logging
+import sys
+
+from main2 import Testing, POSTGRES_DB_NAME, SINGLETON_BLOAT_DEAD_RATIO
+
+if __name__=="__main__":
+    _max_dead_ratio = float(sys.argv[2]) if len(sys.argv) > 2 else SINGLETON_BLOAT_DEAD_RATIO
+    testing = Testing(sys.argv[1] if len(sys.argv) > 1 else POSTGRES_DB_NAME)
+    try:
+        with testing._pool.connection(autocommit=True) as _conn:
+            _report = testing._singleton_table_bloat(_conn, _max_dead_ratio)
+    finally:
+        testing._pool.closeall()
+    for _row in _report:
+        logging.info(
+            f"{_row['table_name']} - live {_row['n_live_tup']}, dead {_row['n_dead_tup']} (ratio {_row['dead_ratio']}), "
+            f"hot updates {_row['n_tup_hot_upd']}/{_row['n_tup_upd']} (ratio {_row['hot_ratio']}), "
+            f"{_row['relation_bytes']} bytes, {_row['autovacuum_count']} autovacuum(s), last {_row['last_autovacuum']}"
+        )
+    if any(_row["dead_ratio"] > _max_dead_ratio for _row in _report):
+        raise SystemExit(1)
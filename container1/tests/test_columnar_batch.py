@@ -0,0 +1,64 @@
+import json
+import zlib
+
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from columnar_batch import MAGIC, encode_batch, decode_batch, decode_batch_columns
+
+ROWS = [
+    {"id": 101, "factory_id": "FACTORY001", "timestamp": datetime(2024, 6, 10, 6, 13, 20), "is_activated": True,
+     "error_msg": None, "ratio": 0.25, "command_config": {"speed": 3}},
+    {"id": 102, "factory_id": "FACTORY001", "timestamp": datetime(2024, 6, 10, 6, 13, 20, 250000), "is_activated": False,
+     "error_msg": "timeout", "ratio": None, "command_config": None},
+    {"id": None, "factory_id": "FACTORY001", "timestamp": None, "is_activated": True,
+     "error_msg": None, "ratio": 1.5, "command_config": [1, 2]},
+    {"id": 90, "factory_id": "FACTORY001", "timestamp": datetime(2024, 6, 9, 23, 59, 59, 999999), "is_activated": True,
+     "error_msg": None, "ratio": -2.0, "command_config": {}},
+]
+
+
+def _encodings(_blob):
+    _document = json.loads(zlib.decompress(_blob[len(MAGIC):]))
+    return {_column["name"]: _column["enc"] for _column in _document["columns"]}
+
+
+def test_round_trip():
+    _blob = encode_batch("commands_record", ROWS)
+    assert _blob.startswith(MAGIC)
+    assert decode_batch(_blob) == ("commands_record", ROWS)
+
+
+def test_column_encodings():
+    assert _encodings(encode_batch("commands_record", ROWS)) == {
+        "id": "delta",
+        "factory_id": "dict",
+        "timestamp": "time_delta",
+        "is_activated": "plain",
+        "error_msg": "plain",
+        "ratio": "plain",
+        "command_config": "plain",
+    }
+
+
+def test_columns_view():
+    _table_name, _columns = decode_batch_columns(encode_batch("commands_record", ROWS))
+    assert _table_name == "commands_record"
+    assert _columns["id"] == [101, 102, None, 90]
+    assert _columns["error_msg"] == [None, "timeout", None, None]
+
+
+def test_other_types_come_back_as_str():
+    _, _rows = decode_batch(encode_batch("t", [{"amount": Decimal("1.10")}]))
+    assert _rows == [{"amount": "1.10"}]
+
+
+def test_empty_batch():
+    assert decode_batch(encode_batch("commands_record", [])) == ("commands_record", [])
+
+
+def test_not_a_batch():
+    with pytest.raises(ValueError):
+        decode_batch(b"not a batch")
@@ -0,0 +1,42 @@
+from latency_histogram import LatencyHistogram
+
+
+def test_empty_histogram_has_no_percentiles():
+    histogram = LatencyHistogram([1.0, 2.0, 5.0])
+    assert histogram.percentile(50) is None
+    assert histogram.snapshot()["mean_sec"] is None
+
+
+def test_percentiles_are_the_upper_bound_of_their_bucket():
+    histogram = LatencyHistogram([5.0, 1.0, 2.0])
+    for _ in range(90):
+        histogram.observe(0.5)
+    for _ in range(9):
+        histogram.observe(1.5)
+    histogram.observe(12.0)
+    assert histogram.percentile(50) == 1.0
+    assert histogram.percentile(90) == 1.0
+    assert histogram.percentile(95) == 2.0
+    assert histogram.percentile(99) == 2.0
+    # the last bucket has no upper bound, the max stands for it
+    assert histogram.percentile(100) == 12.0
+
+
+def test_bucket_bounds_are_inclusive():
+    histogram = LatencyHistogram([1.0, 2.0])
+    histogram.observe(1.0)
+    histogram.observe(2.0)
+    histogram.observe(2.5)
+    assert histogram.snapshot()["buckets"] == {"le_1.0": 1, "le_2.0": 1, "inf": 1}
+
+
+def test_snapshot():
+    histogram = LatencyHistogram([1.0, 2.0])
+    histogram.observe(0.5)
+    histogram.observe(1.5)
+    _snapshot = histogram.snapshot()
+    assert _snapshot["count"] == 2
+    assert _snapshot["mean_sec"] == 1.0
+    assert _snapshot["max_sec"] == 1.5
+    assert _snapshot["p50_sec"] == 1.0
+    assert _snapshot["p99_sec"] == 2.0
@@ -0,0 +1,93 @@
+import panel_debounce
+
+from panel_debounce import PanelSelectionDebouncer
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Scheduler:
+    ''' keeps the last timer of every key instead of running it '''
+    def __init__(self):
+        self.timers = {}
+        self.delays = []
+
+    def schedule(self, _key, _delay_sec, _callback, *_args):
+        self.timers[_key] = (_callback, _args)
+        self.delays.append(_delay_sec)
+
+    def cancel(self, _key):
+        return self.timers.pop(_key, None) is not None
+
+    def fire(self, _key="panel_selection_debounce"):
+        _callback, _args = self.timers.pop(_key)
+        _callback(*_args)
+
+
+def _debouncer(monkeypatch, window_sec=0.5, max_delay_sec=1.0):
+    _clock = _Clock()
+    monkeypatch.setattr(panel_debounce, "monotonic", _clock)
+    _scheduler = _Scheduler()
+    _settled = []
+    return PanelSelectionDebouncer(_scheduler, _settled.append, window_sec, max_delay_sec), _scheduler, _clock, _settled
+
+
+def test_only_the_last_selection_of_a_burst_settles(monkeypatch):
+    debouncer, scheduler, clock, settled = _debouncer(monkeypatch)
+    for _selection in ("b", "a", "aa"):
+        debouncer.submit(_selection)
+        clock.now += 0.1
+    scheduler.fire()
+    assert settled == ["aa"]
+    assert debouncer.stats() == {"submitted": 3, "settled": 1, "suppressed": 2}
+
+
+def test_a_burst_settles_by_the_max_delay(monkeypatch):
+    debouncer, scheduler, clock, settled = _debouncer(monkeypatch, window_sec=0.5, max_delay_sec=1.0)
+    debouncer.submit("b")
+    clock.now += 0.4
+    debouncer.submit("a")
+    clock.now += 0.4
+    debouncer.submit("aa")
+    # 0.2s left before the max delay of the burst, the window is cut short
+    assert scheduler.delays[:2] == [0.5, 0.5]
+    assert abs(scheduler.delays[2] - 0.2) < 1e-9
+    clock.now += 1.0
+    debouncer.submit("off")
+    assert scheduler.delays[3] == 0.0
+    scheduler.fire()
+    assert settled == ["off"]
+
+
+def test_a_new_burst_gets_the_full_window_again(monkeypatch):
+    debouncer, scheduler, clock, settled = _debouncer(monkeypatch)
+    debouncer.submit("b")
+    scheduler.fire()
+    clock.now += 5.0
+    debouncer.submit("a")
+    assert scheduler.delays == [0.5, 0.5]
+    scheduler.fire()
+    assert settled == ["b", "a"]
+
+
+def test_flush_settles_right_away(monkeypatch):
+    debouncer, scheduler, _, settled = _debouncer(monkeypatch)
+    debouncer.submit("b")
+    debouncer.flush()
+    assert settled == ["b"]
+    assert scheduler.timers == {}
+    debouncer.flush()
+    assert settled == ["b"]
+
+
+def test_no_window_disables_the_debounce(monkeypatch):
+    debouncer, scheduler, _, settled = _debouncer(monkeypatch, window_sec=0.0)
+    debouncer.submit("b")
+    debouncer.submit("a")
+    assert settled == ["b", "a"]
+    assert scheduler.delays == []
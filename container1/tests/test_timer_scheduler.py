@@ -0,0 +1,84 @@
+import threading
+
+from time import monotonic
+
+from timer_scheduler import TimerScheduler
+
+
+def _noop():
+    pass
+
+
+def test_schedule_again_supersedes_the_earlier_timer():
+    scheduler = TimerScheduler()
+    _fired = []
+    scheduler.schedule("key", 60.0, _fired.append, "first")
+    scheduler.schedule_at("key", monotonic() - 1.0, _fired.append, "second")
+    with scheduler._condition:
+        _due, _wait_sec = scheduler._next_due()
+    assert [_timer[3] for _, _timer, _ in _due] == [("second",)]
+    assert _wait_sec is None
+    assert scheduler.superseded == 1
+    assert scheduler.pending() == 0
+
+
+def test_cancel_drops_the_timer():
+    scheduler = TimerScheduler()
+    scheduler.schedule_at("key", monotonic() - 1.0, _noop)
+    assert scheduler.is_pending("key")
+    assert scheduler.cancel("key") is True
+    assert scheduler.cancel("key") is False
+    assert scheduler.cancelled == 1
+    with scheduler._condition:
+        _due, _wait_sec = scheduler._next_due()
+    assert _due == []
+    assert _wait_sec is None
+    assert scheduler._heap == []
+
+
+def test_next_due_reports_the_wait_until_the_nearest_deadline():
+    scheduler = TimerScheduler()
+    scheduler.schedule("late", 60.0, _noop)
+    scheduler.schedule("soon", 10.0, _noop)
+    with scheduler._condition:
+        _due, _wait_sec = scheduler._next_due()
+    assert _due == []
+    assert 0.0 < _wait_sec <= 10.0
+    assert 0.0 < scheduler.remaining("soon") <= 10.0
+    assert scheduler.remaining("missing") is None
+
+
+def test_superseded_entries_are_compacted():
+    scheduler = TimerScheduler()
+    for _ in range(1000):
+        scheduler.schedule("key", 60.0, _noop)
+    assert scheduler.pending() == 1
+    assert scheduler.superseded == 999
+    # the heap never keeps more than twice the live timers plus the slack before compacting
+    assert len(scheduler._heap) <= 2 * scheduler.pending() + 64 + 1
+
+
+def test_timers_fire_on_the_scheduler_thread():
+    scheduler = TimerScheduler().start()
+    _fired = threading.Event()
+    try:
+        scheduler.schedule(None, 0.01, _fired.set)
+        scheduler.schedule("cancelled", 0.01, lambda: (_ for _ in ()).throw(AssertionError("cancelled timer fired")))
+        scheduler.cancel("cancelled")
+        assert _fired.wait(5.0)
+    finally:
+        scheduler.stop()
+    assert scheduler.fired == 1
+    assert scheduler.callback_errors == 0
+
+
+def test_stop_right_after_start_is_not_missed():
+    # no timer, the thread waits without a timeout, a stop() landing before that wait must still end it
+    for _ in range(50):
+        scheduler = TimerScheduler().start()
+        _thread = scheduler._thread
+        _stopper = threading.Thread(target=scheduler.stop, daemon=True)
+        _stopper.start()
+        _stopper.join(5.0)
+        assert not _stopper.is_alive()
+        assert not _thread.is_alive()
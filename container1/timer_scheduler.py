@@ -0,0 +1,133 @@
+import heapq
+import itertools
+import logging
+import threading
+
+from time import monotonic
+
+
+class TimerScheduler:
+    ''' Many timers on one thread. Deadlines sit in a heap keyed by monotonic time, scheduling again under
+    the same key supersedes the earlier timer and cancel(key) drops it, both in O(log n) (stale heap entries are
+    skipped when they come up and the heap is compacted once they outnumber the live ones).
+    Callbacks run on the scheduler thread, they should hand anything slow over to another thread
+
+        scheduler = TimerScheduler().start()
+        scheduler.schedule("panel_delayed_start", 3.0, _callback, _arg)
+        scheduler.cancel("panel_delayed_start")
+    '''
+    def __init__(self, name="timer_scheduler") -> None:
+        self._name = name
+        self._condition = threading.Condition()
+        # (deadline, sequence) ordered entries, sequence also tells the superseded entries apart
+        self._heap = []
+        # key -> (sequence, deadline, callback, args)
+        self._timers = {}
+        self._sequence = itertools.count()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.fired = 0
+        self.superseded = 0
+        self.cancelled = 0
+        self.callback_errors = 0
+        # how late the fired callbacks started, in seconds
+        self.max_lateness_sec = 0.0
+
+    def schedule_at(self, _key, _deadline, _callback, *_args):
+        ''' run _callback(*_args) at the monotonic() time _deadline, None as key means a timer of its own.
+        Return the key '''
+        with self._condition:
+            _sequence = next(self._sequence)
+            if _key is None:
+                _key = ("timer", _sequence)
+            elif _key in self._timers:
+                self.superseded += 1
+            self._timers[_key] = (_sequence, _deadline, _callback, _args)
+            heapq.heappush(self._heap, (_deadline, _sequence, _key))
+            if len(self._heap) > 2 * len(self._timers) + 64:
+                self._compact()
+            # wake the thread up when the new deadline is the nearest one
+            if self._heap[0][1] == _sequence:
+                self._condition.notify()
+        return _key
+
+    def schedule(self, _key, _delay_sec, _callback, *_args):
+        ''' run _callback(*_args) in _delay_sec seconds, see schedule_at '''
+        return self.schedule_at(_key, monotonic() + _delay_sec, _callback, *_args)
+
+    def cancel(self, _key):
+        ''' drop the timer of _key, return False when there was none pending '''
+        with self._condition:
+            if self._timers.pop(_key, None) is None:
+                return False
+            self.cancelled += 1
+            return True
+
+    def is_pending(self, _key):
+        with self._condition:
+            return _key in self._timers
+
+    def remaining(self, _key):
+        ''' seconds left before the timer of _key fires, None when there is no such timer '''
+        with self._condition:
+            _timer = self._timers.get(_key)
+        return None if _timer is None else max(_timer[1] - monotonic(), 0.0)
+
+    def pending(self):
+        with self._condition:
+            return len(self._timers)
+
+    def _compact(self):
+        self._heap = [(_deadline, _sequence, _key) for _key, (_sequence, _deadline, _, _) in self._timers.items()]
+        heapq.heapify(self._heap)
+
+    def _next_due(self):
+        ''' pop the due timers, return (due list, seconds until the next deadline or None) '''
+        _now = monotonic()
+        _due = []
+        while self._heap:
+            _deadline, _sequence, _key = self._heap[0]
+            _timer = self._timers.get(_key)
+            if _timer is None or _timer[0] != _sequence:
+                # cancelled or superseded
+                heapq.heappop(self._heap)
+                continue
+            if _deadline > _now:
+                return _due, _deadline - _now
+            heapq.heappop(self._heap)
+            del self._timers[_key]
+            _due.append((_key, _timer, _now - _deadline))
+        return _due, None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                # checked under the condition, a stop() between the check and the wait cannot be missed
+                if self._stop_event.is_set():
+                    return
+                _due, _wait_sec = self._next_due()
+                if not _due:
+                    self._condition.wait(_wait_sec)
+                    continue
+            for _key, (_, _, _callback, _args), _lateness_sec in _due:
+                self.fired += 1
+                self.max_lateness_sec = max(self.max_lateness_sec, _lateness_sec)
+                try:
+                    _callback(*_args)
+                except Exception as e:
+                    self.callback_errors += 1
+                    logging.error(f"(f) _run - timer {_key} failed : {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        ''' stop the thread, the timers still pending are dropped '''
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
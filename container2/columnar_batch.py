@@ -0,0 +1,119 @@
+''' Compressed, column oriented batch format used between the edge (container1) and the cloud (container2).
+The same file lives in both containers, keep the two copies identical.
+
+A batch is MAGIC followed by a zlib compressed JSON document
+
+    {"v": 1, "table": "commands_record", "count": 3, "columns": [
+        {"name": "id", "enc": "delta", "nulls": [], "data": [101, 1, 1]},
+        {"name": "factory_id", "enc": "dict", "nulls": [], "dict": ["FACTORY001"], "data": [0, 0, 0]},
+        {"name": "timestamp", "enc": "time_delta", "nulls": [], "data": [1718000000000000, 250000, 1000]},
+        ...
+    ]}
+
+nulls holds the row positions of the NULL values, data only holds the values that are not NULL.
+    delta       integers, first value then the differences to the previous value
+    time_delta  naive datetimes as microseconds since 1970-01-01, delta encoded
+    dict        strings, indexes into the dict list of distinct values
+    plain       anything else JSON can carry (bool, float, json columns, ...), Decimal and other types as str
+'''
+import json
+import zlib
+
+from datetime import datetime, timedelta
+
+MAGIC = b"AIICB1"
+FORMAT_VERSION = 1
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _is_int(_value):
+    return isinstance(_value, int) and not isinstance(_value, bool)
+
+
+def _is_naive_datetime(_value):
+    return isinstance(_value, datetime) and _value.tzinfo is None
+
+
+def _deltas(_values):
+    _previous = 0
+    _data = []
+    for _value in _values:
+        _data.append(_value - _previous)
+        _previous = _value
+    return _data
+
+
+def _undeltas(_data):
+    _value = 0
+    _values = []
+    for _delta in _data:
+        _value += _delta
+        _values.append(_value)
+    return _values
+
+
+def _encode_column(_name, _values):
+    _nulls = [_i for _i, _value in enumerate(_values) if _value is None]
+    _present = [_value for _value in _values if _value is not None]
+    _column = {"name": _name, "nulls": _nulls}
+    if _present and all(_is_int(_value) for _value in _present):
+        _column.update(enc="delta", data=_deltas(_present))
+    elif _present and all(_is_naive_datetime(_value) for _value in _present):
+        _micros = [(_value - _EPOCH) // timedelta(microseconds=1) for _value in _present]
+        _column.update(enc="time_delta", data=_deltas(_micros))
+    elif _present and all(isinstance(_value, str) for _value in _present) and len(set(_present)) * 2 <= len(_present):
+        _dictionary = list(dict.fromkeys(_present))
+        _index = {_value: _i for _i, _value in enumerate(_dictionary)}
+        _column.update(enc="dict", dict=_dictionary, data=[_index[_value] for _value in _present])
+    else:
+        _column.update(enc="plain", data=_present)
+    return _column
+
+
+def _decode_column(_column, _count):
+    _enc = _column["enc"]
+    if _enc == "delta":
+        _present = _undeltas(_column["data"])
+    elif _enc == "time_delta":
+        _present = [_EPOCH + timedelta(microseconds=_micros) for _micros in _undeltas(_column["data"])]
+    elif _enc == "dict":
+        _present = [_column["dict"][_i] for _i in _column["data"]]
+    elif _enc == "plain":
+        _present = _column["data"]
+    else:
+        raise ValueError(f"unknown column encoding {_enc}")
+    _nulls = set(_column["nulls"])
+    _values = iter(_present)
+    return [None if _i in _nulls else next(_values) for _i in range(_count)]
+
+
+def encode_batch(_table_name, _rows, level=6):
+    ''' rows (list of dicts sharing the same keys, e.g. from a RealDictCursor) -> compressed batch bytes '''
+    _names = list(_rows[0].keys()) if _rows else []
+    _document = {
+        "v": FORMAT_VERSION,
+        "table": _table_name,
+        "count": len(_rows),
+        "columns": [_encode_column(_name, [_row[_name] for _row in _rows]) for _name in _names],
+    }
+    _payload = json.dumps(_document, separators=(",", ":"), default=str).encode()
+    return MAGIC + zlib.compress(_payload, level)
+
+
+def decode_batch_columns(_blob):
+    ''' compressed batch bytes -> (table name, {column name: list of values}) '''
+    if not _blob.startswith(MAGIC):
+        raise ValueError("not a columnar batch")
+    _document = json.loads(zlib.decompress(_blob[len(MAGIC):]))
+    if _document["v"] != FORMAT_VERSION:
+        raise ValueError(f"unsupported columnar batch version {_document['v']}")
+    _count = _document["count"]
+    return _document["table"], {_column["name"]: _decode_column(_column, _count) for _column in _document["columns"]}
+
+
+def decode_batch(_blob):
+    ''' compressed batch bytes -> (table name, list of row dicts) '''
+    _table_name, _columns = decode_batch_columns(_blob)
+    _names = list(_columns)
+    _count = len(_columns[_names[0]]) if _names else 0
+    return _table_name, [{_name: _columns[_name][_i] for _name in _names} for _i in range(_count)]
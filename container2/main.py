@@ -7,12 +7,14 @@ import pytz
 import psycopg2
 
 from psycopg2 import OperationalError, Error, errors
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
 
 from enum import Enum
 from time import monotonic
 from datetime import datetime
 
+from columnar_batch import decode_batch_columns
+
 TIMEZONE = os.getenv("TIMEZONE", "Asia/Bangkok")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 # POSTGRES_SERVICE_NAME = os.getenv("POSTGRES_SERVICE_NAME","localhost")
@@ -912,6 +914,36 @@ class Testing:
             return row
         except Error as e:
             logging.error(f"(f) _fetchone_from_current_data - an error occure : {e}")
+
+    def _get_table_columns(self, _conn, _table_name):
+        with _conn.cursor() as cur:
+            cur.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_name = %s;", (_table_name,)
+            )
+            return {row[0] for row in cur.fetchall()}
+
+    def _load_columnar_batch(self, _conn, _blob, table_name=None, keep_ids=False):
+        ''' Insert an edge columnar batch (see columnar_batch.py) into a DM table, the batch table name by default.
+        Only the columns the target table has are loaded, the edge ids are dropped unless keep_ids.
+        Return the number of inserted rows '''
+        _batch_table_name, _columns = decode_batch_columns(_blob)
+        _table_name = table_name or _batch_table_name
+        _target_columns = self._get_table_columns(_conn, _table_name)
+        if not _target_columns:
+            raise ValueError(f"(f) _load_columnar_batch - table {_table_name} does not exist")
+        _names = [_name for _name in _columns if _name in _target_columns and (keep_ids or _name != "id")]
+        if not _names:
+            return 0
+        _rows = list(zip(*[
+            [json.dumps(_value) if isinstance(_value, (dict, list)) else _value for _value in _columns[_name]]
+            for _name in _names
+        ]))
+        with _conn.cursor() as cur:
+            execute_values(
+                cur, f"INSERT INTO {_table_name} ({', '.join(_names)}) VALUES %s;", _rows, page_size=1000
+            )
+        logging.info(f"{len(_rows)} row(s) of {_batch_table_name} loaded to table {_table_name}")
+        return len(_rows)
     
 
 if __name__=="__main__":